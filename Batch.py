@@ -0,0 +1,123 @@
+import csv
+import io
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+import ImageSlicer
+import ImageUtils
+from Handlers import FORMAT_ALIASES, SUFFIXES, SlicerError, handleppm, handlegeneric
+
+# Columns (csv) or keys (json) a manifest entry can have. Only source, type and method are required
+MANIFEST_FIELDS = ['source', 'destination', 'type', 'method', 'name']
+
+
+def read_manifest(path):
+    """
+    Reads a batch manifest. A manifest is either a json file holding a list of objects, or a csv file with a header
+    row, and every entry describes one slicing job using the keys in MANIFEST_FIELDS. These mirror the command line
+    flags: source (-s), destination (-d), type (-t), method (-m, 1 or 2) and name (-n)
+    :param path: Path to a .json or .csv manifest
+    :return: A list of job dictionaries holding every key in MANIFEST_FIELDS (missing ones are empty strings)
+    """
+    with open(path, newline='') as file:
+        if os.path.splitext(path)[1].lower() == '.json':
+            entries = json.load(file)
+        else:
+            entries = list(csv.DictReader(file))
+    jobs = []
+    for entry in entries:
+        jobs.append({field: str(entry.get(field) or '').strip() for field in MANIFEST_FIELDS})
+    return jobs
+
+
+def run_job(job):
+    """
+    Runs a single slicing job. Nothing a job does can stop the batch it's in: every error, including the job's own
+    SlicerErrors, is caught and reported in the result, and everything the handlers print is captured
+    :param job: A job dictionary (see read_manifest)
+    :return: A result dictionary holding the job, whether it succeeded ('ok'), the error message if it didn't, the path
+    of the sliced image if it did, the number of source bytes it sliced, how long it took and what it printed ('log')
+    """
+    result = {'job': job, 'ok': False, 'error': None, 'output': None, 'bytes': 0, 'seconds': 0.0, 'log': ''}
+    log = io.StringIO()
+    start = time.perf_counter()
+    try:
+        imgtype = job['type'].lower()
+        if imgtype not in ImageSlicer.VALID_FORMATS:
+            raise SlicerError('Invalid image format provided: {}'.format(job['type']))
+        if job['method'] not in ImageSlicer.METHOD_KEY:
+            raise SlicerError('Invalid method provided: {}'.format(job['method']))
+        left_right = ImageSlicer.METHOD_KEY[job['method']]
+        # Unnamed jobs are named after their source directory, so jobs in the same batch don't overwrite each other
+        filename = job['name'] or os.path.basename(os.path.normpath(job['source'])) + '_sliced'
+        with redirect_stdout(log):
+            if imgtype == 'ppm':
+                result['output'] = handleppm(filename, job['source'], job['destination'], left_right)[1]
+                suffixes = ('.ppm',)
+            else:
+                save_dir, name = handlegeneric(filename, job['source'], job['destination'], imgtype, left_right)
+                # The generic handler saves jpgs and tifs with the .jpeg and .tiff extensions
+                extension = FORMAT_ALIASES.get(imgtype, imgtype)
+                result['output'] = os.path.join(save_dir, name + '.' + extension)
+                suffixes = SUFFIXES.get(extension, ('.' + imgtype,))
+        result['bytes'] = sum(os.path.getsize(img) for img in
+                              ImageUtils.retrieve_valid_files(job['source'], False, *suffixes))
+        result['ok'] = True
+    except SlicerError as e:
+        result['error'] = str(e)
+    except Exception:
+        result['error'] = traceback.format_exc()
+    result['seconds'] = time.perf_counter() - start
+    result['log'] = log.getvalue()
+    return result
+
+
+def run_batch(jobs, workers=None):
+    """
+    Runs a batch of slicing jobs in a pool of processes. Each worker process imports Pillow once and then runs job after
+    job, so a batch of many small jobs doesn't pay for interpreter startup over and over
+    :param jobs: List of job dictionaries (see read_manifest)
+    :param workers: Number of worker processes. Defaults to the number of cpus
+    :return: A tuple of the list of results (see run_job), in the order of the jobs, and a summary (see summarize)
+    """
+    start = time.perf_counter()
+    if workers == 1 or len(jobs) <= 1:
+        results = [run_job(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(run_job, jobs))
+    return results, summarize(results, time.perf_counter() - start)
+
+
+def summarize(results, seconds):
+    """
+    Sums up the results of a batch
+    :param results: List of results (see run_job)
+    :param seconds: Wall time the whole batch took
+    :return: A dictionary holding the number of jobs, how many succeeded and failed, the wall time and the throughput in
+    jobs per second and megabytes of source images per second
+    """
+    succeeded = [result for result in results if result['ok']]
+    megabytes = sum(result['bytes'] for result in succeeded) / 1e6
+    return {'jobs': len(results), 'succeeded': len(succeeded), 'failed': len(results) - len(succeeded),
+            'seconds': seconds, 'jobs_per_second': len(results) / seconds if seconds else 0.0,
+            'megabytes_per_second': megabytes / seconds if seconds else 0.0}
+
+
+def print_report(results, summary):
+    """
+    Prints the outcome of every job in a batch followed by the batch's summary
+    :param results: List of results (see run_job)
+    :param summary: The batch's summary (see summarize)
+    """
+    for i, result in enumerate(results):
+        if result['ok']:
+            print('[{}] OK     {} -> {} ({:.2f}s)'.format(i, result['job']['source'], result['output'],
+                                                         result['seconds']))
+        else:
+            print('[{}] FAILED {}: {}'.format(i, result['job']['source'], result['error']))
+    print('{jobs} jobs ({succeeded} succeeded, {failed} failed) in {seconds:.2f}s: {jobs_per_second:.2f} jobs/s, '
+          '{megabytes_per_second:.2f} MB/s'.format(**summary))
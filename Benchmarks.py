@@ -0,0 +1,337 @@
+import getopt
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import PIL
+try:
+    # Only available on unix-like systems. Without it or /proc the peak memory of a case is not recorded
+    import resource
+except ImportError:
+    resource = None
+from PIL import Image
+import ImageUtils
+import PPMCodec
+import SanityChecks
+
+# Formats the suite generates source images in. P3 and P6 go through the ppm pipeline, everything else through the
+# generic one
+SUITE_FORMATS = ['P3', 'P6', 'png', 'jpeg']
+# Stages every case is split into. The generic pipeline decodes while it blends, so its cases have no separate decode
+# stage
+STAGES = ['scan', 'validate', 'decode', 'blend', 'encode']
+# Default settings of a suite run. The baseline shipped with the project was recorded with these
+DEFAULTS = {'width': 1000, 'height': 750, 'count': 4, 'repeat': 3, 'formats': SUITE_FORMATS}
+
+HELP = "-h - Prints this\n" \
+       "-w <width> - Width of the generated images (default 1000)\n" \
+       "-e <height> - Height of the generated images (default 750)\n" \
+       "-c <count> - Number of images to generate per set (default 4)\n" \
+       "-r <repeat> - Number of times each case is timed. The best time is reported (default 3)\n" \
+       "-f <formats> - Comma separated source formats to run (default " + ','.join(SUITE_FORMATS) + ")\n" \
+       "-o <file> - Write the results to a json file\n" \
+       "-x <file> - Compare the results against an earlier json file (e.g. benchmark_baseline.json)\n" \
+       "-p - Run the ppm format comparison (every P3/P6 source and output combination) instead of the suite"
+
+
+def synthetic_pixels(width, height, seed=0):
+    """
+    Makes pseudo random rgb pixel data that is smooth enough for png and jpeg to compress somewhat like a photo would:
+    a low resolution noise image scaled up, with a little full resolution noise on top. The same seed always produces
+    the same pixels
+    :param width: Width of the image
+    :param height: Height of the image
+    :param seed: Seed for the pixel data
+    :return: Bytes holding width * height * 3 samples
+    """
+    rng = random.Random(seed)
+    small = (max(1, width // 16), max(1, height // 16))
+    base = Image.frombytes('RGB', small, rng.randbytes(small[0] * small[1] * 3)).resize((width, height),
+                                                                                       Image.BILINEAR)
+    grain = Image.frombytes('RGB', (width, height), rng.randbytes(width * height * 3))
+    return Image.blend(base, grain, 0.1).tobytes()
+
+
+def write_synthetic_ppm(path, width, height, magic_no='P3', seed=0):
+    """
+    Writes a ppm image filled with synthetic pixels (see synthetic_pixels)
+    :param path: Where to write the image
+    :param width: Width of the image
+    :param height: Height of the image
+    :param magic_no: 'P3' for an ascii image or 'P6' for a binary one
+    :param seed: Seed for the pixel data
+    """
+    pixels = synthetic_pixels(width, height, seed)
+    with open(path, 'wb') as file:
+        PPMCodec.write_ppm(file, {'magic_number': magic_no, 'width': width, 'height': height, 'depth': 255}, pixels)
+
+
+def generate_set(directory, width, height, count, fmt='P3'):
+    """
+    Writes a set of synthetic images into a directory
+    :param directory: Directory to write the images to
+    :param width: Width of the images
+    :param height: Height of the images
+    :param count: Number of images
+    :param fmt: 'P3' or 'P6' for ppm images, or any format Pillow can write (e.g. 'png' or 'jpeg')
+    :return: List of paths to the images, in slicing order
+    """
+    paths = []
+    extension = 'ppm' if fmt in PPMCodec.PPM_FORMATS else fmt.lower()
+    for i in range(count):
+        path = os.path.join(directory, 'source{:04d}.{}'.format(i, extension))
+        if fmt in PPMCodec.PPM_FORMATS:
+            write_synthetic_ppm(path, width, height, fmt, seed=i)
+        else:
+            Image.frombytes('RGB', (width, height), synthetic_pixels(width, height, i)).save(path, fmt)
+        paths.append(path)
+    return paths
+
+
+def generate_ppm_set(directory, width, height, count, magic_no='P3'):
+    """
+    Writes a set of synthetic ppm images into a directory (see generate_set)
+    :return: List of paths to the images, in slicing order
+    """
+    return generate_set(directory, width, height, count, magic_no)
+
+
+def best_time(function, repeat):
+    """
+    Times a function a number of times
+    :param function: A function taking no arguments
+    :param repeat: How many times to run it
+    :return: The fastest run, in seconds
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run_stages(directory, fmt, left_right, destination):
+    """
+    Runs the whole slicing pipeline once over a set of images, timing every stage on its own. These are the same calls
+    the handlers make
+    :param directory: Directory holding the source images
+    :param fmt: Format of the source images (see SUITE_FORMATS)
+    :param left_right: Whether the transition is left to right or top down
+    :param destination: Where to write the sliced image
+    :return: A dictionary mapping stage names to seconds
+    """
+    times = {}
+    start = time.perf_counter()
+    if fmt in PPMCodec.PPM_FORMATS:
+        images = ImageUtils.retrieve_valid_files(directory, False, '.ppm')
+        times['scan'] = time.perf_counter() - start
+        start = time.perf_counter()
+        cache = PPMCodec.PPMCache()
+        cache.preload(images)
+        times['decode'] = time.perf_counter() - start
+        start = time.perf_counter()
+        if not all([SanityChecks.valid_ppm(img, cache=cache) for img in images]) or \
+                not SanityChecks.check_image_size_consistency_ppm(images, cache=cache):
+            raise ValueError('Generated images failed validation')
+        times['validate'] = time.perf_counter() - start
+        start = time.perf_counter()
+        header, pixels = ImageUtils.create_blend_ppm(images, left_right, fmt, cache)
+        times['blend'] = time.perf_counter() - start
+        start = time.perf_counter()
+        with open(destination + '.ppm', 'wb') as file:
+            PPMCodec.write_ppm(file, header, pixels)
+        times['encode'] = time.perf_counter() - start
+    else:
+        images = ImageUtils.retrieve_valid_files(directory, False, '.' + fmt.lower())
+        times['scan'] = time.perf_counter() - start
+        start = time.perf_counter()
+        if not SanityChecks.check_image_size_consistency_generic(images):
+            raise ValueError('Generated images failed validation')
+        times['validate'] = time.perf_counter() - start
+        start = time.perf_counter()
+        img = ImageUtils.create_blend_generic(images, left_right)
+        times['blend'] = time.perf_counter() - start
+        start = time.perf_counter()
+        img.save(destination + '.' + fmt.lower(), fmt)
+        times['encode'] = time.perf_counter() - start
+    return times
+
+
+def case_peak_rss(directory, fmt, left_right, destination):
+    """
+    Runs the pipeline once and reports the peak resident set size of the process. It is meant to be the only thing a
+    freshly started process does (see bench_case), so the peak belongs to the case alone. On Linux the peak is read
+    from /proc (VmHWM), because ru_maxrss carries over the peak of the process that started this one
+    :return: Peak resident set size in bytes, None if neither /proc nor the resource module is available
+    """
+    run_stages(directory, fmt, left_right, destination)
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 if resource else None
+
+
+def bench_case(directory, fmt, left_right, destination, repeat, megapixels):
+    """
+    Benchmarks one case: a source format and slicing method. The pipeline is run repeat times for timing, and once more
+    in a new process to find its peak memory. The process is spawned rather than forked, so it starts out holding
+    nothing but the interpreter and the modules, and its peak counts Pillow's buffers as well as Python objects
+    :return: A dictionary describing the case and holding its best time per stage, its total, its throughput in
+    megapixels (of output) per second and its peak resident set size in bytes (see case_peak_rss)
+    """
+    runs = [run_stages(directory, fmt, left_right, destination) for _ in range(repeat)]
+    stages = {stage: min(run[stage] for run in runs) for stage in STAGES if stage in runs[0]}
+    total = min(sum(run.values()) for run in runs)
+    with ProcessPoolExecutor(1, mp_context=get_context('spawn')) as pool:
+        peak = pool.submit(case_peak_rss, directory, fmt, left_right, destination).result()
+    return {'format': fmt, 'method': 'left-right' if left_right else 'top-down', 'stages': stages,
+            'seconds': total, 'megapixels_per_second': megapixels / total, 'max_rss_bytes': peak}
+
+
+def run_suite(width=1000, height=750, count=4, repeat=3, formats=SUITE_FORMATS):
+    """
+    Runs the benchmark suite: for every source format a set of images is generated, and both slicing methods are
+    benchmarked stage by stage (see bench_case). Everything happens in a temporary directory, so nothing but the
+    results is left behind
+    :return: A report dictionary holding the settings, a description of the environment and the list of cases. It is
+    plain json, so reports can be saved and compared (see compare_reports)
+    """
+    cases = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for fmt in formats:
+            directory = os.path.join(workdir, fmt)
+            os.mkdir(directory)
+            generate_set(directory, width, height, count, fmt)
+            for left_right in (True, False):
+                cases.append(bench_case(directory, fmt, left_right, os.path.join(workdir, 'sliced'), repeat,
+                                        width * height / 1e6))
+    return {'settings': {'width': width, 'height': height, 'count': count, 'repeat': repeat,
+                         'formats': list(formats)},
+            'environment': {'python': platform.python_version(), 'pillow': PIL.__version__,
+                            'platform': platform.platform(), 'machine': platform.machine(),
+                            'cpus': os.cpu_count()},
+            'cases': cases}
+
+
+def compare_reports(old, new):
+    """
+    Compares two reports case by case and stage by stage
+    :param old: The earlier report (see run_suite)
+    :param new: The later report
+    :return: A list of (case, stage, old seconds, new seconds, relative change) tuples for every stage found in both
+    reports. A relative change of 0.5 means the new run took 50% longer
+    """
+    old_cases = {(case['format'], case['method']): case for case in old['cases']}
+    changes = []
+    for case in new['cases']:
+        key = (case['format'], case['method'])
+        if key not in old_cases:
+            continue
+        old_stages = dict(old_cases[key]['stages'], total=old_cases[key]['seconds'])
+        for stage, seconds in dict(case['stages'], total=case['seconds']).items():
+            if stage in old_stages and old_stages[stage]:
+                changes.append(('{} {}'.format(*key), stage, old_stages[stage], seconds,
+                                seconds / old_stages[stage] - 1))
+    return changes
+
+
+def bench_ppm_formats(width=1000, height=750, count=4, repeat=3):
+    """
+    Compares slicing throughput of every combination of source format (P3/P6), output format (P3/P6) and slicing
+    method. Each case slices a freshly generated set of images and writes the result to disk
+    :param width: Width of the generated images
+    :param height: Height of the generated images
+    :param count: Number of images per set
+    :param repeat: Number of times each case is timed
+    :return: A list of dictionaries, one per case, holding the case's parameters, its time and its throughput in
+    megapixels (of output) per second
+    """
+    results = []
+    megapixels = width * height / 1e6
+    with tempfile.TemporaryDirectory() as workdir:
+        for source_format in PPMCodec.PPM_FORMATS:
+            directory = os.path.join(workdir, source_format)
+            os.mkdir(directory)
+            images = generate_ppm_set(directory, width, height, count, source_format)
+            destination = os.path.join(workdir, 'sliced.ppm')
+            for output_format in PPMCodec.PPM_FORMATS:
+                for left_right in (True, False):
+                    def run():
+                        header, pixels = ImageUtils.create_blend_ppm(images, left_right, output_format)
+                        with open(destination, 'wb') as file:
+                            PPMCodec.write_ppm(file, header, pixels)
+                    seconds = best_time(run, repeat)
+                    results.append({'source': source_format, 'output': output_format,
+                                    'method': 'left-right' if left_right else 'top-down',
+                                    'seconds': seconds, 'megapixels_per_second': megapixels / seconds})
+    return results
+
+
+def main(argvs):
+    try:
+        opts, args = getopt.getopt(argvs, 'hw:e:c:r:f:o:x:p')
+    except getopt.GetoptError as e:
+        print(e)
+        exit(1)
+    settings = dict(DEFAULTS)
+    keys = {'-w': 'width', '-e': 'height', '-c': 'count', '-r': 'repeat'}
+    output = None
+    baseline = None
+    formats_only = False
+    for opt, arg in opts:
+        if opt == '-h':
+            print('\n\n' + HELP + '\n')
+            exit(0)
+        elif opt == '-f':
+            settings['formats'] = arg.split(',')
+        elif opt == '-o':
+            output = arg
+        elif opt == '-x':
+            baseline = arg
+        elif opt == '-p':
+            formats_only = True
+        else:
+            settings[keys[opt]] = int(arg)
+    if formats_only:
+        del settings['formats']
+        print('Slicing {count} images of {width}x{height} ({repeat} runs per case)'.format(**settings))
+        print('{:<8}{:<8}{:<12}{:>10}{:>10}'.format('source', 'output', 'method', 'seconds', 'MP/s'))
+        for result in bench_ppm_formats(**settings):
+            print('{source:<8}{output:<8}{method:<12}{seconds:>10.3f}{megapixels_per_second:>10.2f}'.format(**result))
+        return
+    print('Slicing {count} images of {width}x{height} ({repeat} runs per case)'.format(**settings))
+    report = run_suite(**settings)
+    print('{:<8}{:<12}'.format('format', 'method') + ''.join('{:>10}'.format(stage) for stage in STAGES) +
+          '{:>10}{:>10}{:>12}'.format('total', 'MP/s', 'peak MB'))
+    for case in report['cases']:
+        print('{:<8}{:<12}'.format(case['format'], case['method']) +
+              ''.join('{:>10.4f}'.format(case['stages'][stage]) if stage in case['stages'] else '{:>10}'.format('-')
+                      for stage in STAGES) +
+              '{:>10.4f}{:>10.2f}'.format(case['seconds'], case['megapixels_per_second']) +
+              ('{:>12.1f}'.format(case['max_rss_bytes'] / 1e6) if case['max_rss_bytes'] is not None else
+               '{:>12}'.format('-')))
+    if output is not None:
+        with open(output, 'w') as file:
+            json.dump(report, file, indent=2)
+    if baseline is not None:
+        with open(baseline) as file:
+            changes = compare_reports(json.load(file), report)
+        print()
+        print('Compared to {}:'.format(baseline))
+        for case, stage, old, new, change in changes:
+            print('{:<20}{:<10}{:>10.4f} -> {:>8.4f} ({:+.0%})'.format(case, stage, old, new, change))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
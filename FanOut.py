@@ -0,0 +1,97 @@
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+import ImageUtils
+import Output
+import PPMCodec
+
+# Formats that can't hold an alpha channel or a palette, and the modes they take as they are. Anything else is
+# converted to RGB before it is encoded in one of them
+PLAIN_FORMATS = {'jpeg': ('RGB', 'L', 'CMYK'), 'ppm': ('RGB',)}
+
+
+def decode_sources(images, jobs=1, cache=None):
+    """
+    Decodes every source in full, once, so that any number of sliced images can be cut from them without going back
+    to disk
+    :param images: Paths to the images
+    :param jobs: Number of images to decode at the same time
+    :param cache: Optional PPMCodec.PPMCache the images have been parsed into, with their pixels, if they are ppm
+    files
+    :return: A list of loaded PIL Images, in the order of the images
+    """
+    if cache is not None:
+        sources = []
+        for image in images:
+            source = cache.get(image)
+            sources.append(Image.frombytes('RGB', (source.header['width'], source.header['height']), source.pixels))
+        return sources
+    if jobs > 1:
+        with ThreadPoolExecutor(jobs) as pool:
+            return list(pool.map(ImageUtils.load_source, images))
+    return [ImageUtils.load_source(image) for image in images]
+
+
+def scaled_size(size, scale=None):
+    """
+    :param size: The (width, height) of an image
+    :param scale: None, a factor (such as 0.25) or a (width, height) tuple
+    :return: The size the image is scaled to. Neither side goes below a pixel
+    """
+    if scale is None:
+        return size
+    if isinstance(scale, tuple):
+        return scale
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+
+def render(sources, output):
+    """
+    Cuts one sliced image from decoded sources. Since the sources are already in memory, this is just cropping and
+    pasting (see ImageUtils.create_blend_generic), plus scaling and converting the result if the output asks for it
+    :param sources: Decoded sources (see decode_sources)
+    :param output: An output dictionary holding left_right, runs (the layout's runs, see Layouts.build_runs, or None
+    for even strips), format and scale
+    :return: A PIL Image of the sliced image
+    """
+    if output['runs'] is not None:
+        img = ImageUtils.composite_generic(sources, output['runs'])
+    else:
+        img = ImageUtils.create_blend_generic(sources, output['left_right'])
+    size = scaled_size(img.size, output['scale'])
+    if size != img.size:
+        img = img.resize(size, ImageUtils.RESAMPLE, reducing_gap=ImageUtils.REDUCING_GAP)
+    modes = PLAIN_FORMATS.get(output['format'])
+    if modes is not None and img.mode not in modes:
+        img = img.convert('RGB')
+    return img
+
+
+def write_output(sources, output):
+    """
+    Renders one output (see render) and encodes it
+    :param sources: Decoded sources (see decode_sources)
+    :param output: An output dictionary (see render) that also holds the path to write to, the encoder options and,
+    for ppm outputs, the magic number and the depth (max value) of the sources
+    :return: The number of bytes written
+    """
+    img = render(sources, output)
+    with Output.open_output(output['path']) as sink:
+        if output['format'] == 'ppm':
+            header = {'magic_number': output['magic_no'], 'width': img.width, 'height': img.height,
+                      'depth': output['depth']}
+            PPMCodec.write_ppm(sink, header, img.tobytes())
+        else:
+            Output.encode_image(img, sink, output['format'], **output['options'])
+    return sink.written
+
+
+def fan_out(sources, outputs):
+    """
+    Produces several sliced images from one set of decoded sources. Every output is rendered and encoded in a thread
+    of its own. Pillow lets go of the GIL while it encodes, so the outputs are encoded at the same time
+    :param sources: Decoded sources (see decode_sources)
+    :param outputs: List of output dictionaries (see write_output)
+    :return: A list of the number of bytes written for every output
+    """
+    with ThreadPoolExecutor(len(outputs)) as pool:
+        return list(pool.map(write_output, [sources] * len(outputs), outputs))
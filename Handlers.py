@@ -1,9 +1,242 @@
 import os
+import sqlite3
+import time
+from contextlib import ExitStack, nullcontext
+from PIL import Image
+import FanOut
 import ImageUtils
+import Layouts
+import Output
+import Planner
+import PPMCodec
+import Prefetch
+import Profiling
 import SanityChecks
+import Sharding
+import SourceIndex
+import Tiled
+import Watch
 
 
-def handleppm(filename="__slicedimage__", path="", save_dir="", left_right=False):
+# Image types that go by more than one name, and the name Pillow knows them by
+FORMAT_ALIASES = {'jpg': 'jpeg', 'tif': 'tiff'}
+# Image types whose files go by more than one extension
+SUFFIXES = {'jpeg': ('.jpg', '.jpeg'), 'tiff': ('.tif', '.tiff')}
+# Ways an animated transition can be written: as one animated gif, webp or png (apng), or as numbered png frames
+ANIMATION_FORMATS = ['gif', 'webp', 'png', 'frames']
+
+
+class SlicerError(Exception):
+    """
+    Raised by the handlers when a slicing job can't be carried out. The message tells the user why
+    """
+    pass
+
+
+def layout_runs(layout, width, height, count, left_right):
+    """
+    Works out a layout for the handlers (see Layouts.build_runs), turning a layout that doesn't fit the images into a
+    SlicerError
+    :return: The layout's runs
+    """
+    try:
+        return Layouts.build_runs(layout, width, height, count, left_right)
+    except ValueError as e:
+        raise SlicerError('Invalid layout: {}'.format(e))
+
+
+def find_images(path, suffixes, scan=None):
+    """
+    Retrieves the images to slice for the handlers (see ImageUtils.retrieve_valid_files)
+    :param path: Directory to retrieve the images from
+    :param suffixes: Extensions of the images
+    :param scan: Optional dictionary of scanner settings: include, exclude, max_depth, order and jobs. Without one only
+    the directory itself is scanned and the images are ordered by name
+    :return: A list of paths to the images, or None if the path isn't a directory
+    """
+    scan = dict(scan or {})
+    max_depth = scan.pop('max_depth', 0)
+    return ImageUtils.retrieve_valid_files(path, max_depth != 0, *suffixes, max_depth=max_depth, **scan)
+
+
+def serve_cached(result_cache, images, destination, profiler, **settings):
+    """
+    Looks a job up in a result cache (see ResultCache.ResultCache) and, if it is there, writes its sliced image
+    :param result_cache: The ResultCache, or None if the job isn't cached
+    :param images: The job's sources
+    :param destination: Where the sliced image goes, a path or Output.STDOUT
+    :param profiler: Profiling.Profiler to record the lookup with
+    :param settings: Everything besides the sources that decides what the sliced image looks like
+    :return: A tuple of the job's key (None without a cache) and whether the sliced image was served from the cache
+    """
+    if result_cache is None:
+        return None, False
+    with profiler.stage('cache') as record:
+        try:
+            key = result_cache.key(images, **settings)
+            served = result_cache.fetch(key, destination)
+        except OSError as e:
+            raise SlicerError(str(e))
+        if served is not None:
+            record['bytes_written'] = served
+    if served is not None:
+        print('The images have been sliced before. Serving the sliced image from the result cache . . .')
+    return key, served is not None
+
+
+def store_cached(result_cache, key, path):
+    """
+    Adds a freshly sliced image to a result cache. A cache that can't be written to doesn't fail the job
+    :param result_cache: The ResultCache, or None if the job isn't cached
+    :param key: The job's key (see serve_cached)
+    :param path: Path of the sliced image. Images written to Output.STDOUT can't be read back, so they aren't stored
+    """
+    if result_cache is None or path == Output.STDOUT:
+        return
+    try:
+        result_cache.store(key, path)
+    except OSError as e:
+        print('Could not store the sliced image in the result cache: {}'.format(e))
+
+
+def report_encoding(written, start):
+    """
+    Tells the user how long encoding the sliced image took, so encoder options can be tuned. This is timed on its own,
+    since the profiler handlers use by default measures nothing
+    :param written: Number of bytes the encoded image takes
+    :param start: time.perf_counter() from when encoding started
+    """
+    print('Encoded {} bytes in {:.1f} ms'.format(written, (time.perf_counter() - start) * 1000))
+
+
+def start_prefetch(images, prefetch=None):
+    """
+    Starts reading the images ahead of the handlers (see Prefetch.Prefetcher)
+    :param images: Paths to the images, in the order they are going to be read
+    :param prefetch: Optional dictionary of prefetch settings: depth and read_size
+    :return: A context manager handing out the Prefetcher, or None if there are no settings
+    """
+    if prefetch is None:
+        return nullcontext()
+    try:
+        return Prefetch.Prefetcher(images, **prefetch)
+    except ValueError as e:
+        raise SlicerError(str(e))
+
+
+def prefetched_bytes(images, prefetch=None):
+    """
+    :param images: Paths to the images
+    :param prefetch: Optional dictionary of prefetch settings (see start_prefetch)
+    :return: About how many bytes the images read ahead take at most, going by the biggest image
+    """
+    if prefetch is None:
+        return 0
+    return (prefetch.get('depth', Prefetch.DEFAULT_DEPTH) + 1) * max(os.path.getsize(image) for image in images)
+
+
+def plan_job(estimates, max_memory, tiled_size=None):
+    """
+    Picks how to carry out a job within a memory limit (see Planner.choose) and tells the user what was picked
+    :param estimates: Dictionary mapping the strategies the job can be carried out with to their estimates
+    :param max_memory: The memory limit, in bytes
+    :param tiled_size: The (width, height) of the new image if it can also be made in tiled mode
+    :return: A tuple of the strategy and the memory budget to give tiled mode (None unless it can be used)
+    """
+    budget = None
+    if tiled_size is not None:
+        budget, estimates['tiled'] = Planner.tiled_estimate(tiled_size[0], tiled_size[1], max_memory)
+    strategy, fits = Planner.choose(estimates, max_memory)
+    print(Planner.describe(strategy, estimates, max_memory))
+    if not fits:
+        print('No strategy is expected to fit in the memory limit. Going with the one that needs the least memory')
+    return strategy, budget
+
+
+def indexed_records(index, images, kind, jobs=1, profiler=Profiling.DISABLED):
+    """
+    Looks the images up in a source index (see SourceIndex.SourceIndex), inspecting only the ones that are new or have
+    changed since the last run. An index that can't be read or written doesn't fail the job, the images are then
+    validated the usual way
+    :param index: The SourceIndex, or None if the job doesn't use one
+    :param images: Paths to the images
+    :param kind: How the images are inspected (see SourceIndex.KINDS)
+    :param jobs: Number of images to inspect at the same time
+    :param profiler: Profiling.Profiler to record the lookup with
+    :return: A dictionary mapping the images to their records, or None
+    """
+    if index is None:
+        return None
+    with profiler.stage('index'):
+        try:
+            records, inspected = index.refresh(images, kind, jobs)
+        except sqlite3.Error as e:
+            print('Could not use the source index: {}'.format(e))
+            return None
+    print('{} of {} image(s) are new or have changed since they were indexed'.format(inspected, len(images)))
+    return records
+
+
+def output_path(save_dir, name):
+    """
+    :param save_dir: The directory the handlers were given to save in, or Output.STDOUT
+    :param name: File name of the sliced image
+    :return: Where to write the sliced image
+    """
+    return Output.STDOUT if save_dir == Output.STDOUT else os.path.join(save_dir, name)
+
+
+def check_tiled_sources(images, path, profiler=Profiling.DISABLED):
+    """
+    Makes sure a set of images can be sliced tile by tile (see Tiled.open_source) and are all the same size. Only the
+    headers are read, the pixels are read tile by tile while slicing
+    :param images: Paths to the images
+    :param path: The directory the images were retrieved from
+    :param profiler: Profiling.Profiler to record the check with
+    :return: Raises a SlicerError if the images can't be sliced tile by tile
+    """
+    with profiler.stage('validate'):
+        print('Making sure that all images can be read tile by tile and are equal in size . . .')
+        sizes = []
+        for image in images:
+            try:
+                source = Tiled.open_source(image)
+            except (OSError, ValueError) as e:
+                raise SlicerError(str(e))
+            sizes.append((image, source.size))
+            source.close()
+        consistent = SanityChecks.report_size_mismatches(sizes, verbose=True)
+    if not consistent:
+        raise SlicerError('Not all images in {} are equal in size'.format(path))
+
+
+def write_tiled(images, filepath, left_right, output_format, budget, layout=None, profiler=Profiling.DISABLED):
+    """
+    Slices a set of images tile by tile (see Tiled.compose_tiled) for the handlers
+    :param images: Paths to the images (see check_tiled_sources)
+    :param filepath: Where to write the sliced image
+    :param left_right: Whether the strips run left to right or top down
+    :param output_format: Format of the sliced image, 'tif' (a tiled tiff) or 'ppm' (a binary ppm)
+    :param budget: Memory budget in bytes. Decides how big the tiles are
+    :param layout: Optional layout dictionary (see Layouts.build_runs)
+    :param profiler: Profiling.Profiler to record the slicing with
+    :return: Raises a SlicerError if the images can't be sliced
+    """
+    print('Slicing the images tile by tile now . . .')
+    with profiler.stage('slice') as record:
+        try:
+            with open(filepath, 'wb') as file:
+                Tiled.compose_tiled(images, file, left_right, output_format, budget, layout)
+                record['bytes_written'] = file.tell()
+        except OSError as e:
+            raise SlicerError(str(e))
+        except ValueError as e:
+            raise SlicerError('Invalid layout: {}'.format(e))
+
+
+def handleppm(filename="__slicedimage__", path="", save_dir="", left_right=False, stream=False, magic_no='P3',
+              jobs=1, profiler=Profiling.DISABLED, layout=None, scan=None, result_cache=None, feather=0, shards=0,
+              prefetch=None, max_memory=None, index=None):
     """
     A handler that takes care of slicing a set of ppm images.
     Note that this function does NOT perform the actual slicing, but simply performs extra commandline arg validation and calls
@@ -11,117 +244,630 @@ def handleppm(filename="__slicedimage__", path="", save_dir="", left_right=False
     :param left_right: A boolean value that will be passed to the actual slicing functions
     :param path: Path from which to retrieve the image files.
     :param filename: Name we are going to give the sliced image
-    :param save_dir: The directory we are going to save the sliced image in
-    :return: The directory that the new file was saved in, and the new file's name
+    :param save_dir: The directory we are going to save the sliced image in, or Output.STDOUT to write it to stdout
+    :param stream: Whether or not to stream the new image to disk row by row instead of building it in memory
+    :param magic_no: Format of the sliced image, 'P3' (ascii) or 'P6' (binary)
+    :param jobs: Number of processes to parse the images with
+    :param profiler: Profiling.Profiler to record the stages of the job (scan, decode, validate, slice and encode) with
+    :param layout: Optional layout dictionary (see Layouts.build_runs). Without one the images are sliced into even
+    strips
+    :param scan: Optional dictionary of scanner settings (see find_images)
+    :param result_cache: Optional ResultCache.ResultCache. If the same images have been sliced the same way before, the
+    sliced image is copied from it instead of slicing them again
+    :param feather: Width in pixels of the bands the seams between strips are cross-faded over (see
+    ImageUtils.create_blend_ppm). 0 gives hard seams. Can't be used when streaming or with a layout
+    :param shards: Number of worker processes to build the new image with (see Sharding.shared_composite). The new
+    image is held in shared memory and the workers fill it band by band straight from the sources, so the sources'
+    pixels are never held by this process. 0 builds it here. Can't be used when streaming or feathering
+    :param prefetch: Optional dictionary of prefetch settings (see start_prefetch). The images are read ahead while
+    they are being parsed. Only used when they are parsed one after another in this process and kept in memory, so
+    not with more than one job, when streaming or when sharding
+    :param max_memory: Optional memory limit in bytes. If given, the fastest way of slicing the images that is
+    expected to stay within it is worked out from their headers (see Planner): in memory, one image at a time,
+    streaming, or tiled (binary output only). Can't be used when streaming or sharding, which are choices of their own
+    :param index: Optional SourceIndex.SourceIndex. Images that haven't changed since they were indexed aren't
+    validated again, so unless their pixels are kept in memory they are only read while slicing
+    :return: The directory that the new file was saved in, and the new file's name. Raises a SlicerError if the images
+    can't be sliced
     """
-    # Empty file var that will eventually hold the new file's name
-    file = None
-    # File name is only set if valid, so the var will not be 'None' when all the checks are passed
+    if feather and (stream or layout is not None):
+        raise SlicerError('Feathering can only be used with even strips built in memory')
+    if shards and (stream or feather):
+        raise SlicerError('Sharding can be used neither when streaming nor when feathering')
+    if max_memory is not None and (stream or shards):
+        raise SlicerError("A memory limit picks how to slice by itself, so it can't be combined with streaming or "
+                          "sharding")
+    # If no save directory was given we save next to the source images
     if save_dir == "":
         save_dir = path
     else:
-        if not os.path.exists(save_dir):
-            print("Invalid save directory: {}".format(save_dir))
-            exit(1)
+        if save_dir != Output.STDOUT and not os.path.exists(save_dir):
+            raise SlicerError("Invalid save directory: {}".format(save_dir))
 
     if os.path.splitext(filename)[1] != '.ppm':
         filename += '.ppm'
-    if save_dir.endswith('\\') or save_dir.endswith('/'):
+    # Retrieve our ppm images from the path specified. Our retrieval function checks if the path exists for us
+    # If the path does not exist the return value will default to None
+    with profiler.stage('scan'):
+        images = find_images(path, ('.ppm',), scan)
+    # If we got None as a return value, then the directory was invalid
+    if images is None:
+        raise SlicerError('Invalid directory: {}'.format(path))
+    # If the return value is an empty list then obviously we can't move to slicing
+    if not images:
+        raise SlicerError("No images in the directory were retrieved. Try another")
+    filepath = output_path(save_dir, filename)
+    # Streaming doesn't change the sliced image, so it isn't part of the key
+    key, served = serve_cached(result_cache, images, filepath, profiler, handler='ppm', left_right=left_right,
+                               magic_no=magic_no, layout=layout, feather=feather)
+    if served:
+        return save_dir, filepath
+    records = indexed_records(index, images, 'ppm', jobs, profiler)
+    # The index only vouches for the images if they are all valid and of the same size. Otherwise they are validated
+    # the usual way, which tells the user what is wrong with them
+    indexed = records is not None and SourceIndex.all_valid(records, images)
+    # One image at a time: the pixels of the sources aren't kept, every image is read again while slicing
+    strips = False
+    if max_memory is not None:
+        strategy = None
+        with profiler.stage('plan'):
+            headers = []
+            for image in images:
+                if indexed:
+                    headers.append(SourceIndex.ppm_header(records[image]))
+                    continue
+                try:
+                    headers.append(PPMCodec.read_ppm_header(image))
+                except (OSError, ValueError):
+                    # Validation tells the user about it
+                    continue
+            if headers:
+                estimates = Planner.ppm_estimates(headers, left_right, jobs, feather, layout,
+                                                  prefetched_bytes(images, prefetch if jobs <= 1 else None))
+                # Tiled mode only writes binary images, and only reads binary sources
+                tiled = magic_no == 'P6' and not feather and save_dir != Output.STDOUT and \
+                    all(header['magic_number'] == 'P6' for header in headers)
+                strategy, budget = plan_job(estimates, max_memory,
+                                            (headers[0]['width'], headers[0]['height']) if tiled else None)
+        if strategy == 'tiled':
+            check_tiled_sources(images, path, profiler)
+            write_tiled(images, filepath, left_right, 'ppm', budget, layout, profiler)
+            store_cached(result_cache, key, filepath)
+            return save_dir, filepath
+        stream = strategy == 'stream'
+        strips = strategy == 'strips'
+    # Every image is parsed once into this cache, and validation, size checking and slicing all work off of it.
+    # When streaming we don't keep the pixels around, since that would defeat the purpose of streaming. When sharding
+    # the workers read the pixels themselves
+    keep_pixels = not stream and not shards and not strips
+    cache = PPMCodec.PPMCache(keep_pixels=keep_pixels)
+    if jobs > 1 or not keep_pixels:
+        prefetch = None
+    if indexed and not keep_pixels:
+        # The images were validated on an earlier run, so there is nothing to parse them for here
+        cache = None
+    else:
+        with profiler.stage('decode') as record, start_prefetch(images, prefetch) as prefetcher:
+            cache.preload(images, jobs, prefetcher)
+            record['source_bytes'] = sum(os.path.getsize(img) for img in images)
+        if indexed and any(cache.get(img).pixels is None for img in images):
+            # An image the index vouches for couldn't be loaded after all, such as one rewritten without its size or
+            # modification time changing. Validating it the usual way tells the user what is wrong with it
+            indexed = False
+    if indexed:
+        print('All images are valid ppm files of the same size, going by the source index')
+    else:
+        # Make sure every image is a ppm file we can actually slice. Let verbose be true so we don't have to handle
+        # telling the user their wrongdoings
+        with profiler.stage('validate'):
+            print('Making sure that all images are valid ppm files . . .')
+            valid = all([SanityChecks.valid_ppm(img, verbose=True, cache=cache) for img in images])
+            # Check if all the images are equal in size using our util function
+            print('Making sure that all images are equal in size . . .')
+            consistent = valid and SanityChecks.check_image_size_consistency_ppm(images, verbose=True, cache=cache)
+        if not valid:
+            raise SlicerError('Not all images in {} are valid ppm files'.format(path))
+        if not consistent:
+            raise SlicerError('Not all images in {} are equal in size'.format(path))
+    runs = None
+    if layout is not None:
+        header = cache.get(images[0]).header if cache is not None else SourceIndex.ppm_header(records[images[0]])
+        runs = layout_runs(layout, header['width'], header['height'], len(images), left_right)
+    elif shards:
+        # Even strips are handed to the workers as a layout, so they only have one kind of job to do
+        header = cache.get(images[0]).header if cache is not None else SourceIndex.ppm_header(records[images[0]])
+        runs = Layouts.strip_runs(header['width'], header['height'], len(images), left_right)
+    print('Slicing the images now . . .')
+    # The new file only shows up once it has been written in full (see Output.open_output), so a failed job doesn't
+    # leave a broken one behind
+    try:
+        if stream:
+            # The streaming function writes the new image itself, one row at a time, so slicing and encoding are one
+            # and the same stage
+            with profiler.stage('slice') as record, Output.open_output(filepath) as sink:
+                if runs is not None:
+                    ImageUtils.stream_composite_ppm(images, runs, sink, magic_no, cache)
+                else:
+                    ImageUtils.stream_blend_ppm(images, sink, left_right, magic_no, cache)
+                record['bytes_written'] = sink.written
+        else:
+            # The image slicing function does not save anything, but only returns the new image's header and pixels.
+            # A sharded image lives in shared memory, which is freed once it has been saved
+            with ExitStack() as stack:
+                with profiler.stage('slice'):
+                    if shards:
+                        header, pixels = stack.enter_context(
+                            Sharding.shared_composite(images, runs, shards, magic_no))
+                    elif runs is not None:
+                        header, pixels = ImageUtils.composite_ppm(images, runs, magic_no, None if strips else cache)
+                    else:
+                        header, pixels = ImageUtils.create_blend_ppm(images, left_right, magic_no,
+                                                                     None if strips else cache, feather=feather)
+                # Save the data returned by the function
+                start = time.perf_counter()
+                with profiler.stage('encode') as record, Output.open_output(filepath) as sink:
+                    PPMCodec.write_ppm(sink, header, pixels)
+                    record['bytes_written'] = sink.written
+                report_encoding(sink.written, start)
+    except (OSError, ValueError) as e:
+        # A ValueError means a source changed since it was validated and can't be decoded any more
+        raise SlicerError(str(e))
+    store_cached(result_cache, key, filepath)
+    # Return the current working directory as the save dir and the file name
+    return save_dir, filepath
+
+
+def handlegeneric(filename="__slicedimage__", path="", save_dir="", ftype="", left_right=False, jobs=1,
+                  profiler=Profiling.DISABLED, layout=None, scan=None, result_cache=None, options=None, normalize=None,
+                  feather=0, prefetch=None, max_memory=None, index=None):
+    """
+    A handler that takes care of slicing a set of any non-ppm images.
+    Note that this function does NOT perform the actual slicing, but simply performs extra commandline arg validation and calls
+    the proper functions to accomplish the slicing, all while providing user feedback on operation status
+    :param left_right: A boolean value that will be passed to the actual slicing functions
+    :param path: Path from which to retrieve the image files.
+    :param filename: Name we are going to give the sliced image
+    :param save_dir: The directory we are going to save the sliced image in, or Output.STDOUT to write it to stdout
+    :param ftype: File type
+    :param jobs: Number of threads to decode the images with
+    :param profiler: Profiling.Profiler to record the stages of the job (scan, validate, slice and encode) with
+    :param layout: Optional layout dictionary (see Layouts.build_runs). Without one the images are sliced into even
+    strips
+    :param scan: Optional dictionary of scanner settings (see find_images)
+    :param result_cache: Optional ResultCache.ResultCache. If the same images have been sliced the same way before, the
+    sliced image is copied from it instead of slicing them again
+    :param options: Optional dictionary of encoder options (see Output.ENCODER_OPTIONS)
+    :param normalize: Optional dictionary holding a 'size' ((width, height) tuple) and a 'mode', either of which may be
+    None (see ImageUtils.normalize_target). If given, images don't have to be the same size or mode: every image is
+    resampled and converted to fit while slicing
+    :param feather: Width in pixels of the bands the seams between strips are cross-faded over (see
+    ImageUtils.create_blend_generic). 0 gives hard seams. Can't be used with a layout
+    :param prefetch: Optional dictionary of prefetch settings (see start_prefetch). The images are read ahead while
+    they are being decoded
+    :param max_memory: Optional memory limit in bytes. If given, the fastest way of slicing the images that is
+    expected to stay within it is worked out from their headers (see Planner): several images at a time, one image
+    at a time, or tiled (uncompressed tiff images without encoder options only)
+    :param index: Optional SourceIndex.SourceIndex. Images that haven't changed since they were indexed aren't opened
+    to be validated again
+    :return: The directory that the new file was saved in, and the new file's name. Raises a SlicerError if the images
+    can't be sliced
+    """
+    if feather and layout is not None:
+        raise SlicerError('Feathering can only be used with even strips')
+    ftype = FORMAT_ALIASES.get(ftype, ftype)
+    options = options or {}
+    if save_dir == "":
+        save_dir = path
+    else:
+        if save_dir != Output.STDOUT and not os.path.exists(save_dir):
+            raise SlicerError("Invalid save directory: {}".format(save_dir))
+    # Jpegs and tiffs go by two extensions
+    suffixes = SUFFIXES.get(ftype, ('.' + ftype,))
+    # Retrieve the image files from the directory (path checking is cooked into the function itself)
+    with profiler.stage('scan'):
+        images = find_images(path, suffixes, scan)
+    if images is None:
+        raise SlicerError('Invalid directory: {}'.format(path))
+    # If we didn't get any images there is nothing to slice
+    if not images:
+        raise SlicerError("No images in the directory were retrieved. Try another")
+    filepath = output_path(save_dir, filename + '.' + ftype.lower())
+    key, served = serve_cached(result_cache, images, filepath, profiler, handler='generic', ftype=ftype,
+                               left_right=left_right, layout=layout, options=options, normalize=normalize,
+                               feather=feather)
+    if served:
+        return save_dir, filename
+    records = indexed_records(index, images, 'generic', jobs, profiler)
+    if records is not None and any(image not in records for image in images):
+        records = None
+    target = None
+    sizes = None
+    if normalize is not None:
+        # Sizes don't have to match, but every image has to be readable
+        with profiler.stage('validate'):
+            print('Making sure that all images can be read . . .')
+            if records is not None:
+                sizes = [(image, records[image]['size']) for image in images]
+            else:
+                sizes = SanityChecks.generic_sizes(images)
+            unreadable = [image for image, size in sizes if size is None]
+        if unreadable:
+            raise SlicerError('Not all images in {} can be read: {}'.format(path, ', '.join(unreadable)))
         try:
-            file = open(save_dir + filename, 'w')
-        except OSError as e:
-            print(e)
-            exit(1)
+            target = ImageUtils.normalize_target(images[0], **normalize)
+        except ValueError as e:
+            raise SlicerError(str(e))
+        print('Normalizing all images to {}x{} {} . . .'.format(target[0][0], target[0][1], target[1]))
+    elif records is not None and SourceIndex.all_valid(records, images):
+        print('All images are equal in size, going by the source index')
     else:
+        # Check if all the images are the same size
+        with profiler.stage('validate'):
+            print('Making sure that all images are equal in size . . .')
+            consistent = SanityChecks.check_image_size_consistency_generic(images, verbose=True)
+        if not consistent:
+            raise SlicerError('Not all images in {} are equal in size'.format(path))
+    if max_memory is not None:
+        with profiler.stage('plan'):
+            if records is not None:
+                source_size, source_mode = records[images[0]]['size'], records[images[0]]['mode']
+            else:
+                with Image.open(images[0]) as first:
+                    source_size, source_mode = first.size, first.mode
+            if sizes is not None:
+                source_size = max((size for _, size in sizes), key=lambda size: size[0] * size[1])
+            size, mode = target if target is not None else (source_size, source_mode)
+            estimates = Planner.generic_estimates(size, mode, source_size, source_mode, jobs,
+                                                  prefetched_bytes(images, prefetch))
+            # Tiled mode writes plain tiled tiffs, and only reads uncompressed tiffs
+            tiled = ftype == 'tiff' and target is None and not feather and not options and save_dir != Output.STDOUT
+            if tiled:
+                try:
+                    Tiled.open_source(images[0]).close()
+                except (OSError, ValueError):
+                    tiled = False
+            strategy, budget = plan_job(estimates, max_memory, size if tiled else None)
+        if strategy == 'tiled':
+            check_tiled_sources(images, path, profiler)
+            write_tiled(images, filepath, left_right, 'tif', budget, layout, profiler)
+            store_cached(result_cache, key, filepath)
+            return save_dir, filename
+        if strategy == 'strips':
+            jobs = 1
+    # Slice the images and save the new one. Decoding happens while slicing
+    print('Slicing the images now . . .')
+    with profiler.stage('slice') as record, start_prefetch(images, prefetch) as prefetcher:
+        if layout is not None:
+            # The index mask the layout is drawn with holds one byte per pixel
+            if len(images) > 256:
+                raise SlicerError('Layouts can be used with at most 256 images')
+            if target is not None:
+                width, height = target[0]
+            elif records is not None:
+                width, height = records[images[0]]['size']
+            else:
+                with Image.open(images[0]) as first:
+                    width, height = first.size
+            runs = layout_runs(layout, width, height, len(images), left_right)
+            img = ImageUtils.composite_generic(images, runs, jobs, target, prefetcher)
+        else:
+            img = ImageUtils.create_blend_generic(images, left_right, jobs, target, feather, prefetcher)
+        record['source_bytes'] = sum(os.path.getsize(image) for image in images)
+    start = time.perf_counter()
+    with profiler.stage('encode') as record:
         try:
-            file = open(save_dir + "\\" + filename, 'w')
-        except OSError as e:
-            print(e)
-            exit(1)
-    # Now that we have a proper filename we can begin the actual slicing process
-    while True:
-        # Get the path that we will retrieve the images from
-
-        # Retrieve our ppm images from the path specified. Our retrieval function checks if the path exists for us
-        # If the path does not exist the return value will default to None
-        images = ImageUtils.retrieve_valid_files(path, False, '.ppm')
-        # If we got None as a return value, then the directory was invalid
-        if images is None:
-            print()
-            print('Invalid directory: {}'.format(path))
-            print()
-            continue
-        # If the return value is an empty list then obviously we can't move to slicing so we let the user retry
-        if not images:
-            print()
-            print("No images in the directory were retrieved. Try another")
-            print()
-            continue
-        # Check if all the images are equal in size using our util function. Let verbose be true so we don't have to
-        # handle telling the user their wrongdoings
+            with Output.open_output(filepath) as sink:
+                Output.encode_image(img, sink, ftype, **options)
+        except (OSError, ValueError) as e:
+            raise SlicerError(str(e))
+        record['bytes_written'] = sink.written
+    report_encoding(sink.written, start)
+    store_cached(result_cache, key, filepath)
+
+    # Return the current working directory (thats where we saved the new file) and the new file name
+    return save_dir, filename
+
+
+def handleanimation(filename="__slicedimage__", path="", save_dir="", ftype="", left_right=False, frames=120,
+                    animation_format='gif', duration=40, jobs=1, profiler=Profiling.DISABLED, scan=None):
+    """
+    A handler that takes care of rendering a set of images (of any type) into an animated transition, in which the
+    slices sweep in one after another until they form the usual sliced image (see ImageUtils.iter_transition_frames)
+    Note that this function does NOT perform the actual slicing, but simply performs extra commandline arg validation and calls
+    the proper functions to accomplish the slicing, all while providing user feedback on operation status
+    :param left_right: A boolean value that will be passed to the actual slicing functions
+    :param path: Path from which to retrieve the image files.
+    :param filename: Name we are going to give the animation
+    :param save_dir: The directory we are going to save the animation in
+    :param ftype: File type of the source images
+    :param frames: Number of frames to render
+    :param animation_format: How to write the animation (see ANIMATION_FORMATS). 'frames' writes every frame to its own
+    numbered png file, which also keeps only one frame in memory at a time
+    :param duration: How long each frame is shown, in milliseconds
+    :param jobs: Number of threads to decode the images with
+    :param profiler: Profiling.Profiler to record the stages of the job (scan, validate, slice and write) with
+    :param scan: Optional dictionary of scanner settings (see find_images)
+    :return: The directory that the animation was saved in, and the animation's file name (the first frame's file name
+    for numbered frames). Raises a SlicerError if the images can't be animated
+    """
+    ftype = FORMAT_ALIASES.get(ftype, ftype)
+    if animation_format not in ANIMATION_FORMATS:
+        raise SlicerError('Invalid animation format: {}'.format(animation_format))
+    if frames < 1:
+        raise SlicerError('Invalid number of frames: {}'.format(frames))
+    if save_dir == "":
+        save_dir = path
+    else:
+        if not os.path.exists(save_dir):
+            raise SlicerError("Invalid save directory: {}".format(save_dir))
+    suffixes = SUFFIXES.get(ftype, ('.' + ftype,))
+    with profiler.stage('scan'):
+        images = find_images(path, suffixes, scan)
+    if images is None:
+        raise SlicerError('Invalid directory: {}'.format(path))
+    if not images:
+        raise SlicerError("No images in the directory were retrieved. Try another")
+    with profiler.stage('validate'):
         print('Making sure that all images are equal in size . . .')
-        # The utility function returns either True or False so we can continue to slicing or not based on its call
-        if SanityChecks.check_image_size_consistency_ppm(images, verbose=True):
-            # The image slicing function does not save anything, but only returns the new image data
-            print('Slicing the images now . . .')
-            imgdata = ImageUtils.create_blend_ppm(images, left_right)
-            # Save the data returned by the function
-            file.write(imgdata)
-            file.close()
-            # Return the current working directory as the save dir and the file name
-            return save_dir, file.name
+        consistent = SanityChecks.check_image_size_consistency_generic(images, verbose=True)
+    if not consistent:
+        raise SlicerError('Not all images in {} are equal in size'.format(path))
+    print('Rendering {} frames now . . .'.format(frames))
+    rendered = ImageUtils.iter_transition_frames(images, frames, left_right, jobs)
+    try:
+        if animation_format == 'frames':
+            # Every frame is written as soon as it is drawn, so the frames are rendered and written in one stage
+            names = [filename + '_{:04d}.png'.format(i) for i in range(frames)]
+            with profiler.stage('slice') as record:
+                for name, frame in zip(names, rendered):
+                    frame.save(os.path.join(save_dir, name), 'png')
+                    record['bytes_written'] += os.path.getsize(os.path.join(save_dir, name))
+                record['source_bytes'] = sum(os.path.getsize(image) for image in images)
+            return save_dir, names[0]
+        # Animated formats are written in one go, so the frames have to be kept until then
+        with profiler.stage('slice') as record:
+            kept = [frame.copy() for frame in rendered]
+            record['source_bytes'] = sum(os.path.getsize(image) for image in images)
+        name = filename + '.' + animation_format
+        with profiler.stage('write') as record:
+            kept[0].save(os.path.join(save_dir, name), animation_format, save_all=True, append_images=kept[1:],
+                         duration=duration, loop=0)
+            record['bytes_written'] = os.path.getsize(os.path.join(save_dir, name))
+    except OSError as e:
+        raise SlicerError(str(e))
+    return save_dir, name
 
 
-def handlegeneric(filename="__slicedimage__", path="", save_dir="", ftype="", left_right=False):
+def handletiled(filename="__slicedimage__", path="", save_dir="", ftype="", left_right=False, output_format='tif',
+                budget=Tiled.DEFAULT_BUDGET, profiler=Profiling.DISABLED, layout=None, scan=None):
     """
-    A handler that takes care of slicing a set of any non-ppm images.
+    A handler that takes care of slicing a set of images too big to hold in memory (see Tiled.compose_tiled). The
+    images have to be binary (P6) ppm files or uncompressed tiff files
     Note that this function does NOT perform the actual slicing, but simply performs extra commandline arg validation and calls
     the proper functions to accomplish the slicing, all while providing user feedback on operation status
     :param left_right: A boolean value that will be passed to the actual slicing functions
     :param path: Path from which to retrieve the image files.
     :param filename: Name we are going to give the sliced image
     :param save_dir: The directory we are going to save the sliced image in
-    :param ftype: File type
-    :return: The directory that the new file was saved in, and the new file's name
+    :param ftype: File type of the source images, 'ppm' or 'tif'
+    :param output_format: Format of the sliced image, 'tif' (a tiled tiff) or 'ppm' (a binary ppm)
+    :param budget: Memory budget in bytes. Decides how big the tiles are
+    :param profiler: Profiling.Profiler to record the stages of the job (scan, validate and slice) with
+    :param layout: Optional layout dictionary (see Layouts.build_runs). Without one the images are sliced into even
+    strips
+    :param scan: Optional dictionary of scanner settings (see find_images)
+    :return: The directory that the new file was saved in, and the new file's name. Raises a SlicerError if the images
+    can't be sliced
     """
-    if ftype == 'jpg':
-        ftype = 'jpeg'
+    ftype = FORMAT_ALIASES.get(ftype, ftype)
+    if ftype not in ('ppm', 'tiff'):
+        raise SlicerError('Tiled mode only works with ppm and tiff images')
+    if output_format not in Tiled.TILED_FORMATS:
+        raise SlicerError('Invalid tiled output format: {}'.format(output_format))
     if save_dir == "":
         save_dir = path
     else:
         if not os.path.exists(save_dir):
-            print("Invalid save directory: {}".format(save_dir))
-            exit(1)
-    # Get the filename from the user
+            raise SlicerError("Invalid save directory: {}".format(save_dir))
+    with profiler.stage('scan'):
+        images = find_images(path, SUFFIXES.get(ftype, ('.' + ftype,)), scan)
+    if images is None:
+        raise SlicerError('Invalid directory: {}'.format(path))
+    if not images:
+        raise SlicerError("No images in the directory were retrieved. Try another")
+    check_tiled_sources(images, path, profiler)
+    filename = os.path.splitext(filename)[0] + '.' + output_format
+    write_tiled(images, os.path.join(save_dir, filename), left_right, output_format, budget, layout, profiler)
+    return save_dir, filename
 
-    # Ensure that the extension is a valid jpe extension
 
-    while True:
-        # Get the path where the images are
+def handlewatch(filename="__slicedimage__", path="", save_dir="", ftype="", left_right=False, magic_no='P3',
+                layout=None, scan=None, options=None):
+    """
+    A handler that slices a set of images (of any type) and then keeps watching them (see Watch.Watcher). Whenever
+    one of them changes, only that image is read again and only its part of the sliced image is updated (see
+    Watch.PPMTarget and Watch.ImageTarget). If images are added or removed, the images are sliced again from scratch.
+    Runs until interrupted with Ctrl+C
+    Note that this function does NOT perform the actual slicing, but simply performs extra commandline arg validation and calls
+    the proper functions to accomplish the slicing, all while providing user feedback on operation status
+    :param left_right: A boolean value that will be passed to the actual slicing functions
+    :param path: Path from which to retrieve the image files.
+    :param filename: Name we are going to give the sliced image
+    :param save_dir: The directory we are going to save the sliced image in
+    :param ftype: File type of the source images. The sliced image has the same type
+    :param magic_no: Format of a sliced ppm image, 'P3' (ascii) or 'P6' (binary). P6 images are updated in place
+    :param layout: Optional layout dictionary (see Layouts.build_runs). Without one the images are sliced into even
+    strips
+    :param scan: Optional dictionary of scanner settings (see find_images)
+    :param options: Optional dictionary of encoder options for non-ppm images (see Output.ENCODER_OPTIONS)
+    :return: The directory that the new file was saved in, and the new file's name. Raises a SlicerError if the images
+    can't be sliced to begin with
+    """
+    ftype = FORMAT_ALIASES.get(ftype, ftype)
+    if save_dir == "":
+        save_dir = path
+    else:
+        if not os.path.exists(save_dir):
+            raise SlicerError("Invalid save directory: {}".format(save_dir))
+    filename = os.path.splitext(filename)[0] + '.' + ftype
+    filepath = os.path.join(save_dir, filename)
+    suffixes = SUFFIXES.get(ftype, ('.' + ftype,))
 
-        # Retrieve the image files from the directory (path checking is cooked into the function itself)
-        images = ImageUtils.retrieve_valid_files(path, False, ftype)
+    def list_sources():
+        # The sliced image may well be saved among the sources, but must never be taken for one
+        images = find_images(path, suffixes, scan)
         if images is None:
-            print()
-            print('Invalid directory: {}'.format(path))
-            print()
-            continue
-        # If we didn't get any images let the user know and retry
+            raise SlicerError('Invalid directory: {}'.format(path))
+        return [image for image in images if os.path.abspath(image) != os.path.abspath(filepath)]
+
+    def build(images):
         if not images:
-            print()
-            print("No images in the directory were retrieved. Try another")
-            print()
-            continue
-        # Check if all the images are the same size
-        print('Making sure that all images are equal in size . . .')
-        if SanityChecks.check_image_size_consistency_genericf(images, verbose=True):
-            # Slice the images and save the new one
-            print('Slicing the images now . . .')
-            img = ImageUtils.create_blend_generic(images, left_right)
-            if save_dir.endswith('\\') or save_dir.endswith('/'):
-                img.save(save_dir + filename + '.' + ftype.lower(), ftype)
-            else:
-                img.save(save_dir + '\\' + filename + '.' + ftype.lower(), ftype)
+            raise SlicerError("No images in the directory were retrieved. Try another")
+        print('Making sure that all images are valid and equal in size . . .')
+        if ftype == 'ppm':
+            cache = PPMCodec.PPMCache(keep_pixels=False)
+            if not all([SanityChecks.valid_ppm(img, verbose=True, cache=cache) for img in images]):
+                raise SlicerError('Not all images in {} are valid ppm files'.format(path))
+            consistent = SanityChecks.check_image_size_consistency_ppm(images, verbose=True, cache=cache)
+            header = cache.get(images[0]).header
+            size = header['width'], header['height']
+        else:
+            consistent = SanityChecks.check_image_size_consistency_generic(images, verbose=True)
+            with Image.open(images[0]) as first:
+                size = first.size
+        if not consistent:
+            raise SlicerError('Not all images in {} are equal in size'.format(path))
+        if ftype != 'ppm' and len(images) > 256:
+            # The index mask the parts of the sliced image are cut from holds one byte per pixel
+            raise SlicerError('Watch mode can be used with at most 256 images')
+        runs = layout_runs(layout if layout is not None else {'layout': 'strips'}, size[0], size[1], len(images),
+                           left_right)
+        print('Slicing the images now . . .')
+        try:
+            if ftype == 'ppm':
+                return Watch.PPMTarget(images, runs, filepath, magic_no)
+            return Watch.ImageTarget(images, runs, filepath, ftype, options)
+        except (OSError, ValueError) as e:
+            raise SlicerError(str(e))
 
-            # Return the current working directory (thats where we saved the new file) and the new file name
-            return save_dir, filename
+    images = list_sources()
+    target = build(images)
+    watcher = Watch.Watcher(list_sources, path)
+    print('Watching {} for changes. Press Ctrl+C to stop . . .'.format(path))
+    try:
+        while True:
+            images, changed = watcher.wait()
+            start = time.perf_counter()
+            try:
+                if images != target.images:
+                    print('Images were added or removed')
+                    target = build(images)
+                else:
+                    for image in changed:
+                        target.update(images.index(image))
+            except (SlicerError, OSError, ValueError) as e:
+                # A file that is still being written, or one that was saved wrong. Either way the next save fixes it
+                print(e)
+                continue
+            print('Updated {} in {:.1f} ms'.format(filename, (time.perf_counter() - start) * 1000))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+    return save_dir, filename
+
+
+def handlefanout(filename="__slicedimage__", path="", save_dir="", ftype="", outputs=(), jobs=1,
+                 profiler=Profiling.DISABLED, scan=None):
+    """
+    A handler that produces several sliced images from one set of images (see FanOut.fan_out), such as both
+    orientations, or a png master along with a jpeg copy and a thumbnail. The images are scanned, validated and
+    decoded once, and the outputs are then cut from the decoded images and encoded at the same time
+    Note that this function does NOT perform the actual slicing, but simply performs extra commandline arg validation and calls
+    the proper functions to accomplish the slicing, all while providing user feedback on operation status
+    :param path: Path from which to retrieve the image files.
+    :param filename: Name the outputs are named after when they aren't given a name of their own
+    :param save_dir: The directory we are going to save the sliced images in
+    :param ftype: File type of the source images
+    :param outputs: List of output dictionaries, each holding a name (None for the default), left_right, layout
+    (a layout dictionary or None, see Layouts.build_runs), format (one of the -t types, e.g. 'jpg'), magic_no (for ppm
+    outputs), options (encoder options, see Output.ENCODER_OPTIONS) and scale (None, a factor or a (width, height)
+    tuple)
+    :param jobs: Number of images to decode at the same time (processes for ppm images, threads for others)
+    :param profiler: Profiling.Profiler to record the stages of the job (scan, decode, validate and slice) with
+    :param scan: Optional dictionary of scanner settings (see find_images)
+    :return: The directory that the new files were saved in, and a list of the new files' names. Raises a SlicerError
+    if the images can't be sliced
+    """
+    if not outputs:
+        raise SlicerError('No outputs to produce')
+    ftype = FORMAT_ALIASES.get(ftype, ftype)
+    if save_dir == "":
+        save_dir = path
+    else:
+        if not os.path.exists(save_dir):
+            raise SlicerError("Invalid save directory: {}".format(save_dir))
+    with profiler.stage('scan'):
+        images = find_images(path, SUFFIXES.get(ftype, ('.' + ftype,)), scan)
+    if images is None:
+        raise SlicerError('Invalid directory: {}'.format(path))
+    if not images:
+        raise SlicerError("No images in the directory were retrieved. Try another")
+    cache = None
+    if ftype == 'ppm':
+        cache = PPMCodec.PPMCache()
+        with profiler.stage('decode') as record:
+            cache.preload(images, jobs)
+            record['source_bytes'] = sum(os.path.getsize(img) for img in images)
+        with profiler.stage('validate'):
+            print('Making sure that all images are valid ppm files . . .')
+            valid = all([SanityChecks.valid_ppm(img, verbose=True, cache=cache) for img in images])
+            print('Making sure that all images are equal in size . . .')
+            consistent = valid and SanityChecks.check_image_size_consistency_ppm(images, verbose=True, cache=cache)
+        if not valid:
+            raise SlicerError('Not all images in {} are valid ppm files'.format(path))
+    else:
+        with profiler.stage('validate'):
+            print('Making sure that all images are equal in size . . .')
+            consistent = SanityChecks.check_image_size_consistency_generic(images, verbose=True)
+    if not consistent:
+        raise SlicerError('Not all images in {} are equal in size'.format(path))
+    # Max value of the samples, which ppm outputs keep. Images Pillow decodes always go up to 255
+    depth = 255
+    if cache is not None:
+        # The images have been parsed already, they only have to be handed to Pillow. The sliced images are only ever
+        # cut from those from here on, so the parsed ones can go
+        depth = cache.get(images[0]).header['depth']
+        sources = FanOut.decode_sources(images, jobs, cache)
+        cache = None
+    else:
+        print('Decoding the images once for {} outputs . . .'.format(len(outputs)))
+        with profiler.stage('decode') as record:
+            try:
+                sources = FanOut.decode_sources(images, jobs)
+            except OSError as e:
+                raise SlicerError(str(e))
+            record['source_bytes'] = sum(os.path.getsize(img) for img in images)
+    width, height = sources[0].size
+    planned = []
+    names = []
+    for i, output in enumerate(outputs):
+        runs = None
+        if output['layout'] is not None:
+            # The index mask the layout is drawn with holds one byte per pixel
+            if len(images) > 256:
+                raise SlicerError('Layouts can be used with at most 256 images')
+            runs = layout_runs(output['layout'], width, height, len(images), output['left_right'])
+        fmt = FORMAT_ALIASES.get(output['format'], output['format'])
+        name = (output['name'] or '{}_{}'.format(filename, i + 1)) + '.' + output['format']
+        if name in names:
+            raise SlicerError('More than one output is named {}'.format(name))
+        names.append(name)
+        planned.append(dict(output, runs=runs, format=fmt, depth=depth, path=os.path.join(save_dir, name)))
+    print('Slicing and encoding {} outputs now . . .'.format(len(outputs)))
+    with profiler.stage('slice') as record:
+        try:
+            record['bytes_written'] = sum(FanOut.fan_out(sources, planned))
+        except (OSError, ValueError) as e:
+            raise SlicerError(str(e))
+    return save_dir, names
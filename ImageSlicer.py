@@ -1,28 +1,183 @@
 from Handlers import *
+import ImageUtils
+import Layouts
+import Output
+import PPMCodec
+import Prefetch
+import Profiling
+import ResultCache
+import Scanner
+import SourceIndex
+import Tiled
+import cProfile
 import sys
 import getopt
 import random
+import sqlite3
 
 # Valid image formats that the program can handle. Should be in same order as they appear in the VALID_SELECTIONS dict
-VALID_FORMATS = ['ppm', 'jpg', 'jpeg', 'png']
+VALID_FORMATS = ['ppm', 'jpg', 'jpeg', 'png', 'tif', 'tiff', 'webp']
+# Formats a sliced ppm image can be written in
+PPM_FORMATS = PPMCodec.PPM_FORMATS
 METHOD_KEY = {'1': True, '2': False}
+# Keys an output spec can have (see parse_output)
+OUTPUT_KEYS = ['name', 'method', 'type', 'encode', 'scale', 'layout', 'grid', 'weights', 'ppm']
 
 HELP = "-h - Prints this\n"\
        "-s <directory> - Directory to retrieve the source images from\n"\
        "-d <directory> - Destination in which the newly sliced image will be placed (defaults" \
-       " to path where we source our images from)\n"\
+       " to path where we source our images from). - writes the sliced image to stdout, and everything else to" \
+       " stderr\n"\
        "-t <filetype> - Type of image file that will be sliced\n" \
        "\t\tAvailable types:\n\t\t" + '\n\t\t'.join(VALID_FORMATS) + '\n'\
        "-m <1|2> - Method to use when slicing. 1: Final image will be composed of horizontal slices" \
        " 2: Final image will be composed of vertical slices\n" \
-       "-n - Optional parameter. Specifies what the sliced image will have as a file name"
+       "-n - Optional parameter. Specifies what the sliced image will have as a file name\n" \
+       "-l - Optional parameter. Low memory mode for ppm images: rows are streamed straight to the sliced image instead" \
+       " of building it in memory\n" \
+       "-f <P3|P6> - Optional parameter. Format of a sliced ppm image. P3: ascii (default) P6: binary\n" \
+       "-j, --jobs <count> - Optional parameter. Number of images to decode at the same time (defaults to 1). In batch" \
+       " mode, the number of jobs to run at the same time (defaults to the number of cpus)\n" \
+       "-b <manifest> - Batch mode. Runs every job in a json or csv manifest with the keys/columns source, destination," \
+       " type, method and name (same meaning as -s, -d, -t, -m and -n). -s, -d, -t, -m and -n are ignored\n" \
+       "--profile <file> - Optional parameter. Writes a json report of the time, size of the sources, bytes written and" \
+       " peak memory of every stage of the slicing to the file\n" \
+       "--cprofile <file> - Optional parameter. Runs the slicing under cProfile and dumps the stats to the file\n" \
+       "-a <frames> - Animation mode. Renders a transition in which the slices sweep in one after another over the" \
+       " given number of frames, ending on the usual sliced image. Works with every image type\n" \
+       "--animation <" + '|'.join(ANIMATION_FORMATS) + "> - Optional parameter. How to write the animation: an" \
+       " animated gif (default), webp or png, or numbered png frames\n" \
+       "--duration <milliseconds> - Optional parameter. How long each frame of an animation is shown (default 40)\n" \
+       "--layout <" + '|'.join(Layouts.LAYOUTS) + "> - Optional parameter. How the new image is divided between the" \
+       " images: strips (default, see -m), a grid (see --grid), diagonal bands or wedges around the center\n" \
+       "--grid <columns>x<rows> - Optional parameter. Size of a grid layout (defaults to one row with a column per" \
+       " image). Cells are handed out to the images row by row, starting over at the first image when they run out\n" \
+       "--weights <w1,w2,...> - Optional parameter. Relative sizes of the strips, bands or wedges, one per image in" \
+       " the order of their file names (defaults to even sizes)\n" \
+       "--tiled <" + '|'.join(Tiled.TILED_FORMATS) + "> - Tiled mode, for images too big to fit in memory. The sliced" \
+       " image is built and written tile by tile as a tiled tiff or a binary ppm. Sources must be binary (P6) ppm" \
+       " files or uncompressed tiff files\n" \
+       "--tile-memory <megabytes> - Optional parameter. Memory budget of tiled mode, which decides the tile size" \
+       " (default " + str(Tiled.DEFAULT_BUDGET >> 20) + ")\n" \
+       "--depth <levels|all> - Optional parameter. How many levels of subdirectories of the source directory to take" \
+       " images from as well (default 0)\n" \
+       "--include <globs> - Optional parameter. Comma separated globs (e.g. 'shot_*' or 'raw/*.png'). Only images" \
+       " matching one of them are sliced. Can be given more than once\n" \
+       "--exclude <globs> - Optional parameter. Comma separated globs for images and subdirectories to leave out." \
+       " Can be given more than once\n" \
+       "--sort <" + '|'.join(Scanner.ORDERS) + "> - Optional parameter. Order of the images of every directory:" \
+       " by name (default), by name with numbers compared by value, by modification time, or as listed\n" \
+       "--cache <directory> - Optional parameter. Keeps sliced images in a result cache in the directory. Slicing the" \
+       " same unchanged images the same way again copies the sliced image from the cache. Not used by -a, --tiled" \
+       " and --watch\n" \
+       "--cache-size <megabytes> - Optional parameter. Size cap of the result cache. The least recently used images" \
+       " are evicted past it (default " + str(ResultCache.DEFAULT_CAPACITY >> 20) + ")\n" \
+       "--cache-key <" + '|'.join(ResultCache.KEY_MODES) + "> - Optional parameter. How the result cache tells" \
+       " whether the images changed: by path, size and modification time (default) or by hashing their contents\n" \
+       "--watch - Watch mode. Slices the images, then keeps watching them and updates the sliced image whenever one" \
+       " of them changes, reading only the image that changed. Runs until stopped with Ctrl+C\n" \
+       "--encode <option[=value],...> - Optional parameter. Encoder options of the sliced image, trading size for" \
+       " speed. Available options:\n\t\t" + '\n\t\t'.join('{}: {}'.format(fmt, ', '.join(options)) for fmt, options
+                                                          in Output.ENCODER_OPTIONS.items()) + "\n" \
+       "--normalize <first|<width>x<height>> - Optional parameter. Lets images of different sizes and modes be sliced" \
+       " together: every image is resampled to the size of the first image or the given size, and converted to one" \
+       " mode (see --mode). Not available for ppm images and with -a, --tiled or --watch\n" \
+       "--mode <" + '|'.join(ImageUtils.NORMALIZE_MODES) + "> - Optional parameter. Mode to normalize the images to" \
+       " (implies --normalize first). Defaults to the first image's mode, or RGB(A) if it has another one\n" \
+       "--feather <pixels> - Optional parameter. Cross-fades neighbouring slices over a band this wide around every" \
+       " seam instead of leaving hard seams. Only for even strips (no --layout), and not with -l, -a, --tiled or --watch\n" \
+       "--shards <workers> - Optional parameter. Builds a sliced ppm image with this many worker processes. The image" \
+       " is held in shared memory and cut into horizontal bands, which the workers fill straight from the images, so" \
+       " one big image is built on every core. Not with -l, --feather, -a, --tiled or --watch\n" \
+       "--prefetch <depth> - Optional parameter. Reads this many images ahead of the one being decoded, for images on" \
+       " network or other slow storage (default 0, off). Not used by -a, --tiled and --watch, and for ppm images only" \
+       " with one job and without -l or --shards\n" \
+       "--read-size <kilobytes> - Optional parameter. Size of the reads images are prefetched with (default " + \
+       str(Prefetch.DEFAULT_READ_SIZE >> 10) + ")\n" \
+       "--max-memory <megabytes> - Optional parameter. Memory limit of the job. The images' headers are read first, and" \
+       " the fastest way of slicing them that is expected to stay within the limit is picked: in memory, one image at" \
+       " a time, streaming rows (ppm) or tile by tile (binary ppm output or uncompressed tiffs). Not with -l," \
+       " --shards, -a, --tiled or --watch\n" \
+       "--output <key=value;...> - Optional parameter, can be given more than once. Fan-out mode: makes every output" \
+       " described from one scan and one decode of the images, encoding them all at the same time. Keys: " + \
+       ', '.join(OUTPUT_KEYS) + ". They mean the same as -n, -m, -t, --encode, --layout, --grid, --weights and -f," \
+       " and default to them. scale is a factor or a <width>x<height> size, e.g. --output 'type=jpg;scale=0.25'\n" \
+       "--index <file|directory> - Optional parameter. Keeps the format, size, mode and validity of every image in an" \
+       " sqlite file (named " + SourceIndex.DEFAULT_NAME + " if a directory is given), so images that haven't changed" \
+       " since an earlier run are only stat'ed, not opened, to be validated. Not with -a, --tiled, --watch or --output"
+
+
+def parse_output(text, method=None, imgtype='png', ppmformat='P3', layout=None, encode=''):
+    """
+    Parses an output spec given with --output: semicolon separated key=value pairs (see OUTPUT_KEYS), such as
+    'type=jpg;encode=quality=85;scale=0.25;name=thumb'. The keys mean the same as the flags they are named after
+    (method is -m, type is -t, name is -n, ppm is -f, layout, grid, weights and encode are the long flags), and the
+    ones left out are taken from the flags. Scale is a factor or a <width>x<height> size the sliced image is resized
+    to
+    :param text: The spec
+    :param method: The method given with -m, if any
+    :param imgtype: The image type given with -t
+    :param ppmformat: The ppm format given with -f
+    :param layout: The layout dictionary given with --layout, --grid and --weights, if any
+    :param encode: The encoder options given with --encode. Only used by outputs of the same type as -t
+    :return: An output dictionary for handlefanout. Raises a ValueError if the spec doesn't make sense
+    """
+    spec = {}
+    for item in text.split(';'):
+        key, equals, value = item.strip().partition('=')
+        key = key.strip().lower()
+        if not key:
+            continue
+        if key not in OUTPUT_KEYS or not equals:
+            raise ValueError('Invalid output spec entry: {}. Available keys: {}'.format(item.strip(),
+                                                                                        ', '.join(OUTPUT_KEYS)))
+        spec[key] = value.strip()
+    method = spec.get('method', method)
+    if method not in METHOD_KEY:
+        raise ValueError('No valid method given for output: {}'.format(text))
+    outtype = spec.get('type', imgtype).lower()
+    if outtype not in VALID_FORMATS:
+        raise ValueError('Invalid image format in output: {}'.format(outtype))
+    fmt = FORMAT_ALIASES.get(outtype, outtype)
+    ppm = spec.get('ppm', ppmformat).upper()
+    if ppm not in PPM_FORMATS:
+        raise ValueError('Invalid ppm format in output: {}'.format(ppm))
+    if 'layout' in spec or 'grid' in spec or 'weights' in spec:
+        name = spec.get('layout', '').lower() or ('grid' if 'grid' in spec else 'strips')
+        if name not in Layouts.LAYOUTS:
+            raise ValueError('Invalid layout in output: {}'.format(name))
+        layout = {'layout': name, 'grid': Layouts.parse_grid(spec['grid']) if 'grid' in spec else None,
+                  'weights': Layouts.parse_weights(spec['weights']) if 'weights' in spec else None}
+    scale = spec.get('scale')
+    if scale is not None:
+        if 'x' in scale.lower():
+            scale = ImageUtils.parse_size(scale)
+        else:
+            try:
+                scale = float(scale)
+            except ValueError:
+                scale = 0
+            if not scale > 0:
+                raise ValueError('Invalid scale in output: {}'.format(spec['scale']))
+    if 'encode' not in spec and fmt != FORMAT_ALIASES.get(imgtype.lower(), imgtype.lower()):
+        encode = ''
+    return {'name': spec.get('name') or None, 'left_right': METHOD_KEY[method], 'layout': layout, 'format': outtype,
+            'magic_no': ppm, 'options': Output.parse_options(spec.get('encode', encode), fmt), 'scale': scale}
 
 
 def main(argvs):
     opts = None
     try:
-        # h - help, c - console based, t - img type, m - method (left or right), d - destination, s - source
-        opts, args = getopt.getopt(argvs, 'hcs:d:t:m:n:')
+        # h - help, c - console based, t - img type, m - method (left or right), d - destination, s - source,
+        # l - low memory (streaming), f - ppm output format, j - number of jobs, b - batch manifest,
+        # a - number of animation frames
+        opts, args = getopt.getopt(argvs, 'hcls:d:t:m:n:f:j:b:a:', ['jobs=', 'profile=', 'cprofile=', 'animation=',
+                                                                      'duration=', 'layout=', 'grid=', 'weights=',
+                                                                      'tiled=', 'tile-memory=', 'depth=', 'include=',
+                                                                      'exclude=', 'sort=', 'cache=', 'cache-size=',
+                                                                      'cache-key=', 'watch', 'encode=', 'normalize=',
+                                                                      'mode=', 'feather=', 'shards=', 'prefetch=',
+                                                                      'read-size=', 'max-memory=', 'output=', 'index='])
     except getopt.GetoptError as e:
         print(e)
         exit(1)
@@ -32,6 +187,38 @@ def main(argvs):
     imgtype = None
     method = None
     filename = ""
+    stream = False
+    ppmformat = 'P3'
+    jobs = None
+    manifest = None
+    profile = None
+    cprofile = None
+    frames = None
+    animation = 'gif'
+    duration = '40'
+    layout = None
+    grid = None
+    weights = None
+    tiled = None
+    budget = str(Tiled.DEFAULT_BUDGET >> 20)
+    depth = '0'
+    include = []
+    exclude = []
+    order = 'name'
+    cache_dir = None
+    cache_size = str(ResultCache.DEFAULT_CAPACITY >> 20)
+    cache_key = 'stat'
+    watch = False
+    encode = ''
+    normalize = None
+    normalize_mode = None
+    feather = '0'
+    shards = '0'
+    prefetch = '0'
+    read_size = str(Prefetch.DEFAULT_READ_SIZE >> 10)
+    max_memory = None
+    outputs = []
+    index = None
     for opt, arg in opts:
         if opt == '-h':
             print('\n\n' + HELP + '\n')
@@ -46,19 +233,249 @@ def main(argvs):
             imgtype = arg
         elif opt == '-n':
             filename = arg
+        elif opt == '-l':
+            stream = True
+        elif opt == '-f':
+            ppmformat = arg.upper()
+        elif opt in ('-j', '--jobs'):
+            jobs = arg
+        elif opt == '-b':
+            manifest = arg
+        elif opt == '--profile':
+            profile = arg
+        elif opt == '--cprofile':
+            cprofile = arg
+        elif opt == '-a':
+            frames = arg
+        elif opt == '--animation':
+            animation = arg.lower()
+        elif opt == '--duration':
+            duration = arg
+        elif opt == '--layout':
+            layout = arg.lower()
+        elif opt == '--grid':
+            grid = arg
+        elif opt == '--weights':
+            weights = arg
+        elif opt == '--tiled':
+            tiled = arg.lower()
+        elif opt == '--tile-memory':
+            budget = arg
+        elif opt == '--depth':
+            depth = arg.lower()
+        elif opt == '--include':
+            include += [pattern for pattern in arg.split(',') if pattern]
+        elif opt == '--exclude':
+            exclude += [pattern for pattern in arg.split(',') if pattern]
+        elif opt == '--sort':
+            order = arg.lower()
+        elif opt == '--cache':
+            cache_dir = arg
+        elif opt == '--cache-size':
+            cache_size = arg
+        elif opt == '--cache-key':
+            cache_key = arg.lower()
+        elif opt == '--watch':
+            watch = True
+        elif opt == '--encode':
+            encode = arg
+        elif opt == '--normalize':
+            normalize = arg.lower()
+        elif opt == '--mode':
+            normalize_mode = arg.upper()
+        elif opt == '--feather':
+            feather = arg
+        elif opt == '--shards':
+            shards = arg
+        elif opt == '--prefetch':
+            prefetch = arg
+        elif opt == '--read-size':
+            read_size = arg
+        elif opt == '--max-memory':
+            max_memory = arg
+        elif opt == '--output':
+            outputs.append(arg)
+        elif opt == '--index':
+            index = arg
 
+    if jobs is not None and (not jobs.isdigit() or int(jobs) < 1):
+        print("Invalid number of jobs provided: " + jobs)
+        print("Type -h for command reference")
+        exit(1)
+    if frames is not None and (not frames.isdigit() or int(frames) < 1):
+        print("Invalid number of frames provided: " + frames)
+        print("Type -h for command reference")
+        exit(1)
+    if animation not in ANIMATION_FORMATS:
+        print("Invalid animation format provided: " + animation)
+        print("Type -h for command reference")
+        exit(1)
+    if not duration.isdigit():
+        print("Invalid frame duration provided: " + duration)
+        print("Type -h for command reference")
+        exit(1)
+    if tiled is not None and tiled not in Tiled.TILED_FORMATS:
+        print("Invalid tiled output format provided: " + tiled)
+        print("Type -h for command reference")
+        exit(1)
+    if not budget.isdigit() or int(budget) < 1:
+        print("Invalid tile memory budget provided: " + budget)
+        print("Type -h for command reference")
+        exit(1)
+    if depth != 'all' and not depth.isdigit():
+        print("Invalid depth provided: " + depth)
+        print("Type -h for command reference")
+        exit(1)
+    if order not in Scanner.ORDERS:
+        print("Invalid sort order provided: " + order)
+        print("Type -h for command reference")
+        exit(1)
+    if not cache_size.isdigit():
+        print("Invalid result cache size provided: " + cache_size)
+        print("Type -h for command reference")
+        exit(1)
+    if cache_key not in ResultCache.KEY_MODES:
+        print("Invalid result cache key provided: " + cache_key)
+        print("Type -h for command reference")
+        exit(1)
+    if watch and (tiled is not None or frames is not None):
+        print("Watch mode can't be combined with animation or tiled mode")
+        print("Type -h for command reference")
+        exit(1)
+    if not feather.isdigit():
+        print("Invalid feather width provided: " + feather)
+        print("Type -h for command reference")
+        exit(1)
+    if int(feather) and (watch or tiled is not None or frames is not None):
+        print("Feathering can't be combined with animation, tiled or watch mode")
+        print("Type -h for command reference")
+        exit(1)
+    if not shards.isdigit():
+        print("Invalid number of shards provided: " + shards)
+        print("Type -h for command reference")
+        exit(1)
+    if int(shards) and (stream or int(feather) or watch or tiled is not None or frames is not None):
+        print("Sharding can't be combined with -l, --feather, animation, tiled or watch mode")
+        print("Type -h for command reference")
+        exit(1)
+    if not prefetch.isdigit():
+        print("Invalid prefetch depth provided: " + prefetch)
+        print("Type -h for command reference")
+        exit(1)
+    if not read_size.isdigit() or int(read_size) < 1:
+        print("Invalid read size provided: " + read_size)
+        print("Type -h for command reference")
+        exit(1)
+    if max_memory is not None:
+        if not max_memory.isdigit() or int(max_memory) < 1:
+            print("Invalid memory limit provided: " + max_memory)
+            print("Type -h for command reference")
+            exit(1)
+        if stream or int(shards) or watch or tiled is not None or frames is not None:
+            print("A memory limit picks how to slice by itself, so it can't be combined with -l, --shards, animation,"
+                  " tiled or watch mode")
+            print("Type -h for command reference")
+            exit(1)
+        max_memory = int(max_memory) << 20
+    if normalize is not None or normalize_mode is not None:
+        if watch or tiled is not None or frames is not None:
+            print("Normalizing can't be combined with animation, tiled or watch mode")
+            print("Type -h for command reference")
+            exit(1)
+        if normalize_mode is not None and normalize_mode not in ImageUtils.NORMALIZE_MODES:
+            print("Invalid mode provided: " + normalize_mode)
+            print("Type -h for command reference")
+            exit(1)
+        try:
+            normalize = {'size': ImageUtils.parse_size(normalize) if normalize not in (None, 'first') else None,
+                         'mode': normalize_mode}
+        except ValueError as e:
+            print(e)
+            print("Type -h for command reference")
+            exit(1)
+    if outputs and (stream or int(shards) or max_memory is not None or int(feather) or normalize is not None or watch or
+                    tiled is not None or frames is not None or destinationdir == Output.STDOUT):
+        print("Several outputs can't be combined with -l, --shards, --max-memory, --feather, --normalize, animation,"
+              " tiled or watch mode, or written to stdout")
+        print("Type -h for command reference")
+        exit(1)
+    if index is not None and (watch or tiled is not None or frames is not None or outputs):
+        print("The source index is only used when slicing, not in animation, tiled, watch or fan-out mode")
+        print("Type -h for command reference")
+        exit(1)
+    if destinationdir == Output.STDOUT:
+        if watch or tiled is not None or frames is not None:
+            print("Only a sliced image can be written to stdout, not a watched, tiled or animated one")
+            print("Type -h for command reference")
+            exit(1)
+        # The sliced image goes to stdout, so everything we have to say goes to stderr instead
+        sys.stdout = sys.stderr
+    if layout is None and (grid is not None or weights is not None):
+        layout = 'grid' if grid is not None else 'strips'
+    if layout is not None:
+        if layout not in Layouts.LAYOUTS:
+            print("Invalid layout provided: " + layout)
+            print("Type -h for command reference")
+            exit(1)
+        try:
+            layout = {'layout': layout, 'grid': Layouts.parse_grid(grid) if grid is not None else None,
+                      'weights': Layouts.parse_weights(weights) if weights is not None else None}
+        except ValueError as e:
+            print(e)
+            print("Type -h for command reference")
+            exit(1)
+    if manifest is not None:
+        # Imported here since batch mode is the only thing that needs it
+        import Batch
+        try:
+            batch = Batch.read_manifest(manifest)
+        except (OSError, ValueError) as e:
+            print("Invalid manifest: {}".format(e))
+            exit(1)
+        results, summary = Batch.run_batch(batch, int(jobs) if jobs is not None else None)
+        Batch.print_report(results, summary)
+        exit(0 if not summary['failed'] else 1)
+    jobs = jobs if jobs is not None else '1'
+    prefetch = {'depth': int(prefetch), 'read_size': int(read_size) << 10} if int(prefetch) else None
+    # The jobs that decode the images also list the directories while scanning
+    scan = {'include': include, 'exclude': exclude, 'max_depth': None if depth == 'all' else int(depth),
+            'order': order, 'jobs': int(jobs)}
     if imgtype is None:
         print("No image format provided")
         exit(1)
+    if ppmformat not in PPM_FORMATS:
+        print("Invalid ppm format provided: " + ppmformat)
+        print("Type -h for command reference")
+        exit(1)
     if imgtype.lower() not in VALID_FORMATS:
         print("Invalid image format provided: " + imgtype)
         print("Type -h for command reference")
         exit(1)
+    if normalize is not None and imgtype.lower() == 'ppm':
+        print("Normalizing is not available for ppm images")
+        print("Type -h for command reference")
+        exit(1)
+    if int(shards) and imgtype.lower() != 'ppm':
+        print("Sharding is only available for ppm images")
+        print("Type -h for command reference")
+        exit(1)
+    try:
+        options = Output.parse_options(encode, FORMAT_ALIASES.get(imgtype.lower(), imgtype.lower()))
+    except ValueError as e:
+        print(e)
+        print("Type -h for command reference")
+        exit(1)
     else:
-        if method is None:
+        try:
+            outputs = [parse_output(output, method, imgtype, ppmformat, layout, encode) for output in outputs]
+        except ValueError as e:
+            print(e)
+            print("Type -h for command reference")
+            exit(1)
+        if method is None and not outputs:
             print("No method provided.")
             exit(1)
-        if method not in METHOD_KEY.keys():
+        if method is not None and method not in METHOD_KEY.keys():
             print("Invalid method provided")
             print("Type -h for command reference")
             exit(1)
@@ -67,12 +484,70 @@ def main(argvs):
                 filename += "slicedimage"
                 for i in range(5):
                     filename += chr(random.randint(48, 57))
-            if imgtype.lower() == 'ppm':
-                info = handleppm(filename, sourcedir, destinationdir, METHOD_KEY[method])
+            profiler = Profiling.Profiler() if profile is not None else Profiling.DISABLED
+            result_cache = None
+            if cache_dir is not None:
+                try:
+                    result_cache = ResultCache.ResultCache(cache_dir, int(cache_size) << 20, cache_key)
+                except OSError as e:
+                    print("Invalid result cache directory: {}".format(e))
+                    exit(1)
+            source_index = None
+            if index is not None:
+                try:
+                    source_index = SourceIndex.SourceIndex(index)
+                except sqlite3.Error as e:
+                    print("Invalid source index: {}".format(e))
+                    exit(1)
+            if cprofile is not None:
+                stats = cProfile.Profile()
+                stats.enable()
+            try:
+                if outputs:
+                    info = handlefanout(filename, sourcedir, destinationdir, imgtype.lower(), outputs, int(jobs),
+                                        profiler, scan)
+                elif watch:
+                    info = handlewatch(filename, sourcedir, destinationdir, imgtype.lower(), METHOD_KEY[method],
+                                       ppmformat, layout, scan, options)
+                elif tiled is not None:
+                    info = handletiled(filename, sourcedir, destinationdir, imgtype.lower(), METHOD_KEY[method], tiled,
+                                       int(budget) << 20, profiler, layout, scan)
+                elif frames is not None:
+                    info = handleanimation(filename, sourcedir, destinationdir, imgtype.lower(), METHOD_KEY[method],
+                                           int(frames), animation, int(duration), int(jobs), profiler, scan)
+                elif imgtype.lower() == 'ppm':
+                    info = handleppm(filename, sourcedir, destinationdir, METHOD_KEY[method], stream, ppmformat,
+                                     int(jobs), profiler, layout, scan, result_cache, int(feather), int(shards),
+                                     prefetch, max_memory, source_index)
+                else:
+                    info = handlegeneric(filename, sourcedir, destinationdir, imgtype, METHOD_KEY[method], int(jobs),
+                                         profiler, layout, scan, result_cache, options, normalize, int(feather),
+                                         prefetch, max_memory, source_index)
+            except SlicerError as e:
+                print(e)
+                exit(1)
+            finally:
+                if cprofile is not None:
+                    stats.disable()
+                    stats.dump_stats(cprofile)
+                if source_index is not None:
+                    source_index.close()
+            if profile is not None:
+                profiler.write(profile)
+            if result_cache is not None and tiled is None and frames is None and not outputs:
+                print(result_cache.report())
+            if outputs:
+                print('Images have been sliced. Products can be found in {} under the names {}'.format
+                      (info[0], ', '.join(info[1])))
+            elif frames is not None:
+                print('Images have been animated. Product can be found in {} under the name {}'.format
+                      (info[0], info[1]))
+            elif tiled is not None or watch:
+                print('Images have been sliced. Product can be found in {} under the name {}'.format
+                      (info[0], info[1]))
             else:
-                info = handlegeneric(filename, sourcedir, destinationdir, imgtype, METHOD_KEY[method])
-            print('Images have been sliced. Product can be found in {} under the name {}'.format
-                  (info[0], filename + '.' + imgtype))
+                print('Images have been sliced. Product can be found in {} under the name {}'.format
+                      (info[0], filename + '.' + imgtype))
             print('\n')
 
 if __name__ == '__main__':
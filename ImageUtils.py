@@ -1,117 +1,516 @@
+import math
 import os
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
+import Layouts
+import PPMCodec
+import Scanner
 
 
-def create_blend_generic(images, left_right=True):
+# Formats Pillow decodes top to bottom in a single tile. Decoding of these can be stopped after any row
+ROW_LIMITED_FORMATS = ('PNG', 'PPM')
+# Modes sources can be normalized to (see normalize_target)
+NORMALIZE_MODES = ['RGB', 'RGBA', 'L']
+# Filter used when a source has to be resampled to the size of the new image
+RESAMPLE = Image.BICUBIC
+# When a source is shrunk by more than this factor, it is first reduced by a whole factor (see Image.reduce), which is
+# far cheaper than filtering, and only the rest of the way is filtered. Pillow's docs show 3 to be indistinguishable
+# from filtering all the way
+REDUCING_GAP = 3.0
+
+
+def create_blend_generic(images, left_right=True, jobs=1, normalize=None, feather=0, prefetch=None):
     """
     Blends together even slices from a collection of jpgs to form one image. Function can slice to form a transition
     going top-down or left to right
 
-    This function assumes that all jpg images are of the same size and mode
-    :param images: Collection of paths to jpgs
+    Only one source image is open at a time: each one is opened, has its slice decoded (see load_strip) and pasted
+    into the new image, and is closed again before the next one is touched. So no matter how many images there are,
+    memory use stays at about one decoded image plus the new one
+
+    With more than one job the slices are decoded in a pool of threads (Pillow lets go of the GIL while decoding), so
+    that many images are decoded at the same time. The slices are still pasted in order, so the new image is the same
+    either way. Memory use then grows to about one decoded image per job
+
+    This function assumes that all jpg images are of the same size and mode, unless they are to be normalized
+    :param images: Collection of jpgs. Anything decode_strip takes will do: paths, file objects or PIL Images
     :param left_right: Whether or not the transition will be left to right or top to bottom
+    :param jobs: Number of images to decode at the same time
+    :param normalize: Optional (size, mode) tuple (see normalize_target). If given, the new image has that size and
+    mode, and every slice is resampled and converted to fit it (see decode_strip)
+    :param feather: Width in pixels of the band over which neighbouring slices are cross-faded (see seam_bands). Each
+    slice is decoded that much wider, and only the bands are blended, through a ramp mask made once (see
+    feather_ramp). 0 gives hard seams
+    :param prefetch: Optional Prefetch.Prefetcher the images are read through (see open_source), so the next images
+    are being read while one is being decoded
     :return: A PIL Image class of the new image
     """
-    # The way the slicing is performed is through PIL's cropping method. We simply takes equal crops from each
-    # image and stitch them together to form a new one
-    imagesl = []
-    croppedjpgs = []
-    # The images collection is just a list of paths. We need PIL classes to crop
-    for img in images:
-        imagesl.append(Image.open(img))
-    # Used to determine how much to take from each image
-    divisor = len(imagesl)
-    # Leftoff is our 'marker' variable. Will be used to determine where to start and stop on a particular image when
-    # cropping
-    leftoff = 0
-    # Get the jpg attributes so we can apply them to the new image
-    w, h, mode, size = imagesl[0].width, imagesl[0].height, imagesl[0].mode, imagesl[0].size
-    # If we are going left to right, the leftoff variable will go from left to right with respect to width
-    # If we are going top down, the leftoff variable will go from top to bottom with respect to height
-    c_w = int(w / divisor)
-    c_h = int(h / divisor)
+    # Get the jpg attributes so we can apply them to the new image. Opening an image only reads its header
+    if normalize is not None:
+        size, mode = normalize
+    elif isinstance(images[0], Image.Image):
+        mode, size = images[0].mode, images[0].size
+    else:
+        with Image.open(images[0]) as first:
+            mode, size = first.mode, first.size
+    w, h = size
+    new_img = Image.new(mode, size)
+    # If we are going left to right the slices run along the width, if we are going top down they run along the height
+    bounds = slice_bounds(w if left_right else h, len(images))
+    bands = seam_bands(bounds, feather)
+    # Every slice reaches over the bands on either side of it
+    spans = [(bands[i - 1][0] if 0 < i <= len(bands) else bounds[i],
+              bands[i][1] if i < len(bands) else bounds[i + 1]) for i in range(len(images))]
     if left_right:
-        for i in imagesl:
-            # Crop the image we are currently on using leftoff to determine the bounds for the left and right
-            # (top and bottom remain constant)
-            croppedjpgs.append(i.crop((leftoff, 0, int(leftoff + c_w) % (w+1), h)))
-            # Move the boundaries
-            leftoff = ((leftoff + c_w) % w)
-        # Setup a new image
-        new_img = Image.new(mode, size)
-        # Reset the bounds
-        leftoff = 0
-        # This is the same process as the cropping, except we're just pasting now
-        for cropped in croppedjpgs:
-            new_img.paste(cropped, (int(leftoff), 0, int(leftoff + c_w) % (w+1), h))
-            leftoff = ((leftoff + c_w) % w)
-    # Top down process is the exact same as left right except the left and right bounds remain constant, and the top
-    # and bottom bounds change (using leftoff)
+        boxes = [(start, 0, stop, h) for start, stop in spans]
+    else:
+        boxes = [(0, start, w, stop) for start, stop in spans]
+    ramp = feather_ramp(bands[0][1] - bands[0][0], h if left_right else w, left_right) if bands else None
+
+    def paste(i, strip):
+        if i == 0 or ramp is None:
+            new_img.paste(strip, boxes[i][:2])
+            return
+        # The band before this slice already holds the previous slice, which the ramp fades into this one
+        band = bands[i - 1][1] - bands[i - 1][0]
+        if left_right:
+            new_img.paste(strip.crop((0, 0, band, h)), boxes[i][:2], ramp)
+            new_img.paste(strip.crop((band, 0, strip.width, h)), (boxes[i][0] + band, 0))
+        else:
+            new_img.paste(strip.crop((0, 0, w, band)), boxes[i][:2], ramp)
+            new_img.paste(strip.crop((0, band, w, strip.height)), (0, boxes[i][1] + band))
+
+    def decode(image, box):
+        # Images are only opened here, in the decoding thread, so waiting on a prefetched image holds up nothing else
+        return decode_strip(open_source(image, prefetch), box, normalize)
+
+    if jobs > 1:
+        with ThreadPoolExecutor(jobs) as pool:
+            # map hands the slices back in the order of the images, whichever one finishes decoding first
+            for i, strip in enumerate(pool.map(decode, images, boxes)):
+                paste(i, strip)
     else:
-        for i in imagesl:
-            croppedjpgs.append(i.crop((0, int(leftoff), w, int(leftoff + c_h) % (h + 1))))
-            leftoff = ((leftoff + c_h) % h)
-        new_img = Image.new(mode, size)
-        leftoff = 0
-        for cropped in croppedjpgs:
-            new_img.paste(cropped, (0, int(leftoff), w, int(leftoff + (h / divisor)) % (h + 1)))
-            leftoff = ((leftoff + c_h) % h)
+        for i, path in enumerate(images):
+            paste(i, decode(path, boxes[i]))
     # Return the new image (PIL class)
     return new_img
 
 
+def open_source(source, prefetch=None):
+    """
+    Gets a source image ready to be opened by Pillow
+    :param source: Path to an image, a binary file object holding one, or a PIL Image
+    :param prefetch: Optional Prefetch.Prefetcher. Paths are handed out by it, already read into memory
+    :return: The source, or a file object holding it if it's a path and there is a prefetcher
+    """
+    if prefetch is not None and isinstance(source, str):
+        return prefetch.open(source)
+    return source
+
+
+def decode_strip(source, box, normalize=None):
+    """
+    Opens an image, decodes one slice of it (see load_strip) and closes it again. Images that are already open are
+    simply cropped, and left open
+    :param source: Path to an image, a binary file object holding one, or a PIL Image
+    :param box: The (left, top, right, bottom) box to crop
+    :param normalize: Optional (size, mode) tuple (see normalize_target). If given, the box is in the coordinates of
+    an image of that size, and the slice is resampled and converted from the matching part of the source (see
+    load_normalized_strip)
+    :return: A PIL Image of the slice
+    """
+    if isinstance(source, Image.Image):
+        return source.crop(box) if normalize is None else resample_strip(source, box, *normalize)
+    with Image.open(source) as img:
+        return load_strip(img, box) if normalize is None else load_normalized_strip(img, box, *normalize)
+
+
+def limit_rows(img, bottom):
+    """
+    Makes an image that has been opened but not loaded yet stop decoding at a given row, if its format allows (see
+    ROW_LIMITED_FORMATS). The image then pretends to end at that row
+    :param img: A PIL Image that has not been loaded yet
+    :param bottom: Number of rows to decode
+    """
+    w, h = img.size
+    tile = img.tile[0] if len(img.tile) == 1 else None
+    if (bottom < h and img.format in ROW_LIMITED_FORMATS and tile is not None and tuple(tile[1]) == (0, 0, w, h)
+            and not img.info.get('interlace')):
+        # Pretend the image ends at the bottom of the slice, so the decoder never gets to the rows below it
+        img.tile = [(tile[0], (0, 0, w, bottom)) + tuple(tile[2:])]
+        img._size = (w, bottom)
+
+
+def load_strip(img, box):
+    """
+    Crops a slice out of an image that has been opened but not loaded yet, decoding as little of the image as its
+    format allows. Formats that are decoded top to bottom (see ROW_LIMITED_FORMATS) stop decoding at the bottom of the
+    slice. Everything else is decoded in full, but since the decoded image is only referenced by the image object,
+    it is dropped as soon as the image is closed
+    :param img: A PIL Image that has not been loaded yet
+    :param box: The (left, top, right, bottom) box to crop
+    :return: A PIL Image of the slice
+    """
+    limit_rows(img, box[3])
+    return img.crop(box)
+
+
+def load_normalized_strip(img, box, size, mode):
+    """
+    The normalizing counterpart of load_strip: makes a slice of an image of the given size and mode out of an image
+    of any size and mode, decoding as little as possible. Jpegs that are at least twice as big as the new image are
+    decoded at a half, quarter or eighth of their size straight away (draft mode), and, when converting to greyscale,
+    without their color. Formats decoded top to bottom stop below the last row the slice is resampled from
+    :param img: A PIL Image that has not been loaded yet
+    :param box: The (left, top, right, bottom) box of the slice, in the coordinates of the new image
+    :param size: The (width, height) of the new image
+    :param mode: The mode of the new image
+    :return: A PIL Image of the slice
+    """
+    extent = img.size
+    if img.format == 'JPEG' and img.size != size:
+        drafted = img.draft('L' if mode == 'L' else None, size)
+        if drafted is not None:
+            # A drafted jpeg is rounded up to whole pixels, but its content spans exactly the draft box
+            extent = drafted[1][2:]
+    scale = extent[1] / size[1]
+    # The filter reaches a couple of source pixels past the bottom of the slice for every pixel of the new image
+    limit_rows(img, math.ceil(box[3] * scale + 2 * max(scale, 1)) + 1)
+    return resample_strip(img, box, size, mode, extent)
+
+
+def resample_strip(img, box, size, mode, extent=None):
+    """
+    Makes a slice of an image of the given size and mode out of an image of any size and mode. The part of the image
+    that covers the slice is resampled, and converted to the mode. When the image is a whole multiple of the new
+    image's size, it is reduced (see Image.reduce) rather than filtered
+    :param img: A PIL Image
+    :param box: The (left, top, right, bottom) box of the slice, in the coordinates of the new image
+    :param size: The (width, height) of the new image
+    :param mode: The mode of the new image
+    :param extent: The (width, height) the content of the image spans, if that isn't its size (see
+    load_normalized_strip)
+    :return: A PIL Image of the slice
+    """
+    extent = extent or img.size
+    scale_x, scale_y = extent[0] / size[0], extent[1] / size[1]
+    if img.mode != mode and img.mode in ('1', 'P'):
+        # Palette and bilevel images can't be filtered, only sampled, so they are converted first
+        img = img.convert('RGBA' if mode == 'RGBA' or 'transparency' in img.info else 'RGB')
+    if scale_x == scale_y == 1:
+        strip = img.crop(box)
+    else:
+        # Multiplying before dividing keeps the far edge exactly on the edge of the image
+        source_box = (box[0] * extent[0] / size[0], box[1] * extent[1] / size[1],
+                      box[2] * extent[0] / size[0], box[3] * extent[1] / size[1])
+        if min(scale_x, scale_y) >= 1 and all(float(value).is_integer() for value in (scale_x, scale_y) + source_box):
+            strip = img.reduce((int(scale_x), int(scale_y)), tuple(int(value) for value in source_box))
+        else:
+            strip = img.resize((box[2] - box[0], box[3] - box[1]), RESAMPLE, source_box, REDUCING_GAP)
+    return strip if strip.mode == mode else strip.convert(mode)
+
+
+def normalize_target(source, size=None, mode=None):
+    """
+    Works out what to normalize a collection of images to. Anything not given is taken from the first image. Its mode
+    is kept if it is one of NORMALIZE_MODES, and turned into RGB (or RGBA, if the image has transparency) otherwise
+    :param source: The first image. Anything decode_strip takes will do. Only its header is read
+    :param size: Optional (width, height) of the new image
+    :param mode: Optional mode of the new image (one of NORMALIZE_MODES)
+    :return: A (size, mode) tuple for create_blend_generic and composite_generic
+    """
+    if isinstance(source, Image.Image):
+        first_size, first_mode, transparent = source.size, source.mode, 'transparency' in source.info
+    else:
+        with Image.open(source) as first:
+            first_size, first_mode, transparent = first.size, first.mode, 'transparency' in first.info
+    if mode is None:
+        if first_mode in NORMALIZE_MODES:
+            mode = first_mode
+        else:
+            mode = 'RGBA' if transparent or first_mode.endswith('A') else 'RGB'
+    if mode not in NORMALIZE_MODES:
+        raise ValueError('Invalid mode: {}'.format(mode))
+    return tuple(size or first_size), mode
+
+
+def parse_size(text):
+    """
+    Parses an image size given as <width>x<height>, e.g. 1920x1080
+    :param text: The size
+    :return: A (width, height) tuple. Raises a ValueError if the text isn't a size
+    """
+    width, _, height = text.lower().partition('x')
+    if not width.isdigit() or not height.isdigit() or not int(width) or not int(height):
+        raise ValueError('Invalid size: {}'.format(text))
+    return int(width), int(height)
+
+
+def slice_bounds(extent, count):
+    """
+    Splits a length (width or height) into count consecutive slices that are as even as possible. Any leftover pixels
+    are spread over the slices instead of being dropped, so the slices always cover the whole extent
+    :param extent: The width or height being sliced
+    :param count: The number of slices
+    :return: A list of count + 1 boundaries. Slice i runs from bounds[i] up to (not including) bounds[i + 1]
+    """
+    return [i * extent // count for i in range(count + 1)]
+
+
+def seam_bands(bounds, feather):
+    """
+    Works out the bands around the seams between slices over which neighbouring slices are cross-faded. Every band is
+    centered on its seam, and they are all as wide as the feather, or as the narrowest slice if that is narrower, so
+    that no two bands ever overlap
+    :param bounds: Slice boundaries (see slice_bounds)
+    :param feather: Width of the bands
+    :return: A list of (start, stop) tuples, one per seam. Empty if there is nothing to feather
+    """
+    feather = min([feather] + [bounds[i + 1] - bounds[i] for i in range(len(bounds) - 1)])
+    if feather <= 0:
+        return []
+    return [(bound - feather // 2, bound - feather // 2 + feather) for bound in bounds[1:-1]]
+
+
+def feather_ramp(width, length, left_right=True):
+    """
+    Makes the mask a band is cross-faded through. It is made once per blend and used for every band
+    :param width: Width of the bands
+    :param length: Length of the seams (the height of the image for left to right slices, its width otherwise)
+    :param left_right: Whether the slices run left to right (so the ramp runs along the width) or top down
+    :return: An 'L' image that ramps up from the slice before a seam (0) to the slice after it (255)
+    """
+    ramp = bytes(round(255 * (i + 0.5) / width) for i in range(width))
+    if left_right:
+        return Image.frombytes('L', (width, 1), ramp).resize((width, length), Image.NEAREST)
+    return Image.frombytes('L', (1, width), ramp).resize((length, width), Image.NEAREST)
+
+
+def transition_bounds(extent, count, progress):
+    """
+    Slice boundaries part way through a sweeping transition. At the start (progress 0) the first image covers the
+    whole extent and the others are squeezed against the far edge; as progress goes up the boundaries slide back until,
+    at progress 1, they are the even slices create_blend_generic makes (see slice_bounds)
+    :param extent: The width or height being sliced
+    :param count: The number of slices
+    :param progress: How far along the transition is, from 0 to 1
+    :return: A list of count + 1 boundaries, in the same form slice_bounds returns them
+    """
+    return [0] + [extent - round(progress * (extent - bound)) for bound in slice_bounds(extent, count)[1:-1]] + [extent]
+
+
+def load_source(source, mode=None):
+    """
+    Opens and fully decodes an image, so it can be kept around and cropped again and again without being read a second
+    time
+    :param source: Path to an image, a binary file object holding one, or a PIL Image
+    :param mode: Mode to convert the image to, if it isn't in it already
+    :return: A loaded PIL Image
+    """
+    img = source if isinstance(source, Image.Image) else Image.open(source)
+    # Loading a single frame image also closes the file it was opened from
+    img.load()
+    return img if mode is None or img.mode == mode else img.convert(mode)
+
+
+def iter_transition_frames(images, frames, left_right=True, jobs=1):
+    """
+    Renders the frames of a sweeping transition between a collection of images (see transition_bounds). Every image
+    is decoded once up front and kept in memory. Frames are then drawn onto one canvas, and each frame only pastes the
+    parts of each slice that weren't already covered by that same image in the frame before. Since the boundaries
+    only move a little from one frame to the next, a frame costs a few thin strips of pasting rather than a whole new
+    blend, and rendering many frames costs little more than decoding the images once
+
+    The same canvas is handed out for every frame and is drawn over as soon as the next one is asked for, so copy a
+    frame if it has to be kept
+
+    This function assumes that all images are of the same size
+    :param images: Collection of images. Anything decode_strip takes will do: paths, file objects or PIL Images
+    :param frames: Number of frames. The first shows only the first image, the last is the finished blend
+    :param left_right: Whether or not the transition will be left to right or top to bottom
+    :param jobs: Number of images to decode at the same time
+    :return: A generator of PIL Images, one per frame
+    """
+    first = load_source(images[0])
+    if jobs > 1:
+        with ThreadPoolExecutor(jobs) as pool:
+            sources = [first] + list(pool.map(load_source, images[1:], [first.mode] * (len(images) - 1)))
+    else:
+        sources = [first] + [load_source(image, first.mode) for image in images[1:]]
+    w, h = first.size
+    canvas = Image.new(first.mode, first.size)
+    previous = None
+    for frame in range(frames):
+        bounds = transition_bounds(w if left_right else h, len(sources), frame / (frames - 1) if frames > 1 else 1)
+        for i, source in enumerate(sources):
+            start, end = bounds[i], bounds[i + 1]
+            if previous is None:
+                spans = [(start, end)]
+            else:
+                # Only the part of this slice that was covered by another image in the last frame has to be pasted
+                spans = [(start, min(end, previous[i])), (max(start, previous[i + 1]), end)]
+            for low, high in spans:
+                if low < high:
+                    box = (low, 0, high, h) if left_right else (0, low, w, high)
+                    canvas.paste(source.crop(box), box[:2])
+        previous = bounds
+        yield canvas
+
+
+def composite_generic(images, runs, jobs=1, normalize=None, prefetch=None):
+    """
+    Builds a new image out of any layout of the source images (see Layouts.build_runs), such as grids, diagonal bands
+    or wedges. The layout is turned into an index mask once, and every image is then pasted through the part of the
+    mask that belongs to it, so all the per pixel work happens inside Pillow. Like create_blend_generic, only the part
+    of each image that the layout actually uses is decoded (see decode_strip), one image at a time unless jobs is
+    greater than one
+
+    This function assumes that all images are of the same size and mode, unless they are to be normalized
+    :param images: Collection of images. Anything decode_strip takes will do: paths, file objects or PIL Images
+    :param runs: The layout's runs
+    :param jobs: Number of images to decode at the same time
+    :param normalize: Optional (size, mode) tuple (see create_blend_generic)
+    :param prefetch: Optional Prefetch.Prefetcher the images are read through (see create_blend_generic)
+    :return: A PIL Image class of the new image
+    """
+    if normalize is not None:
+        size, mode = normalize
+    elif isinstance(images[0], Image.Image):
+        mode, size = images[0].mode, images[0].size
+    else:
+        with Image.open(images[0]) as first:
+            mode, size = first.mode, first.size
+    new_img = Image.new(mode, size)
+    parts = [(images[i], box, part) for i, (box, part) in layout_parts(runs, size[0], len(images)).items()]
+
+    def decode(image, box):
+        return decode_strip(open_source(image, prefetch), box, normalize)
+
+    if jobs > 1:
+        with ThreadPoolExecutor(jobs) as pool:
+            strips = pool.map(decode, [part[0] for part in parts], [part[1] for part in parts])
+            for (image, box, part), strip in zip(parts, strips):
+                new_img.paste(strip, box[:2], part)
+    else:
+        for image, box, part in parts:
+            new_img.paste(decode(image, box), box[:2], part)
+    return new_img
+
+
+def layout_parts(runs, width, count):
+    """
+    Cuts a layout's index mask (see Layouts.index_mask) up into the part every image fills
+    :param runs: The layout's runs (see Layouts.build_runs)
+    :param width: Width of the new image
+    :param count: Number of images
+    :return: A dictionary mapping image numbers to the (left, top, right, bottom) box around the image's part and the
+    mask of the part within that box. Images the layout doesn't use are left out
+    """
+    mask = Layouts.index_mask(runs, width)
+    parts = {}
+    for i in range(count):
+        part = mask.point([255 if value == i else 0 for value in range(256)])
+        box = part.getbbox()
+        if box is not None:
+            parts[i] = (box, part.crop(box))
+    return parts
+
+
+def layout_spans(runs, width):
+    """
+    Turns a layout's runs into the spans of a flat pixel buffer (see get_pixel_data) that each image fills. Spans that
+    follow one another in the buffer are merged, so e.g. a top down strip is a single span
+    :param runs: The layout's runs (see Layouts.build_runs)
+    :param width: Width of the new image
+    :return: A dictionary mapping image numbers to lists of (start, stop) sample offsets
+    """
+    spans = {}
+    for y, row in enumerate(runs):
+        base = y * width * 3
+        for start, stop, index in row:
+            start, stop = base + start * 3, base + stop * 3
+            image_spans = spans.setdefault(index, [])
+            if image_spans and image_spans[-1][1] == start:
+                image_spans[-1] = (image_spans[-1][0], stop)
+            else:
+                image_spans.append((start, stop))
+    return spans
+
+
+def composite_ppm(images, runs, magic_no='P3', cache=None):
+    """
+    The ppm counterpart of composite_generic. Each image fills its spans of the new image's pixel buffer (see
+    layout_spans) with one slice copy per span, so no pixel is ever touched from Python. Images are read one at a
+    time, unless they are already in the cache
+
+    This function assumes that all ppm images are of the same size, and that they are all valid ppm files
+    :param images: List of paths to valid ppm files
+    :param runs: The layout's runs (see Layouts.build_runs)
+    :param magic_no: Magic number of the new image, 'P3' (ascii) or 'P6' (binary)
+    :param cache: Optional PPMCodec.PPMCache the sources have already been parsed into
+    :return: A tuple of the new image's header dictionary and its pixel buffer
+    """
+    if cache is not None:
+        header = dict(cache.get(images[0]).header, magic_number=magic_no)
+    else:
+        header = dict(extract_ppm_data(images[0]), magic_number=magic_no)
+    width = header['width']
+    new_pixels = bytearray(width * header['height'] * 3)
+    for i, spans in sorted(layout_spans(runs, width).items()):
+        pixels = cache.get(images[i]).pixels if cache is not None else PPMCodec.load_pixels(images[i])[1]
+        for start, stop in spans:
+            new_pixels[start:stop] = pixels[start:stop]
+    return header, new_pixels
+
+
+def stream_composite_ppm(images, runs, file, magic_no='P3', cache=None):
+    """
+    Streaming version of composite_ppm: all sources are read row by row in lockstep, and every row of the new image is
+    written as soon as it is stitched together (see stream_blend_ppm)
+    :param images: List of paths to valid ppm files
+    :param runs: The layout's runs (see Layouts.build_runs)
+    :param file: A binary file object the new image is written to
+    :param magic_no: Magic number of the new image, 'P3' (ascii) or 'P6' (binary)
+    :param cache: Optional PPMCodec.PPMCache the sources have already been parsed into (see get_ppm_rows)
+    :return: The new image's header dictionary
+    """
+    if cache is not None:
+        header = dict(cache.get(images[0]).header, magic_number=magic_no)
+    else:
+        header = dict(extract_ppm_data(images[0]), magic_number=magic_no)
+    PPMCodec.write_header(file, header)
+    readers = [get_ppm_rows(img, cache=cache) for img in images]
+    try:
+        for row, rows in zip(runs, zip(*readers)):
+            for start, stop, index in row:
+                PPMCodec.write_pixels(file, rows[index][start * 3:stop * 3], magic_no)
+    finally:
+        for reader in readers:
+            reader.close()
+    return header
+
+
 def get_pixel_data(image):
     """
-    Provides structure for accessing a ppm files data in the form of a dictionary. The dictionary returned can be used
-    by providing a tuple in the form (y, x) to receive the pixel's rgb data at that point (y is the row, x is the col)
+    Provides access to a ppm file's pixel data in the form of a flat buffer of rgb samples. The buffer is laid out row
+    after row, so the pixel at row y and column x has its (r, g, b) samples at index (y * width + x) * 3 onward
     :param image: Path to a ppm file
-    :return: A dictionary mapping tuples of (y, x) pairs to a tuple of (r, g, b)
-    """
-    data = dict()
-  
-    with open(image) as i:
-        # Extract the dimensions and all the lines past the first three
-        lines = i.readlines()
-        w, h = int(lines[1].split()[0]), int(lines[1].split()[1])
-        col = lines[3:]
-        x = y = 0
-        # We loop over the lines three at a time
-        for rgb in zip(col[0::3], col[1::3], col[2::3]):
-            # Setup a key value pair
-            data[(x, y)] = rgb
-            # Increase the y (going forward one column)
-            y += 1
-            # If we are out of bounds
-            if y > w-1:
-                # Go back to column one and increase the row
-                y = 0
-                x += 1
-    return data
+    :return: An array('B') holding width * height * 3 samples
+    """
+    return PPMCodec.read_ppm(image)[1]
 
 
 def extract_ppm_data(image):
     """
-    Basic utility function that just returns a dictionary mapping basic ppm attributes to their values
+    Basic utility function that just returns a dictionary mapping basic ppm attributes to their values. Only the header
+    of the file is read
     :param image: Path to a ppm file
     :return: Dictionary mapping string attributes to values
     """
-    d = {}
-    with open(image) as f:
-        lines = f.readlines()
-        dims = lines[1].split()
-        depth = lines[2]
-        magic_no = lines[0]
-        w = int(dims[0])
-        h = int(dims[1])
-        d['width'] = w
-        d['height'] = h
-        d['depth'] = depth
-        d['magic_number'] = magic_no
-        d['header'] = lines[:3]
-    return d
+    return PPMCodec.read_ppm_header(image)
 
 
-def create_blend_ppm(images, left_right=True):
+def create_blend_ppm(images, left_right=True, magic_no='P3', cache=None, jobs=1, feather=0):
     """
     Blends together even slices from a collection of ppms to form one image. Function can slice to form a transition
     going top-down or left to right
@@ -144,98 +543,168 @@ def create_blend_ppm(images, left_right=True):
     |246813579| be the first thrid of rows from the first parent image etc.
     |k9l1m2n3o|
 
+    The pixel data of every image is turned into a flat buffer of samples (see PPMCodec.load_pixels), so both
+    transitions come down to copying slices of one buffer into another. Binary (P6) sources are memory-mapped, so
+    their slices are copied straight out of the mapped file without ever being decoded
+
+    This function assumes that all ppm images are of the same size, and that they are all valid ppm files
+
+    :param images: List of paths to valid ppm files
+    :param left_right: Whether or not the blend transition will be left to right or top down (if false)
+    :param magic_no: Magic number of the new image, 'P3' (ascii) or 'P6' (binary)
+    :param cache: Optional PPMCodec.PPMCache the sources have already been parsed into. Without one every source is
+    read from disk here
+    :param jobs: Number of processes to parse the sources with. With more than one, all sources are parsed up front
+    (see PPMCodec.PPMCache.preload) and held in memory at the same time
+    :param feather: Width in pixels of the band over which neighbouring slices are cross-faded (see seam_bands). The
+    bands of both neighbours are handed to Pillow, which blends them through a ramp mask made once (see
+    feather_ramp), so the extra work only covers the bands. 0 gives hard seams
+    :return: A tuple of the new image's header dictionary and its pixel buffer
+    """
+    if cache is None and jobs > 1:
+        cache = PPMCodec.PPMCache()
+    if cache is not None:
+        cache.preload(images, jobs)
+    # Extract the header of the first image. The new image gets the same dimensions and depth
+    if cache is not None:
+        header = dict(cache.get(images[0]).header, magic_number=magic_no)
+    else:
+        header = dict(extract_ppm_data(images[0]), magic_number=magic_no)
+    width = header['width']
+    height = header['height']
+    new_pixels = bytearray(width * height * 3)
+    bounds = slice_bounds(width if left_right else height, len(images))
+    bands = seam_bands(bounds, feather)
+    ramp = feather_ramp(bands[0][1] - bands[0][0], height if left_right else width, left_right) if bands else None
+    previous = None
+    for i, img in enumerate(images):
+        pixels = cache.get(img).pixels if cache is not None else PPMCodec.load_pixels(img)[1]
+        if left_right:
+            # Copy this image's columns out of every row. Each row is width * 3 samples long
+            start, stop = bounds[i] * 3, bounds[i + 1] * 3
+            for row in range(0, width * height * 3, width * 3):
+                new_pixels[row + start:row + stop] = pixels[row + start:row + stop]
+        # Top down is much easier than left-right, since the rows of each slice are contiguous in the buffer we only
+        # have one copy to make per image
+        else:
+            start, stop = bounds[i] * width * 3, bounds[i + 1] * width * 3
+            new_pixels[start:stop] = pixels[start:stop]
+        if i > 0 and ramp is not None:
+            blend_ppm_band(new_pixels, previous, pixels, bands[i - 1], width, height, left_right, ramp)
+        previous = pixels
+    return header, new_pixels
+
+
+def blend_ppm_band(new_pixels, before, after, band, width, height, left_right, ramp):
+    """
+    Cross-fades the band around one seam of a ppm blend (see seam_bands). The band is cut out of both neighbouring
+    sources and blended by Pillow through the ramp, so no pixel is touched from Python
+    :param new_pixels: Pixel buffer of the new image
+    :param before: Pixel buffer of the source before the seam
+    :param after: Pixel buffer of the source after the seam
+    :param band: The band's (start, stop) columns (left to right) or rows (top down)
+    :param width: Width of the images
+    :param height: Height of the images
+    :param left_right: Whether the slices run left to right or top down
+    :param ramp: The mask to blend through (see feather_ramp)
+    """
+    if left_right:
+        # The band is a column of spans, one per row
+        spans = [(row + band[0] * 3, row + band[1] * 3) for row in range(0, width * height * 3, width * 3)]
+        size = (band[1] - band[0], height)
+    else:
+        spans = [(band[0] * width * 3, band[1] * width * 3)]
+        size = (width, band[1] - band[0])
+    first = Image.frombytes('RGB', size, b''.join(before[start:stop] for start, stop in spans))
+    second = Image.frombytes('RGB', size, b''.join(after[start:stop] for start, stop in spans))
+    blended = memoryview(Image.composite(second, first, ramp).tobytes())
+    offset = 0
+    for start, stop in spans:
+        new_pixels[start:stop] = blended[offset:offset + stop - start]
+        offset += stop - start
+
+
+def stream_blend_ppm(images, file, left_right=True, magic_no='P3', cache=None):
+    """
+    Streaming version of create_blend_ppm. Rather than building the new image in memory and returning it, the sources
+    are read row by row and every finished row of the new image is written straight to the destination. Memory use is
+    bounded by one row from each source, no matter how tall the images are
+
+    For left to right transitions all sources are read in lockstep: row y of the new image is stitched together from
+    row y of every source. For top down transitions the sources are read one after another, each one only up until
+    the end of its slice. Binary (P6) sources are memory-mapped, so their rows are written out as spans of the mapped
+    file without being decoded
+
     This function assumes that all ppm images are of the same size, and that they are all valid ppm files
 
     :param images: List of paths to valid ppm files
+    :param file: A binary file object the new image is written to
     :param left_right: Whether or not the blend transition will be left to right or top down (if false)
-    :return: A string holding the new ppm image data
-    """
-    new_image_data = []
-    # Used to determine how much to take from each image
-    divisor = len(images)
-    # Leftoff is our 'marker' variable. Will be used to determine where to start and stop on a particular image when
-    # cropping
-    leftoff = 0
+    :param magic_no: Magic number of the new image, 'P3' (ascii) or 'P6' (binary)
+    :param cache: Optional PPMCodec.PPMCache the sources have already been parsed into (see get_ppm_rows)
+    :return: The new image's header dictionary
+    """
+    if cache is not None:
+        header = dict(cache.get(images[0]).header, magic_number=magic_no)
+    else:
+        header = dict(extract_ppm_data(images[0]), magic_number=magic_no)
+    width = header['width']
+    height = header['height']
+    PPMCodec.write_header(file, header)
     if left_right:
-        # Extract image data
-        img_data = extract_ppm_data(images[0])
-        # Save the width, height and append the header onto the end of the new image
-        width = img_data['width']
-        height = img_data['height']
-        new_image_data += img_data['header']
-        # Get pixel data so we can actually use y,x pairs
-        datas = [get_pixel_data(img) for img in images]
-        # Go from top row to bottom row
-        for h in range(int(height)):
-            # We're going to crop a piece from each image
-            for d in datas:
-                # Go only up until the bounds specified and then increase the bounds, paying respect to the width
-                # using modulus to ensure no out of bounds errors
-                for w in range(int(leftoff) % width, int(leftoff + (width / divisor)) % (width+1)):
-                    new_image_data.append(''.join(d[(h, w)]))
-                leftoff = (leftoff + (width / divisor)) % width
-    # Top down is much easier than left-right, we just have to copy chunks, so we don't even need the
-    # datas, we just do simple string manipulation
+        bounds = slice_bounds(width, len(images))
+        readers = [get_ppm_rows(img, cache=cache) for img in images]
+        try:
+            # Since the spans of a row are written in order there is no need to stitch the row together first
+            for rows in zip(*readers):
+                for i, row in enumerate(rows):
+                    PPMCodec.write_pixels(file, row[bounds[i] * 3:bounds[i + 1] * 3], magic_no)
+        finally:
+            for reader in readers:
+                reader.close()
     else:
-        for img in images:
-            with open(img) as file:
-                lines = file.readlines()
-                new_image_data += lines[int(leftoff):int(leftoff + (len(lines) / divisor))]
-                leftoff += len(lines) / divisor
-    return ''.join(new_image_data)
+        bounds = slice_bounds(height, len(images))
+        for i, img in enumerate(images):
+            rows = get_ppm_rows(img, bounds[i], cache)
+            for _ in range(bounds[i + 1] - bounds[i]):
+                PPMCodec.write_pixels(file, next(rows), magic_no)
+            rows.close()
+    return header
 
 
-def retrieve_valid_files(path, go_deep=False, *suffixes):
+def get_ppm_rows(image, skip=0, cache=None):
+    """
+    Reads the rows of a ppm file one at a time (see PPMCodec.iter_rows). If a cache is given, rows are served from
+    the pixels it already holds, and the file is only read again if the cache didn't keep them
+    :param image: Path to a ppm file
+    :param skip: Number of rows at the top of the image to pass over
+    :param cache: Optional PPMCodec.PPMCache
+    :return: A generator of row buffers. Closing it closes the file
+    """
+    if cache is not None:
+        yield from cache.get(image).iter_rows(skip)
+        return
+    with open(image, 'rb') as source:
+        yield from PPMCodec.iter_rows(source, PPMCodec.read_header(source), skip)
+
+
+def retrieve_valid_files(path, go_deep=False, *suffixes, include=None, exclude=None, max_depth=None, order='name',
+                         jobs=1):
     """
     Retrieves files with the specified suffixes. Multiple suffixes are allowed. If go_deep is specified the function
-    checks lower folders for hte proper files
+    checks lower folders for the proper files as well. The directory is walked by Scanner.scan_files, which takes the
+    remaining keyword arguments; use it directly to work on the files while they are still being found
     :param path: Path to a directory
     :param go_deep: Boolean indicating if the function should check lower and lower folders
-    :param suffixes: Proper file suffixes
-    :return: A list of paths to valid folders
-    """
-    path = path.replace('/', '\\')
-    # Keeping a list of found, valid files
-    files = []
-    # Directories will only be used if go-deep is specified
-    directories = [path]
-    while directories:
-        # Pop the latest directory
-        currdir = directories.pop()
-        # If that directory does exist (in place for the user-specified dir)
-        if os.path.exists(currdir):
-            # Try to scan it
-            try:
-                file_list = list(os.scandir(currdir))
-                for i in file_list:
-                    # If we aren't going deep we just check for file and if tit has hte suffix we need we append.
-                    # If no suffixes are specified we grab all the files found
-                    if not go_deep:
-                        if i.is_file():
-                            if not suffixes:
-                                files.append(i.path)
-                            else:
-                                if os.path.splitext(i.name)[1] in suffixes:
-                                    files.append(i.path)
-                    # Go deep was specified, so for each directory found we append it to the directory list for later
-                    # iteration
-                    else:
-                        if i.is_dir():
-                            directories.append(i.path)
-                        # Same file checking as above
-                        elif i.is_file():
-                            if not suffixes:
-                                files.append(i.path)
-                            else:
-                                if os.path.splitext(i.name)[1] in suffixes:
-                                    files.append(i.path)
-            # Windows can be tricky sometimes in terms of folder access, so if we get an error, we just print and move
-            # to the next dir
-            except WindowsError as e:
-                print(e)
-        # If the initial dir is invalid, we can't do anything, so we return None
-        else:
-            return None
-    # Return the files sorted alphabetically
-    return sorted(files)
-
+    :param suffixes: Proper file suffixes. They are compared case-insensitively
+    :param include: Optional list of globs or compiled regular expressions files have to match
+    :param exclude: Optional list of globs or compiled regular expressions for files and folders to leave out
+    :param max_depth: How many levels of folders to go down when going deep. None has no limit
+    :param order: How to order the files of every folder (see Scanner.ORDERS)
+    :param jobs: Number of folders to list at the same time
+    :return: A list of paths to valid files, or None if the path isn't a directory
+    """
+    # If the initial dir is invalid, we can't do anything, so we return None
+    if not os.path.isdir(path):
+        return None
+    return list(Scanner.scan_files(path, suffixes, include, exclude, max_depth if go_deep else 0, order, jobs))
@@ -0,0 +1,222 @@
+import math
+from bisect import bisect_right
+from fractions import Fraction
+from PIL import Image
+
+# Ways the new image can be divided between the source images
+#   strips - even (or weighted) slices, left to right or top down. What create_blend_generic and create_blend_ppm make
+#   grid - a grid of cells, handed out to the images row by row, starting over at the first image if there are more
+#          cells than images
+#   diagonal - (weighted) bands running from the bottom left to the top right, in order from the top left corner
+#   radial - (weighted) wedges around the center, clockwise from straight up
+LAYOUTS = ['strips', 'grid', 'diagonal', 'radial']
+
+
+def weighted_bounds(extent, weights):
+    """
+    Splits a length into consecutive slices sized in proportion to a list of weights. The boundaries are worked out
+    with exact fractions and rounded down, so leftover pixels are spread over the slices instead of being dropped and
+    the slices always cover the whole extent. Even weights give the same boundaries as ImageUtils.slice_bounds
+    :param extent: The length being sliced
+    :param weights: List of positive numbers, one per slice
+    :return: A list of len(weights) + 1 boundaries. Slice i runs from bounds[i] up to (not including) bounds[i + 1]
+    """
+    weights = [Fraction(weight) for weight in weights]
+    if not weights or min(weights) <= 0:
+        raise ValueError('Weights must be positive numbers')
+    total = sum(weights)
+    bounds = [0]
+    cumulative = Fraction(0)
+    for weight in weights:
+        cumulative += weight
+        bounds.append(math.floor(extent * cumulative / total))
+    return bounds
+
+
+def strip_runs(width, height, count, left_right=True, weights=None):
+    """
+    Lays out even or weighted strips, the way the regular slicing methods do
+    :param width: Width of the new image
+    :param height: Height of the new image
+    :param count: Number of images
+    :param left_right: Whether the strips run left to right or top down
+    :param weights: Optional list of count weights for the strip sizes (see weighted_bounds)
+    :return: The layout's runs (see build_runs)
+    """
+    bounds = weighted_bounds(width if left_right else height, weights or [1] * count)
+    if left_right:
+        # Every row is split the same way, so they can all share one list of runs
+        row = [(bounds[i], bounds[i + 1], i) for i in range(count) if bounds[i] < bounds[i + 1]]
+        return [row] * height
+    runs = []
+    for i in range(count):
+        runs += [[(0, width, i)]] * (bounds[i + 1] - bounds[i])
+    return runs
+
+
+def grid_runs(width, height, count, columns, rows):
+    """
+    Lays out a grid of even cells. Cell (row r, column c) goes to image (r * columns + c) % count
+    :param width: Width of the new image
+    :param height: Height of the new image
+    :param count: Number of images
+    :param columns: Number of columns in the grid
+    :param rows: Number of rows in the grid
+    :return: The layout's runs (see build_runs)
+    """
+    column_bounds = weighted_bounds(width, [1] * columns)
+    row_bounds = weighted_bounds(height, [1] * rows)
+    runs = []
+    for r in range(rows):
+        row = [(column_bounds[c], column_bounds[c + 1], (r * columns + c) % count) for c in range(columns)
+               if column_bounds[c] < column_bounds[c + 1]]
+        runs += [row] * (row_bounds[r + 1] - row_bounds[r])
+    return runs
+
+
+def diagonal_runs(width, height, count, weights=None):
+    """
+    Lays out diagonal bands. Pixel (x, y) belongs to a band according to x + y, which runs from 0 in the top left
+    corner to width + height - 2 in the bottom right one, so the bands are split along that range (see weighted_bounds)
+    :param width: Width of the new image
+    :param height: Height of the new image
+    :param count: Number of images
+    :param weights: Optional list of count weights for the band widths
+    :return: The layout's runs (see build_runs)
+    """
+    bounds = weighted_bounds(width + height - 1, weights or [1] * count)
+    runs = []
+    for y in range(height):
+        row = []
+        for i in range(count):
+            # Band i covers x + y from bounds[i] up to bounds[i + 1], which on this row is x from bounds[i] - y up
+            start = min(max(bounds[i] - y, 0), width)
+            stop = min(max(bounds[i + 1] - y, 0), width)
+            if start < stop:
+                row.append((start, stop, i))
+        runs.append(row)
+    return runs
+
+
+def radial_runs(width, height, count, weights=None):
+    """
+    Lays out wedges around the center of the image, going clockwise from straight up. A pixel belongs to the wedge
+    its center lies in. Along any one row the angle only ever grows or shrinks on either side of the vertical center
+    line, so each half row is split into runs by binary searching for the columns where the wedge changes, rather than
+    by looking at every pixel
+    :param width: Width of the new image
+    :param height: Height of the new image
+    :param count: Number of images
+    :param weights: Optional list of count weights for the wedge angles
+    :return: The layout's runs (see build_runs)
+    """
+    weights = [Fraction(weight) for weight in weights or [1] * count]
+    total = sum(weights)
+    # Fractions of a full turn at which each wedge after the first starts
+    cuts = [float(sum(weights[:i + 1]) / total) for i in range(count - 1)]
+    cx, cy = width / 2, height / 2
+    # First column whose center is on or right of the vertical center line
+    middle = min(max(math.ceil(cx - 0.5), 0), width)
+    runs = []
+    for y in range(height):
+        dy = y + 0.5 - cy
+
+        def wedge(x):
+            # Clockwise angle from straight up, as a fraction of a full turn
+            return bisect_right(cuts, math.atan2(x + 0.5 - cx, -dy) % (2 * math.pi) / (2 * math.pi))
+
+        row = []
+        for low, high in ((0, middle), (middle, width)):
+            x = low
+            while x < high:
+                current = wedge(x)
+                # Find the first column after x that is in another wedge
+                start, stop = x + 1, high
+                while start < stop:
+                    mid = (start + stop) // 2
+                    if wedge(mid) == current:
+                        start = mid + 1
+                    else:
+                        stop = mid
+                if row and row[-1][1] == x and row[-1][2] == current:
+                    row[-1] = (row[-1][0], start, current)
+                else:
+                    row.append((x, start, current))
+                x = start
+        runs.append(row)
+    return runs
+
+
+def build_runs(spec, width, height, count, left_right=True):
+    """
+    Works out which image every pixel of the new image comes from. The result is kept as runs: for every row of the
+    new image, a list of (start, stop, index) tuples saying that the pixels from column start up to (not including)
+    column stop come from image number index. The runs of a row cover it completely and are in order, and rows that
+    are split the same way share one list
+    :param spec: A layout dictionary holding 'layout' (one of LAYOUTS) and optionally 'weights' (list of weights, one
+    per image, for strips, diagonal and radial layouts) and 'grid' (a (columns, rows) tuple for grid layouts)
+    :param width: Width of the new image
+    :param height: Height of the new image
+    :param count: Number of images
+    :param left_right: Whether strips run left to right or top down. Only used for strips
+    :return: List of height lists of runs. Raises a ValueError if the spec doesn't make sense
+    """
+    layout = spec.get('layout', 'strips')
+    weights = spec.get('weights')
+    if layout not in LAYOUTS:
+        raise ValueError('Unknown layout: {}'.format(layout))
+    if weights is not None and len(weights) != count:
+        raise ValueError('Got {} weights for {} images'.format(len(weights), count))
+    if layout == 'strips':
+        return strip_runs(width, height, count, left_right, weights)
+    if layout == 'grid':
+        columns, rows = spec.get('grid') or (count, 1)
+        if columns < 1 or rows < 1:
+            raise ValueError('A grid needs at least one column and one row')
+        return grid_runs(width, height, count, columns, rows)
+    if layout == 'diagonal':
+        return diagonal_runs(width, height, count, weights)
+    return radial_runs(width, height, count, weights)
+
+
+def index_mask(runs, width):
+    """
+    Turns a layout's runs into an index mask: an 8 bit image in which every pixel holds the number of the image it
+    comes from. Rows that share their runs are only built once
+    :param runs: The layout's runs (see build_runs)
+    :param width: Width of the new image
+    :return: A PIL Image in 'L' mode. Raises a ValueError if the runs refer to more than 256 images
+    """
+    built = {}
+    rows = []
+    for row in runs:
+        if id(row) not in built:
+            data = bytearray(width)
+            for start, stop, index in row:
+                if index > 255:
+                    raise ValueError('An index mask can hold at most 256 images')
+                data[start:stop] = bytes((index,)) * (stop - start)
+            built[id(row)] = bytes(data)
+        rows.append(built[id(row)])
+    return Image.frombytes('L', (width, len(runs)), b''.join(rows))
+
+
+def parse_grid(text):
+    """
+    Parses a grid size given as <columns>x<rows>, e.g. 3x2
+    :param text: The grid size
+    :return: A (columns, rows) tuple. Raises a ValueError if the text isn't a grid size
+    """
+    columns, _, rows = text.lower().partition('x')
+    if not columns.isdigit() or not rows.isdigit():
+        raise ValueError('Invalid grid size: {}'.format(text))
+    return int(columns), int(rows)
+
+
+def parse_weights(text):
+    """
+    Parses comma separated weights, e.g. 1,2,1.5
+    :param text: The weights
+    :return: A list of Fractions. Raises a ValueError if any weight isn't a number
+    """
+    return [Fraction(weight.strip()) for weight in text.split(',')]
@@ -0,0 +1,159 @@
+import os
+import sys
+import tempfile
+import threading
+from contextlib import contextmanager
+
+# Destination that stands for standard output
+STDOUT = '-'
+# Extension of the temporary files outputs are written to before they are renamed into place
+PARTIAL_SUFFIX = '.partial'
+# Encoder options that can be given on the command line, per format (as Pillow knows it), and their types. Anything
+# else Pillow's encoders take can still be passed to encode_image directly
+ENCODER_OPTIONS = {
+    'png': {'compress_level': int, 'optimize': bool},
+    'jpeg': {'quality': int, 'progressive': bool, 'subsampling': int, 'optimize': bool},
+    'webp': {'quality': int, 'lossless': bool, 'method': int},
+    'tiff': {'compression': str},
+}
+# Formats whose encoders go back and patch what they wrote, and so can't be written straight to a pipe
+SEEKING_FORMATS = ['tiff']
+# Size of the blocks encoded images are written in when they have to be buffered first
+CHUNK_SIZE = 1 << 16
+# Temporary files are created readable by their owner only. Finished outputs get the permissions a plain open() would
+# have given them, which depend on the umask. It's read the first time an output is written (see get_umask)
+UMASK = None
+UMASK_LOCK = threading.Lock()
+
+
+def parse_options(text, fmt):
+    """
+    Parses encoder options given on the command line, e.g. quality=85,progressive,subsampling=2. An option without a
+    value is switched on
+    :param text: Comma separated options
+    :param fmt: Format the options are for, as Pillow knows it
+    :return: A dictionary of options for encode_image. Raises a ValueError if an option is unknown or has a bad value
+    """
+    known = ENCODER_OPTIONS.get(fmt.lower(), {})
+    options = {}
+    for item in text.split(','):
+        name, equals, value = item.strip().partition('=')
+        name = name.strip().lower().replace('-', '_')
+        if not name:
+            continue
+        if name not in known:
+            raise ValueError('Unknown {} encoder option: {}. Available: {}'.format(
+                fmt, name, ', '.join(known) if known else 'none'))
+        kind = known[name]
+        value = value.strip()
+        if kind is bool:
+            if equals and value.lower() not in ('1', '0', 'true', 'false', 'yes', 'no'):
+                raise ValueError('Invalid value for {}: {}'.format(name, value))
+            options[name] = not equals or value.lower() in ('1', 'true', 'yes')
+        elif kind is int:
+            if not value.isdigit():
+                raise ValueError('Invalid value for {}: {}'.format(name, value))
+            options[name] = int(value)
+        else:
+            options[name] = value
+    return options
+
+
+class Sink:
+    """
+    Wraps the file an output is written to and counts the bytes written to it. Pillow hands the encoded image over in
+    blocks through write() rather than writing to the file descriptor itself, since the sink has no fileno()
+    """
+    def __init__(self, file):
+        self.file = file
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data) if not isinstance(data, memoryview) else data.nbytes
+        return self.file.write(data)
+
+    def flush(self):
+        self.file.flush()
+
+    def seekable(self):
+        return self.file.seekable()
+
+    def seek(self, *args):
+        return self.file.seek(*args)
+
+    def tell(self):
+        return self.file.tell()
+
+
+def get_umask():
+    """
+    Reads the umask of the process, once. On Linux it's read from /proc, which leaves it alone. Anywhere else reading it
+    means setting it, and other threads creating files in the meantime get the umask it was set to, so it's set to one
+    that only lets the owner in while it's read
+    :return: The umask
+    """
+    global UMASK
+    with UMASK_LOCK:
+        if UMASK is None:
+            try:
+                with open('/proc/self/status') as file:
+                    for line in file:
+                        if line.startswith('Umask:'):
+                            UMASK = int(line.split()[1], 8)
+            except OSError:
+                pass
+        if UMASK is None:
+            UMASK = os.umask(0o077)
+            os.umask(UMASK)
+        return UMASK
+
+
+@contextmanager
+def open_output(path):
+    """
+    Opens the destination of an output for writing. Regular files are written to a temporary file next to them, which
+    is renamed over the destination once everything has been written, so a half written output never shows up and a
+    failed one leaves the old file alone. Standard output (STDOUT) and anything else that isn't a regular file, such
+    as a named pipe, is written to directly
+    :param path: Path of the destination, or STDOUT
+    :return: A context manager handing out a Sink
+    """
+    if path == STDOUT:
+        # Progress messages are sent to stderr while the output goes to stdout, so this is the real stdout
+        sink = Sink(sys.__stdout__.buffer)
+        yield sink
+        sink.flush()
+        return
+    if os.path.exists(path) and not os.path.isfile(path):
+        with open(path, 'wb') as file:
+            yield Sink(file)
+        return
+    directory, name = os.path.split(os.path.abspath(path))
+    handle, temporary = tempfile.mkstemp(prefix=name + '.', suffix=PARTIAL_SUFFIX, dir=directory)
+    try:
+        with os.fdopen(handle, 'wb') as file:
+            yield Sink(file)
+        os.chmod(temporary, 0o666 & ~get_umask())
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+def encode_image(img, sink, fmt, **options):
+    """
+    Encodes an image into an output
+    :param img: A PIL Image
+    :param sink: The Sink to write to (see open_output)
+    :param fmt: Format to encode in, as Pillow knows it
+    :param options: Options for Pillow's encoder
+    """
+    if fmt.lower() in SEEKING_FORMATS and not sink.seekable():
+        # Encode into memory first, then send it on in blocks
+        buffer = tempfile.SpooledTemporaryFile(CHUNK_SIZE * 256)
+        img.save(buffer, fmt, **options)
+        buffer.seek(0)
+        for chunk in iter(lambda: buffer.read(CHUNK_SIZE), b''):
+            sink.write(chunk)
+        return
+    img.save(sink, fmt, **options)
@@ -0,0 +1,498 @@
+import io
+import mmap
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+# Size of the blocks we pull out of a ppm file when decoding its samples. Big enough to keep the number of reads low,
+# small enough that the temporary token list for a block never gets close to the size of the image itself
+READ_SIZE = 1 << 20
+# Whitespace as defined by the netpbm format
+WHITESPACE = b' \t\r\n\v\f'
+# Magic numbers of the ppm flavours we can read and write: ascii and binary
+PPM_FORMATS = ['P3', 'P6']
+# Headers are tiny. If we've read this much of a file without getting through one, it's not a ppm file
+MAX_HEADER_SIZE = 1 << 16
+# Bytes ascii (P3) samples are made of, and the bytes their pixel data may be made of, along with whitespace
+DIGITS = b'0123456789'
+P3_CHARACTERS = DIGITS + WHITESPACE
+# Why ascii samples that aren't plain decimal numbers are rejected
+NOT_DECIMAL = 'Malformed ppm pixel data (samples must be decimal numbers)'
+# Pre-rendered P3 samples. A sample is written as its decimal value followed by a newline, so one sample per line,
+# which is the layout every ppm produced by this program has always had
+P3_SAMPLES = [b'%d\n' % i for i in range(256)]
+
+
+def parse_header(buffer):
+    """
+    Parses the header of a ppm file out of the start of a buffer. The header is made up of four whitespace separated
+    fields (magic number, width, height and max value) that may be interleaved with '#' comments running to the end of
+    the line. Exactly one whitespace character separates the max value from the pixel data
+    :param buffer: Bytes-like object holding (at least the start of) a ppm file
+    :return: A dictionary mapping the header attributes to their values, or None if the buffer ends before the header
+    does. The 'offset' key holds the position in the buffer at which the pixel data starts
+    """
+    fields = []
+    pos = 0
+    end = len(buffer)
+    while len(fields) < 4:
+        # Skip over whitespace and comments until we hit the start of a field
+        while pos < end:
+            char = buffer[pos:pos + 1]
+            if char == b'#':
+                newline = buffer.find(b'\n', pos)
+                if newline == -1:
+                    return None
+                pos = newline + 1
+            elif char in WHITESPACE:
+                pos += 1
+            else:
+                break
+        start = pos
+        while pos < end and buffer[pos:pos + 1] not in WHITESPACE and buffer[pos:pos + 1] != b'#':
+            pos += 1
+        # A field running into the end of the buffer may still continue past it
+        if pos == end:
+            return None
+        fields.append(bytes(buffer[start:pos]))
+    try:
+        w, h, depth = int(fields[1]), int(fields[2]), int(fields[3])
+    except ValueError:
+        raise ValueError('Malformed ppm header: {}'.format(b' '.join(fields)))
+    return {'magic_number': fields[0].decode('ascii', 'replace'), 'width': w, 'height': h, 'depth': depth,
+            'offset': pos + 1}
+
+
+def check_header(header):
+    """
+    Makes sure a parsed header describes an image this module can actually decode: an ascii (P3) or binary (P6) ppm
+    with positive dimensions and one byte per sample
+    :param header: The header dictionary (see parse_header)
+    :return: The header dictionary, or raises a ValueError describing the problem
+    """
+    if header['magic_number'] not in PPM_FORMATS:
+        raise ValueError('Not a P3 or P6 ppm file (magic number {})'.format(header['magic_number']))
+    if header['width'] <= 0 or header['height'] <= 0 or not 0 < header['depth'] < 256:
+        raise ValueError('Unsupported ppm dimensions or depth: {}x{} (depth {})'
+                         .format(header['width'], header['height'], header['depth']))
+    return header
+
+
+def read_header(file, strict=True):
+    """
+    Reads the header of a ppm file from a file object opened in binary mode. Only as much of the file as is needed to
+    get through the header is read, and on return the file is positioned at the start of the pixel data
+    :param file: A binary file object positioned at the start of a ppm file
+    :param strict: Whether or not to reject headers this module can't decode (see check_header)
+    :return: The header dictionary (see parse_header)
+    """
+    start = file.tell()
+    buffer = b''
+    while True:
+        chunk = file.read(512)
+        buffer += chunk
+        header = parse_header(buffer) if chunk else parse_header(buffer + b'\n')
+        if header is not None:
+            file.seek(start + header['offset'])
+            return check_header(header) if strict else header
+        if not chunk:
+            raise ValueError('Truncated ppm header')
+        if len(buffer) > MAX_HEADER_SIZE:
+            raise ValueError('No ppm header found')
+
+
+def read_ppm_header(path):
+    """
+    Basic utility function that reads the header of a ppm file without touching any of its pixel data
+    :param path: Path to a ppm file
+    :return: The header dictionary (see parse_header)
+    """
+    with open(path, 'rb') as file:
+        return read_header(file)
+
+
+def decode_samples(tokens):
+    """
+    Decodes ascii (P3) samples
+    :param tokens: List of whitespace separated tokens of P3 pixel data
+    :return: An array('B') of the samples. Raises a ValueError if a token isn't a sample that fits in a byte, for the
+    same tokens check_samples rejects
+    """
+    # int() also takes signs and underscores, which no sample has
+    if b''.join(tokens).translate(None, DIGITS):
+        raise ValueError(NOT_DECIMAL)
+    try:
+        return array('B', map(int, tokens))
+    except OverflowError:
+        raise ValueError('Malformed ppm pixel data (sample {} does not fit in a byte)'.format(max(map(int, tokens))))
+
+
+def check_samples(data, tokens):
+    """
+    Makes sure ascii (P3) samples can be decoded (see decode_samples), without decoding them. Checking is cheaper than
+    decoding: the data is scanned for anything but digits and whitespace, and only tokens of three digits or more
+    can be out of range
+    :param data: The bytes the tokens were split from
+    :param tokens: List of whitespace separated tokens of P3 pixel data
+    :return: Raises a ValueError if a token isn't a sample that fits in a byte
+    """
+    if data.translate(None, P3_CHARACTERS):
+        raise ValueError(NOT_DECIMAL)
+    long_tokens = [token for token in tokens if len(token) >= 3]
+    if not long_tokens:
+        return
+    # Tokens of the same length compare like the numbers they stand for, longer ones may have leading zeros
+    if max(map(len, long_tokens)) == 3:
+        largest = int(max(long_tokens))
+    else:
+        largest = max(map(int, long_tokens))
+    if largest > 255:
+        raise ValueError('Malformed ppm pixel data (sample {} does not fit in a byte)'.format(largest))
+
+
+def iter_p3_samples(file):
+    """
+    Decodes the ascii samples of a P3 file block by block. Tokens that straddle the border of two blocks are carried
+    over into the next block so that every sample is decoded exactly once
+    :param file: A binary file object positioned at the start of the pixel data of a P3 file
+    :return: A generator of arrays of samples
+    """
+    carry = b''
+    while True:
+        block = file.read(READ_SIZE)
+        if not block:
+            break
+        block = carry + block
+        # Anything after the last whitespace character could be the first half of a sample
+        cut = max(block.rfind(c) for c in (b' ', b'\t', b'\r', b'\n', b'\v', b'\f')) + 1
+        carry = block[cut:]
+        yield decode_samples(block[:cut].split())
+    if carry.strip():
+        yield decode_samples(carry.split())
+
+
+def count_samples(file, header):
+    """
+    Counts the samples in the pixel data of a ppm file without decoding them. For binary (P6) files this is just the
+    size of the file past the header, ascii (P3) files have their whitespace separated tokens counted block by block,
+    and checked so that a file that is counted as valid can also be decoded (see check_samples)
+    :param file: A binary file object positioned at the start of the pixel data
+    :param header: The header dictionary of the file
+    :return: The number of samples found. Raises a ValueError if an ascii sample can't be decoded
+    """
+    if header['magic_number'] == 'P6':
+        return file_size(file) - header['offset']
+    count = 0
+    carry = b''
+    while True:
+        block = file.read(READ_SIZE)
+        if not block:
+            break
+        # A token cut in half by the end of the block is counted with the next block
+        data = carry + block
+        tokens = data.split()
+        carry = tokens.pop() if tokens and block[-1:] not in WHITESPACE else b''
+        check_samples(data[:len(data) - len(carry)], tokens)
+        count += len(tokens)
+    check_samples(carry, [carry])
+    return count + (1 if carry else 0)
+
+
+def read_pixels(file, header):
+    """
+    Decodes the pixel data of a ppm file into a flat buffer of rgb samples. The buffer is laid out row after row, three
+    samples per pixel, so the sample for channel c of the pixel at row y and column x lives at (y * width + x) * 3 + c
+    :param file: A binary file object positioned at the start of the pixel data
+    :param header: The header dictionary of the file
+    :return: An array('B') holding width * height * 3 samples
+    """
+    count = header['width'] * header['height'] * 3
+    if header['magic_number'] == 'P6':
+        pixels = array('B')
+        pixels.frombytes(file.read(count))
+    else:
+        pixels = array('B')
+        for samples in iter_p3_samples(file):
+            pixels.extend(samples)
+    if len(pixels) != count:
+        raise ValueError('Expected {} samples but found {}'.format(count, len(pixels)))
+    return pixels
+
+
+def file_size(file):
+    """
+    :param file: A binary file object, either opened from disk or already read into memory (see Prefetch)
+    :return: The size of the file, in bytes
+    """
+    if isinstance(file, io.BytesIO):
+        return len(file.getvalue())
+    return os.fstat(file.fileno()).st_size
+
+
+def map_pixels(file, header):
+    """
+    Memory-maps the pixel data of a binary (P6) ppm file. Nothing is copied or decoded: the returned view reads
+    straight out of the page cache, and slicing it is free. Files that have already been read into memory (see
+    Prefetch) are viewed where they are
+    :param file: A binary file object holding a P6 file
+    :param header: The header dictionary of the file
+    :return: A memoryview over the width * height * 3 samples of the file
+    """
+    count = header['width'] * header['height'] * 3
+    if isinstance(file, io.BytesIO):
+        # Files read ahead of time hold their contents as bytes, which getvalue() hands over without copying
+        mapped = file.getvalue()
+    else:
+        # The view keeps the mapping alive, so there is no need to hold on to the mmap object itself
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    pixels = memoryview(mapped)[header['offset']:header['offset'] + count]
+    if len(pixels) != count:
+        raise ValueError('Expected {} samples but found {}'.format(count, len(pixels)))
+    return pixels
+
+
+def load_pixels(path):
+    """
+    Gets at the pixel data of a ppm file as cheaply as possible. Binary files are memory-mapped (see map_pixels), ascii
+    files have to be decoded (see read_pixels). Either way the result is a flat buffer of samples supporting slicing
+    :param path: Path to a ppm file
+    :return: A tuple of the header dictionary and the pixel buffer
+    """
+    with open(path, 'rb') as file:
+        header = read_header(file)
+        if header['magic_number'] == 'P6':
+            return header, map_pixels(file, header)
+        return header, read_pixels(file, header)
+
+
+def iter_rows(file, header, skip=0):
+    """
+    Decodes the pixel data of a ppm file one row at a time, so that only a single row (plus one read block) is ever
+    held in memory no matter how tall the image is
+    :param file: A binary file object positioned at the start of the pixel data
+    :param header: The header dictionary of the file
+    :param skip: Number of rows at the top of the image to pass over without yielding them
+    :return: A generator of arrays (P3) or memoryviews (P6) holding width * 3 samples each
+    """
+    row_len = header['width'] * 3
+    rows = header['height']
+    if header['magic_number'] == 'P6':
+        # Binary rows have a fixed size, so the rows are simply views into the mapped file. Skipped rows are never
+        # even paged in
+        pixels = map_pixels(file, header)
+        for offset in range(skip * row_len, rows * row_len, row_len):
+            yield pixels[offset:offset + row_len]
+        return
+    # Ascii samples have no fixed width, so we regroup the decoded blocks into rows. Skipped rows still have to be
+    # decoded, they just never leave this function
+    pending = array('B')
+    row_no = 0
+    for samples in iter_p3_samples(file):
+        pending.extend(samples)
+        start = 0
+        while len(pending) - start >= row_len and row_no < rows:
+            if row_no >= skip:
+                yield pending[start:start + row_len]
+            start += row_len
+            row_no += 1
+        del pending[:start]
+        if row_no == rows:
+            return
+    raise ValueError('Truncated ppm pixel data')
+
+
+def read_ppm(path):
+    """
+    Reads a whole ppm file
+    :param path: Path to a ppm file
+    :return: A tuple of the header dictionary and the pixel buffer (see read_pixels)
+    """
+    with open(path, 'rb') as file:
+        header = read_header(file)
+        return header, read_pixels(file, header)
+
+
+def write_header(file, header):
+    """
+    Writes a ppm header in the three line layout (magic number, dimensions, depth)
+    :param file: A binary file object
+    :param header: Dictionary holding at least the magic number, width, height and depth
+    """
+    file.write('{}\n{} {}\n{}\n'.format(header['magic_number'], header['width'], header['height'],
+                                        header['depth']).encode('ascii'))
+
+
+def write_pixels(file, pixels, magic_no='P3'):
+    """
+    Writes a flat buffer of rgb samples as ppm pixel data
+    :param file: A binary file object
+    :param pixels: Bytes-like object or array('B') of samples
+    :param magic_no: 'P3' to write ascii samples (one per line) or 'P6' to write raw bytes
+    """
+    if magic_no == 'P6':
+        # Written in blocks, so pipes and other slow outputs get a steady stream rather than one huge write
+        pixels = memoryview(pixels).cast('B')
+        for start in range(0, len(pixels), READ_SIZE):
+            file.write(pixels[start:start + READ_SIZE])
+        return
+    # Render the samples in blocks so we never hold the ascii version of the whole image in memory
+    for start in range(0, len(pixels), READ_SIZE):
+        file.write(b''.join(map(P3_SAMPLES.__getitem__, pixels[start:start + READ_SIZE])))
+
+
+def write_ppm(file, header, pixels):
+    """
+    Writes a whole ppm image
+    :param file: A binary file object
+    :param header: Dictionary holding at least the magic number, width, height and depth
+    :param pixels: Flat buffer of rgb samples (see read_pixels)
+    """
+    write_header(file, header)
+    write_pixels(file, pixels, header['magic_number'])
+
+
+class PPMSource:
+    """
+    A ppm file that has been opened and parsed exactly once. The header, the number of samples in the file and (unless
+    asked not to) the pixel data are all gathered in that single pass, so validating a file, checking its size and
+    slicing it can all be done without going back to disk
+
+    Binary (P6) files are memory-mapped rather than read, so keeping their pixels costs no memory. Ascii (P3) files
+    are decoded as they are read, and their sample count is simply the length of the decoded buffer
+    """
+    def __init__(self, path, keep_pixels=True, file=None):
+        """
+        :param path: Path to a ppm file
+        :param keep_pixels: Whether or not to hold on to the pixel data. If not, ascii files are only counted, and
+        will have to be read again to get at their pixels (see iter_rows)
+        :param file: Optional binary file object holding the file, such as one read ahead of time (see Prefetch). It
+        is parsed instead of opening the path, and closed afterwards
+        """
+        self.path = path
+        self.header = None
+        self.pixels = None
+        # Number of samples in the file, or None if they can't be decoded (see decode_samples)
+        self.samples = 0
+        # Description of why the file couldn't be parsed, if it couldn't
+        self.error = None
+        # Validity codes of the file, filled in by SanityChecks.valid_ppm
+        self.codes = None
+        # Number of times the file has been opened and read
+        self.reads = 1
+        with file if file is not None else open(path, 'rb') as file:
+            try:
+                self.header = read_header(file, strict=False)
+                check_header(self.header)
+            except ValueError as e:
+                self.error = str(e)
+                # A header we can read but not decode still gets its samples counted, so that validation can tell
+                # the caller everything that is wrong with the file
+                if self.header is not None and self.header['magic_number'] in PPM_FORMATS:
+                    try:
+                        self.samples = count_samples(file, self.header)
+                    except ValueError as e:
+                        self.samples = None
+                        self.error = str(e)
+                return
+            try:
+                if self.header['magic_number'] == 'P6':
+                    self.samples = count_samples(file, self.header)
+                    if self.samples == self.header['width'] * self.header['height'] * 3:
+                        self.pixels = map_pixels(file, self.header)
+                elif keep_pixels:
+                    pixels = array('B')
+                    for samples in iter_p3_samples(file):
+                        pixels.extend(samples)
+                    self.samples = len(pixels)
+                    if self.samples == self.header['width'] * self.header['height'] * 3:
+                        self.pixels = pixels
+                else:
+                    self.samples = count_samples(file, self.header)
+            except ValueError as e:
+                # Samples that can't be decoded, whether or not they are kept
+                self.samples = None
+                self.error = str(e)
+
+    def __getstate__(self):
+        """
+        Memory-mapped pixels can't be sent to another process. They are dropped when pickling and mapped again when
+        unpickling (see __setstate__), which lets PPMSources be parsed in a process pool (see PPMCache.preload)
+        """
+        state = self.__dict__.copy()
+        state['mapped'] = isinstance(self.pixels, memoryview)
+        if state['mapped']:
+            state['pixels'] = None
+        return state
+
+    def __setstate__(self, state):
+        mapped = state.pop('mapped')
+        self.__dict__.update(state)
+        # Mapping a file doesn't read anything, so this doesn't count as a read
+        if mapped:
+            with open(self.path, 'rb') as file:
+                self.pixels = map_pixels(file, self.header)
+
+    def iter_rows(self, skip=0):
+        """
+        Same as the module level iter_rows, but served from the pixels kept in memory whenever possible
+        :param skip: Number of rows at the top of the image to pass over without yielding them
+        :return: A generator of row buffers holding width * 3 samples each
+        """
+        row_len = self.header['width'] * 3
+        if self.pixels is not None:
+            for offset in range(skip * row_len, len(self.pixels), row_len):
+                yield self.pixels[offset:offset + row_len]
+            return
+        self.reads += 1
+        with open(self.path, 'rb') as file:
+            yield from iter_rows(file, read_header(file), skip)
+
+
+class PPMCache:
+    """
+    Per-run collection of PPMSources. Every path asked for is opened and parsed the first time it is asked for, and
+    served from memory after that. The total number of file reads is kept so it can be checked that a run really
+    reads every source once (see test_PPMCodec)
+    """
+    def __init__(self, keep_pixels=True):
+        """
+        :param keep_pixels: Passed on to every PPMSource created (see PPMSource)
+        """
+        self.keep_pixels = keep_pixels
+        self.sources = {}
+
+    def get(self, path):
+        """
+        :param path: Path to a ppm file
+        :return: The PPMSource for the path
+        """
+        if path not in self.sources:
+            self.sources[path] = PPMSource(path, self.keep_pixels)
+        return self.sources[path]
+
+    def preload(self, paths, jobs=1, prefetch=None):
+        """
+        Parses a collection of files into the cache up front. Decoding ascii samples is pure Python and holds the GIL,
+        so with more than one job the files are parsed in a pool of processes rather than threads. The parsed sources
+        are sent back in order, so the cache ends up the same no matter how the work was split up
+        :param paths: Paths to ppm files
+        :param jobs: Number of worker processes to parse with
+        :param prefetch: Optional Prefetch.Prefetcher the files are read through when they are parsed one after
+        another, so the next files are being read while one is being parsed. Worker processes read on their own
+        """
+        paths = [path for path in dict.fromkeys(paths) if path not in self.sources]
+        if jobs <= 1 or len(paths) <= 1:
+            for path in paths:
+                file = prefetch.open(path) if prefetch is not None else None
+                self.sources[path] = PPMSource(path, self.keep_pixels, file)
+            return
+        with ProcessPoolExecutor(min(jobs, len(paths))) as pool:
+            for path, source in zip(paths, pool.map(PPMSource, paths, [self.keep_pixels] * len(paths))):
+                self.sources[path] = source
+
+    @property
+    def reads(self):
+        """
+        :return: The number of times a file has been opened and read through this cache
+        """
+        return sum(source.reads for source in self.sources.values())
@@ -0,0 +1,120 @@
+import PPMCodec
+import Tiled
+
+# Ways a slicing job can be carried out, fastest first
+#   memory - the sources are parsed up front and held in memory (ppm), or decoded several at a time (other images),
+#            and the new image is built in memory
+#   strips - the new image is built in memory, from one source at a time
+#   stream - ppm only: the sources are read row by row and every row is written as soon as it's stitched together
+#   tiled - binary ppm and uncompressed tiff sources only: the new image is built and written tile by tile, with
+#           tiles as big as the memory left over allows (see Tiled.compose_tiled)
+STRATEGIES = ['memory', 'strips', 'stream', 'tiled']
+# Memory the interpreter, Pillow and the rest of the program take before any image is touched. Every worker process
+# takes this much again
+BASE_MEMORY = 64 << 20
+# Memory taken while a block of an ascii (P3) source is decoded, on top of the samples themselves: the block, and the
+# list of tokens it's split into, which is many times the size of the block. Only one block is decoded at a time
+P3_DECODE_MEMORY = PPMCodec.READ_SIZE * 16
+
+
+def pixel_size(mode):
+    """
+    :param mode: A Pillow image mode
+    :return: The number of bytes Pillow holds every pixel of an image of that mode in. Images with more than one band
+    take 4 bytes a pixel, even RGB ones
+    """
+    if mode in ('1', 'L', 'P'):
+        return 1
+    return 2 if mode.startswith('I;16') else 4
+
+
+def ppm_estimates(headers, left_right=True, jobs=1, feather=0, layout=None, prefetch=0):
+    """
+    Estimates the peak memory use of every strategy that can slice a set of ppm images the way asked
+    :param headers: Header dictionaries of the images (see PPMCodec.read_ppm_header)
+    :param left_right: Whether the strips run left to right or top down
+    :param jobs: Number of processes the images are parsed with
+    :param feather: Width of the feathered seams. Streaming can't feather
+    :param layout: Optional layout dictionary (see Layouts.build_runs)
+    :param prefetch: Number of bytes held by images read ahead (see Prefetch), if they are. Only the memory strategy
+    reads ahead
+    :return: A dictionary mapping the strategies that can be used (memory, strips and stream) to their estimates, in
+    bytes. Tiled mode is estimated on its own (see tiled_estimate). Binary sources are memory-mapped, so they only
+    take page cache, which the system can always take back, unless they have been read ahead
+    """
+    size = headers[0]['width'] * headers[0]['height'] * 3
+    ascii_sources = sum(1 for header in headers if header['magic_number'] == 'P3')
+    decoding = P3_DECODE_MEMORY if ascii_sources else 0
+    # Parsing in a pool of processes costs a process per job, each decoding an image of its own
+    parsing = jobs * (BASE_MEMORY + size + decoding) if jobs > 1 and ascii_sources else 0
+    held = len(headers) if prefetch else ascii_sources
+    estimates = {
+        'memory': BASE_MEMORY + size * (1 + held) + decoding + parsing + prefetch,
+        # Feathering holds on to the previous source until its seam has been blended
+        'strips': BASE_MEMORY + size * (1 + min(ascii_sources, 2 if feather else 1)) + decoding + parsing,
+    }
+    if not feather:
+        # Left to right strips and layouts read every source at the same time, top down strips one after another.
+        # Every ascii source being read holds on to up to a block's worth of samples and a row
+        readers = ascii_sources if left_right or layout is not None else min(ascii_sources, 1)
+        estimates['stream'] = BASE_MEMORY + decoding + readers * (PPMCodec.READ_SIZE + headers[0]['width'] * 3) + \
+            parsing
+    return estimates
+
+
+def generic_estimates(size, mode, source_size, source_mode, jobs=1, prefetch=0):
+    """
+    Estimates the peak memory use of every strategy that can slice a set of images the way asked (see ppm_estimates)
+    :param size: The (width, height) of the new image
+    :param mode: The mode of the new image
+    :param source_size: The (width, height) of the biggest source
+    :param source_mode: The mode of the sources
+    :param jobs: Number of images decoded at the same time
+    :param prefetch: Number of bytes held by images read ahead (see Prefetch), if they are
+    :return: A dictionary mapping the strategies that can be used (memory and strips) to their estimates, in bytes.
+    A source is counted as fully decoded along with its slice, since only some formats can stop decoding early (see
+    ImageUtils.load_strip). Memory and strips are one and the same with a single job
+    """
+    new = size[0] * size[1] * pixel_size(mode)
+    source = source_size[0] * source_size[1] * pixel_size(source_mode)
+    estimates = {'strips': BASE_MEMORY + new + 2 * source + prefetch}
+    if jobs > 1:
+        estimates['memory'] = BASE_MEMORY + new + jobs * 2 * source + prefetch
+    return estimates
+
+
+def tiled_estimate(width, height, max_memory):
+    """
+    Estimates the peak memory use of tiled mode when it's given whatever memory is left over as its budget
+    :param width: Width of the new image
+    :param height: Height of the new image
+    :param max_memory: The job's memory limit, in bytes
+    :return: A tuple of the budget to give tiled mode and the estimate, in bytes. The layout takes a list per row
+    """
+    budget = max(max_memory - BASE_MEMORY, 0)
+    side = Tiled.plan_tile_size(width, height, budget)
+    return budget, BASE_MEMORY + Tiled.TILE_COPIES * side * side * 3 + height * 8
+
+
+def choose(estimates, max_memory):
+    """
+    Picks the fastest strategy whose estimate fits in a memory limit
+    :param estimates: Dictionary mapping strategies to their estimates (see ppm_estimates)
+    :param max_memory: The memory limit, in bytes
+    :return: A tuple of the strategy and whether it fits. If none fits, it's the one using the least memory
+    """
+    for strategy in STRATEGIES:
+        if strategy in estimates and estimates[strategy] <= max_memory:
+            return strategy, True
+    return min(estimates, key=lambda strategy: estimates[strategy]), False
+
+
+def describe(strategy, estimates, max_memory):
+    """
+    :return: A line telling the user which strategy was picked, and what every strategy was estimated to take
+    """
+    def megabytes(count):
+        return '{:.0f} MB'.format(count / (1 << 20))
+    others = ', '.join('{} {}'.format(name, megabytes(estimates[name])) for name in STRATEGIES if name in estimates)
+    return 'Slicing with the {} strategy, estimated to peak at {} of the {} allowed ({})'.format(
+        strategy, megabytes(estimates[strategy]), megabytes(max_memory), others)
@@ -0,0 +1,99 @@
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Default number of files read ahead of the one being worked on
+DEFAULT_DEPTH = 4
+# Default size of the reads files are fetched with, in bytes. Network file systems and object store mounts often have
+# a high cost per read, so bigger reads mean fewer round trips
+DEFAULT_READ_SIZE = 1 << 20
+
+
+def read_file(path, read_size=DEFAULT_READ_SIZE):
+    """
+    Reads a whole file into memory
+    :param path: Path to the file
+    :param read_size: Size of the reads, in bytes
+    :return: The contents of the file as bytes
+    """
+    with open(path, 'rb') as file:
+        return b''.join(iter(lambda: file.read(read_size), b''))
+
+
+class Prefetcher:
+    """
+    Reads a sequence of files ahead of the code that uses them, so that on storage where every open and read takes a
+    long time (network file systems, object store mounts) the files are already in memory when they are needed.
+    Reading happens in a pool of threads, which sit waiting on the storage while the caller keeps the CPU busy, so a
+    job takes about as long as the longer of reading and working rather than both together
+
+    The files are read in order, at most depth of them at a time. Whenever the caller takes a file (see open), reading
+    moves on to the files up to depth past it, so memory use stays at about depth files however many there are
+    """
+    def __init__(self, paths, depth=DEFAULT_DEPTH, read_size=DEFAULT_READ_SIZE):
+        """
+        Starts reading the first files right away
+        :param paths: Paths of the files, in the order they are going to be used
+        :param depth: Number of files to read ahead
+        :param read_size: Size of the reads, in bytes
+        """
+        if depth < 1 or read_size < 1:
+            raise ValueError('The prefetch depth and read size must be at least 1')
+        self.paths = list(paths)
+        # Where every path is first found, since a file may be used more than once
+        self.positions = {}
+        for i, path in enumerate(self.paths):
+            self.positions.setdefault(path, i)
+        self.depth = depth
+        self.read_size = read_size
+        self.pool = ThreadPoolExecutor(depth)
+        # Files being read or read but not yet taken, by position
+        self.pending = {}
+        # Position of the next file to start reading
+        self.next = 0
+        # open() may be called from more than one thread, e.g. by the threads decoding the files
+        self.lock = threading.Lock()
+        self.read_ahead(0)
+
+    def read_ahead(self, position):
+        """
+        Starts reading every file up to depth positions past a position that isn't being read yet
+        :param position: Position of the file being taken
+        """
+        with self.lock:
+            while self.next < min(len(self.paths), position + self.depth):
+                self.pending[self.next] = self.pool.submit(read_file, self.paths[self.next], self.read_size)
+                self.next += 1
+
+    def open(self, path):
+        """
+        Hands out a file, waiting for it to be read if it hasn't been yet. Every file is handed out from memory once,
+        after that (or if it isn't one of the paths at all) it is simply read here
+        :param path: Path to the file
+        :return: A binary file object holding the contents of the file
+        """
+        position = self.positions.get(path)
+        if position is None:
+            return io.BytesIO(read_file(path, self.read_size))
+        # Reading moves on past this file. If the caller got ahead of the reading, this file is started now as well
+        self.read_ahead(position + 1)
+        with self.lock:
+            future = self.pending.pop(position, None)
+        if future is None:
+            return io.BytesIO(read_file(path, self.read_size))
+        # Nothing is copied, the bytes are shared with the file object as long as it isn't written to
+        return io.BytesIO(future.result())
+
+    def close(self):
+        """
+        Stops reading ahead. Files that have been read but not taken are dropped
+        """
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.pending.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
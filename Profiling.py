@@ -0,0 +1,84 @@
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class Profiler:
+    """
+    Collects measurements for the stages of a slicing job: wall time, source and written bytes, and the peak memory
+    allocated through Python (tracemalloc) while the stage ran. A stage is measured by running it inside stage():
+
+        with profiler.stage('decode') as record:
+            ...
+            record['source_bytes'] += size
+
+    source_bytes is the combined size of the source files a stage worked from, not the number of bytes it actually
+    read: slicing only decodes the rows it needs, and binary ppm files are memory-mapped and only partly touched.
+    bytes_written is the number of bytes the stage wrote
+
+    Tracing memory slows Python down a fair bit, so it's only switched on while a profiler is actually in use
+    (see DISABLED for the profiler handlers use by default)
+    """
+    def __init__(self, trace_memory=True):
+        """
+        :param trace_memory: Whether or not to record the peak memory of every stage
+        """
+        self.trace_memory = trace_memory
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Measures a stage
+        :param name: Name of the stage
+        :return: A context manager handing out the stage's record, so the stage can add to its source_bytes
+        and bytes_written
+        """
+        record = {'stage': name, 'seconds': 0.0, 'source_bytes': 0, 'bytes_written': 0, 'peak_memory_bytes': None}
+        started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            if self.trace_memory:
+                record['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+            if started_tracing:
+                tracemalloc.stop()
+            self.stages.append(record)
+
+    def report(self):
+        """
+        :return: A json-serializable dictionary holding every stage's record, in the order they ran, and the totals
+        """
+        return {'stages': self.stages,
+                'total_seconds': sum(record['seconds'] for record in self.stages),
+                'total_source_bytes': sum(record['source_bytes'] for record in self.stages),
+                'total_bytes_written': sum(record['bytes_written'] for record in self.stages)}
+
+    def write(self, path):
+        """
+        Writes the report (see report) to a json file
+        :param path: Where to write the report
+        """
+        with open(path, 'w') as file:
+            json.dump(self.report(), file, indent=2)
+
+
+class DisabledProfiler:
+    """
+    Stand-in for a Profiler that measures nothing. Its stages hand out a throwaway record, so code can be written
+    against a profiler without checking whether profiling is on, at the cost of one dictionary per stage
+    """
+    @contextmanager
+    def stage(self, name):
+        yield {'stage': name, 'seconds': 0.0, 'source_bytes': 0, 'bytes_written': 0, 'peak_memory_bytes': None}
+
+
+# The profiler used when none is asked for
+DISABLED = DisabledProfiler()
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import shutil
+import Output
+
+# Ways the sources of a job can be identified in a cache key
+#   stat - by their path, size and modification time. Costs one stat call per source, but a file that is rewritten
+#          with the same size within the file system's timestamp resolution goes unnoticed
+#   content - by a hash of their bytes. Reads every source in full, but is immune to timestamps and moved files
+KEY_MODES = ['stat', 'content']
+# Default size cap of a cache, in bytes
+DEFAULT_CAPACITY = 1 << 30
+
+
+def source_digest(path, key_mode='stat'):
+    """
+    Identifies a single source file for a cache key
+    :param path: Path to the source
+    :param key_mode: How to identify it (see KEY_MODES)
+    :return: A string that changes whenever the source does
+    """
+    if key_mode == 'content':
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    stat = os.stat(path)
+    return '{}:{}:{}'.format(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+def copy_atomically(source, destination):
+    """
+    Copies a file so that the destination either doesn't change or holds the whole copy, even if the copy is
+    interrupted (see Output.open_output)
+    :param source: Path of the file to copy
+    :param destination: Path to copy it to, or Output.STDOUT
+    :return: The number of bytes copied
+    """
+    with open(source, 'rb') as original, Output.open_output(destination) as sink:
+        shutil.copyfileobj(original, sink, Output.CHUNK_SIZE)
+    return sink.written
+
+
+class ResultCache:
+    """
+    On-disk cache of sliced images, so running the same job over the same sources again is just a file copy. Entries
+    are addressed by a hash of everything that decides what the sliced image looks like: the sources (see KEY_MODES)
+    and the job's settings, such as its method, format and layout
+
+    Entries are written atomically (see copy_atomically), so a cache shared between runs never serves half an image.
+    When the cache grows past its size cap, the least recently used entries are evicted. Every entry's modification
+    time is bumped when it is served, so the cache keeps no index of its own that could go stale
+    """
+    def __init__(self, directory, capacity=DEFAULT_CAPACITY, key_mode='stat'):
+        """
+        :param directory: Directory holding the cache. Created if it doesn't exist
+        :param capacity: Size cap of the cache, in bytes
+        :param key_mode: How sources are identified (see KEY_MODES)
+        """
+        if key_mode not in KEY_MODES:
+            raise ValueError('Invalid cache key mode: {}'.format(key_mode))
+        self.directory = directory
+        self.capacity = capacity
+        self.key_mode = key_mode
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'bytes_served': 0}
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, images, **settings):
+        """
+        Works out the cache key of a job
+        :param images: Paths of the job's sources, in the order they are sliced in
+        :param settings: Everything else that decides what the sliced image looks like. Anything json can't
+        serialize (such as a Fraction) goes by its str()
+        :return: The key, a hex string
+        """
+        digest = hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode())
+        for image in images:
+            digest.update(source_digest(image, self.key_mode).encode() + b'\0')
+        return digest.hexdigest()
+
+    def entry(self, key):
+        """
+        :param key: A key returned by key()
+        :return: Path of the key's entry, which may or may not exist
+        """
+        return os.path.join(self.directory, key)
+
+    def fetch(self, key, destination):
+        """
+        Serves a cached sliced image
+        :param key: The job's key (see key)
+        :param destination: Where to write the sliced image if it is cached, or Output.STDOUT
+        :return: The number of bytes written if it was cached, None otherwise
+        """
+        entry = self.entry(key)
+        try:
+            written = copy_atomically(entry, destination)
+            # Mark the entry as just used, which is what eviction goes by
+            os.utime(entry)
+        except FileNotFoundError:
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits'] += 1
+        self.stats['bytes_served'] += written
+        return written
+
+    def store(self, key, path):
+        """
+        Adds a sliced image to the cache, then evicts the least recently used entries until the cache fits in its cap
+        again. An image bigger than the whole cap isn't stored at all
+        :param key: The job's key (see key)
+        :param path: Path of the sliced image
+        """
+        if os.path.getsize(path) > self.capacity:
+            return
+        copy_atomically(path, self.entry(key))
+        self.stats['stores'] += 1
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """
+        Removes the least recently used entries until the cache fits in its cap
+        :param keep: Optional key whose entry must not be evicted
+        """
+        entries = []
+        with os.scandir(self.directory) as listing:
+            for item in listing:
+                if item.is_file() and not item.name.endswith(Output.PARTIAL_SUFFIX):
+                    stat = item.stat()
+                    entries.append((stat.st_mtime_ns, item.name, stat.st_size))
+        total = sum(size for _, _, size in entries)
+        for _, name, size in sorted(entries):
+            if total <= self.capacity:
+                break
+            if name == keep:
+                continue
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                # Another run evicted it first
+                pass
+            total -= size
+            self.stats['evictions'] += 1
+
+    def report(self):
+        """
+        :return: A line summing up the cache's statistics
+        """
+        lookups = self.stats['hits'] + self.stats['misses']
+        return 'Result cache: {hits} hit(s), {misses} miss(es), {stores} store(s), {evictions} eviction(s), ' \
+               '{rate:.0%} hit rate'.format(rate=self.stats['hits'] / lookups if lookups else 0.0, **self.stats)
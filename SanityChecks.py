@@ -1,7 +1,8 @@
 import enum
 from PIL import Image
-from os.path import splitext
+from os.path import basename, splitext
 from os import pathsep
+import PPMCodec
 
 
 # Error codes that can result from validating a ppm file
@@ -12,167 +13,147 @@ class PPMCodes(enum.Enum):
     NOT_PPM = 4
     GOOD = 5
     BAD = 6
+    BAD_SAMPLES = 7
 
 
-def check_image_size_consistency_ppm(images, verbose=False, fullpath=False):
+def report_size_mismatches(sizes, required_size=None, verbose=False, fullpath=False):
+    """
+    Groups a collection of image sizes and compares every group against the size of the first image (or against a
+    required size). Every group that doesn't match is reported at once, so a single pass over the collection is
+    enough to find all the offending files
+    :param sizes: List of (path, size) tuples. A size of None marks a file whose size couldn't be read
+    :param required_size: Optional (width, height) tuple all images must have. Defaults to the first image's size
+    :param verbose: Whether or not to print out the mismatching groups
+    :param fullpath: Whether or not to print out the files' full paths or just their names
+    :return: True if all sizes match, false otherwise
+    """
+    if not sizes:
+        return True
+    expected = required_size if required_size is not None else sizes[0][1]
+    # Group the files by size, keeping the groups in the order their first file was found
+    groups = {}
+    for path, size in sizes:
+        groups.setdefault(size, []).append(path if fullpath else basename(path))
+    is_ok = True
+    for size, paths in groups.items():
+        if size == expected:
+            continue
+        is_ok = False
+        if verbose:
+            if size is None:
+                print('{} file(s) have no readable size: {}'.format(len(paths), ', '.join(paths)))
+            else:
+                print('{} file(s) do not match the size of {} (have size of {}): {}'
+                      .format(len(paths), expected, size, ', '.join(paths)))
+    return is_ok
+
+
+def ppm_sizes(images, cache=None):
+    """
+    Reads the dimensions of a collection of ppm files. Only the headers of the files are read, or, if a cache is
+    given, nothing at all is read for files that are already in it
+    :param images: The collection retrieved by retrieve_valid_files
+    :param cache: Optional PPMCodec.PPMCache
+    :return: List of (path, (width, height)) tuples. Files without a readable header get a size of None
+    """
+    sizes = []
+    for img in images:
+        try:
+            header = cache.get(img).header if cache is not None else PPMCodec.read_ppm_header(img)
+        except (OSError, ValueError):
+            header = None
+        sizes.append((img, (header['width'], header['height']) if header is not None else None))
+    return sizes
+
+
+def generic_sizes(images):
+    """
+    Reads the dimensions of a collection of image files. Pillow only reads the header of an image when opening it, and
+    every image is closed again straight away
+    :param images: The collection retrieved by retrieve_valid_files
+    :return: List of (path, (width, height)) tuples. Files Pillow can't identify get a size of None
+    """
+    sizes = []
+    for img in images:
+        try:
+            with Image.open(img) as i:
+                sizes.append((img, i.size))
+        except OSError:
+            sizes.append((img, None))
+    return sizes
+
+
+def check_image_size_consistency_ppm(images, verbose=False, fullpath=False, cache=None):
     """
     Ensures that all ppm files in an image collection retrieved by retrieve_valid_files are all the same size.
     This is the sister function to check_image_size_consistency_ppm_required_size differing only in the fact
-    that it does not ensure a specific size, but checks for discrepancies between each and all files.
+    that it does not ensure a specific size, but checks every file against the first one.
 
-    As such, the runtime of this function is much longer
+    Only the headers of the files are read, and every file is read once
     :param images: The collection retrieved by retrieve_valid_files
     :param verbose: Determines whether or not to print out error messages
     :param fullpath: Determines whether or not in the error message will print out the involved files' path or name
+    :param cache: Optional PPMCodec.PPMCache to take the headers from (see ppm_sizes)
     :return: A boolean indicating if all ppms files are equal in size (true) or there is at least one difference (false)
     """
-    # Flag that is set to True if something goes wrong
-    is_ok = True
-    # For every image in the collection
-    for img in images:
-        # Make sure the ppm is actually valid before we attempt to open it up and use it
-        if valid_ppm(img, verbose=verbose) == PPMCodes.GOOD:
-            # Open up the file and extract the dimensions
-            with open(img) as file:
-                lines = file.readlines()
-                lines = [x.strip('\n') for x in lines]
-                dimensions = lines[1].split()
-                w = float(dimensions[0])
-                h = float(dimensions[1])
-                size = (w, h)
-            # For every other image in the collection
-            for img2 in images:
-                # Make sure hte ppm is valid
-                if valid_ppm(img, verbose=verbose):
-                    with open(img) as file:
-                        # Get the dimensions for the ppm image
-                        lines = file.readlines()
-                        lines = [x.strip('\n') for x in lines]
-                        dimensions = lines[1].split()
-                        w = float(dimensions[0])
-                        h = float(dimensions[1])
-                        # If the sizes don't match we set our flag and printout the files and their dims
-                        if size[0] * size[1] != w * h:
-                            is_ok = False
-                            if fullpath and verbose:
-                                print('{} does not match {} in size ({} vs {})'.format(img, img2, size, (w, h)))
-                            elif verbose and not fullpath:
-                                print('{} does not match {} in size ({} vs {})'.format(img.split('\\').pop(),
-                                                                                       img2.split('\\').pop(),
-                                                                                       size, (w, h)))
-    return is_ok
+    return report_size_mismatches(ppm_sizes(images, cache), verbose=verbose, fullpath=fullpath)
 
 
-def check_image_size_consistency_ppm_required_size(images, required_size, verbose=False, fullpath=False):
+def check_image_size_consistency_ppm_required_size(images, required_size, verbose=False, fullpath=False, cache=None):
     """
     Ensures that all ppm files in an image collection retrieved by retrieve_valid_files are all the same size.
     This is the sister function to check_image_size_consistency_ppm_ differing only in the fact
     that it ensures a specific size across all files
     :param images: The collection retrieved by retrieve_valid_files
-    :param required_size: The size required (width * height) in pixels
+    :param required_size: The size required as a (width, height) tuple
     :param verbose: Whether or not to print out error messages as we go through the files
     :param fullpath: Whether or not to print out full file path or just name when being verbose
+    :param cache: Optional PPMCodec.PPMCache to take the headers from (see ppm_sizes)
     :return: True if all files match the required size, false otherwise
     """
-    is_ok = True
-    # For every image in the collection
-    for img in images:
-        # Open up the image, make sure its valid, and retrieve its dimensions
-        with open(img) as file:
-            if valid_ppm(img, verbose=verbose) == PPMCodes.GOOD:
-                lines = file.readlines()
-                lines = [x.strip('\n') for x in lines]
-                dimensions = lines[1].split()
-                w = float(dimensions[0])
-                h = float(dimensions[1])
-                # If the total size is not equal to the required size, print out an error message
-                if w * h != required_size:
-                    is_ok = False
-                    if verbose:
-                        if fullpath:
-                            print('{} does not have the require size of {} (has size of {})'
-                                  .format(img, required_size, w * h))
-                        else:
-                            print('{} does not have the require size of {} (has size of {})'
-                                  .format(img.split('\\').pop(), required_size, w * h))
-
-    return is_ok
+    return report_size_mismatches(ppm_sizes(images, cache), tuple(required_size), verbose, fullpath)
 
 
 def check_image_size_consistency_generic(images, verbose=False, fullpath=False):
     """
-    Checks if all img files contianed within 'images' are all equal in size
+    Checks if all img files contianed within 'images' are all equal in size to the first one. Only the headers of the
+    files are read, and every file is closed as soon as its size is known
     :param images: Return value from retrieve_valid_files
     :param verbose: Whether or not to print out errors in sizes as we find them
     :param fullpath: Whether or not to print out full path or just file name in our verbosity
-    :return:
+    :return: True if all files are equal in size, false otherwise
     """
-    is_ok = True
-    # The img files in the images collection are just paths. We can't ascertain their sizes without some help from PIL
-    generic = {}
-    for img in images:
-        generic[img] = Image.open(img)
-    # The keys will be the paths, will the values will be the images themselves (a PIL class)
-    keys = generic.keys()
-    for i in keys:
-        imgi = generic[i]
-        size = imgi.size
-        for j in keys:
-            imgj = generic[j]
-            if generic[j].size[0] != size[0] or generic[j].size[1] != size[1]:
-                is_ok = False
-                if verbose:
-                    if not fullpath:
-                        print('{} does not match {} in size ({} vs {})'
-                              .format(i.split('\\').pop(), j.split('\\').pop(), (imgj.width, imgj.height), size))
-                    else:
-                        print('{} does not match {} in size ({} vs {})'
-                              .format(i, j, (imgj.width, imgj.height), size))
-    return is_ok
+    return report_size_mismatches(generic_sizes(images), verbose=verbose, fullpath=fullpath)
 
 
 def check_image_size_consistency_generic_required_size(images, required_size, verbose=False, fullpath=False):
     """
     Checks to see if all img files in 'images' are equal to the specified required size
     :param images: Collection of paths returned by retrieve_valid_files
-    :param required_size: The total size in pixels that the images must be equal to
+    :param required_size: The size required as a (width, height) tuple
     :param verbose: Whether or not to print out errors in sizes as we find them
     :param fullpath: Whether or not to print out full path or just file name in our verbosity
-    :return:
+    :return: True if all files match the required size, false otherwise
     """
-    is_ok = True
-    generic = {}
-    # The img files in the images collection are just paths. We can't ascertain their sizes without some help from PIL
-    for img in images:
-        generic[img] = Image.open(img)
-    # The keys will be the paths, will the values will be the images themselves (a PIL class)
-    for i in generic.keys():
-        img = generic[i]
-        if img.width * img.height != required_size:
-            is_ok = False
-            if verbose:
-                if not fullpath:
-                    print('{} does not have the require size of {} (has size of {})'
-                          .format(i.split('\\').pop(), required_size, img.width * img.height))
-                else:
-                    print('{} does not have the require size of {} (has size of {})'
-                          .format(i, required_size, img.width * img.height))
-    return is_ok
+    return report_size_mismatches(generic_sizes(images), tuple(required_size), verbose, fullpath)
 
 
-def valid_ppm(path, verbose=False, fullpath=False, return_error_codes=False):
+def valid_ppm(path, verbose=False, fullpath=False, return_error_codes=False, cache=None):
     """
     Checks to make sure a specific ppm file is actually a valid ppm file by checking the following:
         The file has the extension .ppm
-        The first line is the 'magic number': P3
-        The second line's dimensions (w x h) equals the actual size of the file
-        The third line is the color depth and it should be '255'
+        The first field is the 'magic number': P3 (ascii) or P6 (binary)
+        The dimensions (w x h) that follow equal the actual number of pixels in the file
+        The samples of an ascii file are decimal numbers that fit in a byte
+        The field after that is the color depth and it should be '255'
     The function keeps a running collection of the errors gotten, and can return that collection if wanted
     Otherwise it will return True if all tests are pass, and false if any are failed
     :param path: The path to the ppm file
     :param verbose: Whether or not to print out error messages as we fail tests
     :param fullpath: Whether or not to print out the file's full path when printing out errors
     :param return_error_codes: Whether or not to return the collection of errors
+    :param cache: Optional PPMCodec.PPMCache. The file is parsed through it, so slicing it afterwards won't read it
+    again, and its validity codes are recorded on its PPMSource
     :return: True/False or a list holding PPMCodes
     """
     # Keep track of our errors in case we need to return them
@@ -191,40 +172,55 @@ def valid_ppm(path, verbose=False, fullpath=False, return_error_codes=False):
             return errors
         else:
             return False
-    # Open the file, read the lines, strip the lines of all newlines (to ensure proper equality checks) and extract
-    # the dimensions
-    with open(path) as file:
-        lines = file.readlines()
-        lines = [x.strip('\n') for x in lines]
-        dimensions = lines[1].split()
-        w = float(dimensions[0])
-        h = float(dimensions[1])
-        # Perform basic equality checks
-        if lines[2] != '255':
-            if verbose:
-                if fullpath:
-                    print('{} does not have the correct color depth of 255 (has {})'.format(path, lines[3]))
-                else:
-                    print('{} does not have the correct color depth of 255 (has {})'.format(filename, lines[3]))
-                errors.append(PPMCodes.BAD_DEPTH)
-        if lines[0] != 'P3':
-            if verbose:
-                if fullpath:
-                    print('{} does not have the correct magic number of P3 (has {})'.format(path, lines[0]))
-                else:
-                    print('{} does not have the correct magic number of P3 (has {})'.format(filename, lines[0]))
-            errors.append(PPMCodes.NOT_PPM3)
-        # Have to multiply by three because the width * height will be total number of pixels, while the length of the
-        # lines list from index 3 onward will be all the rgb values for the pixels. So one pixel takes up three lines
-        # in a ppm file
-        if len(lines[3:]) != (w * h) * 3:
-            if verbose:
-                if fullpath:
-                    print('{} does not have the correct size: {} != {}'.format(path, len(lines[3:]), (w*h)/3))
-                else:
-                    print('{} does not have the correct size: {} != {}'.format(filename, len(lines[3:]), (w * h) / 3))
-            errors.append(PPMCodes.BAD_DIMENSIONS)
+    # Parse the file (or get it from the cache if it was parsed before). Either way it is only ever read once
+    source = cache.get(path) if cache is not None else PPMCodec.PPMSource(path, keep_pixels=False)
+    header = source.header
+    if header is None:
+        if verbose:
+            print('{} does not have a ppm header ({})'.format(path if fullpath else filename, source.error))
+        errors.append(PPMCodes.NOT_PPM)
+        source.codes = errors
+        if return_error_codes:
+            return errors
+        else:
+            return False
+    w = header['width']
+    h = header['height']
+    # Perform basic equality checks
+    if header['depth'] != 255:
+        if verbose:
+            if fullpath:
+                print('{} does not have the correct color depth of 255 (has {})'.format(path, header['depth']))
+            else:
+                print('{} does not have the correct color depth of 255 (has {})'.format(filename, header['depth']))
+        errors.append(PPMCodes.BAD_DEPTH)
+    if header['magic_number'] not in PPMCodec.PPM_FORMATS:
+        if verbose:
+            if fullpath:
+                print('{} does not have the correct magic number of P3 or P6 (has {})'
+                      .format(path, header['magic_number']))
+            else:
+                print('{} does not have the correct magic number of P3 or P6 (has {})'
+                      .format(filename, header['magic_number']))
+        errors.append(PPMCodes.NOT_PPM3)
+    elif source.samples is None:
+        # The samples can't be decoded, so there is no count to compare with the dimensions
+        if verbose:
+            print('{} has samples that can\'t be decoded: {}'.format(path if fullpath else filename, source.error))
+        errors.append(PPMCodes.BAD_SAMPLES)
+    # Have to multiply by three because the width * height will be total number of pixels, while the pixel data holds
+    # the rgb values for the pixels. So one pixel takes up three samples in a ppm file
+    elif source.samples != (w * h) * 3:
+        if verbose:
+            if fullpath:
+                print('{} does not have the correct size: {} != {}'.format(path, source.samples, (w * h) * 3))
+            else:
+                print('{} does not have the correct size: {} != {}'.format(filename, source.samples, (w * h) * 3))
+            if source.error is not None:
+                print(source.error)
+        errors.append(PPMCodes.BAD_DIMENSIONS)
+    source.codes = errors
     if return_error_codes:
-        return PPMCodes.GOOD if not errors else PPMCodes.BAD
-    else:
         return errors
+    else:
+        return not errors
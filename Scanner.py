@@ -0,0 +1,166 @@
+import fnmatch
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+# Orders the files of a directory can be handed out in. Every directory is ordered on its own as soon as it has been
+# listed, so none of them needs the whole tree to be listed first
+#   name - by file name, the way sorted() orders strings
+#   natural - by file name, with runs of digits compared as numbers and letters compared case-insensitively, so
+#             img2.png comes before img10.png
+#   mtime - by modification time, oldest first
+#   none - in the order the file system lists them, which is the fastest
+ORDERS = ['name', 'natural', 'mtime', 'none']
+
+
+def natural_key(name):
+    """
+    Sort key that orders names the way a person would: runs of digits are compared by their value and everything else
+    case-insensitively
+    :param name: A file name
+    :return: A list alternating between text and numbers. It always starts with text, so any two keys can be compared
+    """
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', name)]
+
+
+def compile_pattern(pattern):
+    """
+    Turns an include or exclude pattern into a regular expression. A pattern is either a glob (a string, such as
+    '*_draft.*' or 'raw/*') or an already compiled regular expression
+    :param pattern: A glob string or a compiled regular expression
+    :return: A tuple of the function that matches the pattern against a string and whether it is given the relative path
+    of a file instead of just its name. Globs have to match a whole name, or a whole path if they hold a '/'. Regular
+    expressions are searched for anywhere in the path
+    """
+    if isinstance(pattern, str):
+        return re.compile(fnmatch.translate(pattern)).match, '/' in pattern
+    return pattern.search, True
+
+
+def matches(patterns, name, relative):
+    """
+    :param patterns: List of compiled patterns (see compile_pattern)
+    :param name: Name of a file or directory
+    :param relative: Its path relative to the directory being scanned, with '/' separators
+    :return: Whether any of the patterns matches
+    """
+    for match, whole_path in patterns:
+        if match(relative if whole_path else name) is not None:
+            return True
+    return False
+
+
+def list_directory(path, order='name'):
+    """
+    Lists a single directory. Whether an entry is a file or a directory comes from the DirEntry, which most platforms
+    fill in while listing, so no extra stat call is made per entry. Only the mtime order stats the files
+    :param path: Path of the directory
+    :param order: How to order the files (see ORDERS)
+    :return: A tuple of the files and the subdirectories, both as lists of DirEntries. Directory symlinks are left out
+    of the subdirectories, so a symlink loop can't make a scan run forever. If the directory can't be listed the
+    error is printed and both lists are empty
+    """
+    files, directories = [], []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append(entry)
+                    elif entry.is_file():
+                        files.append(entry)
+                except OSError:
+                    # The entry vanished or can't be looked at. Either way it isn't something we can slice
+                    continue
+    # Folder access can be tricky sometimes (permissions, especially on network shares), so if we get an error, we
+    # just print and move on to the next directory
+    except OSError as e:
+        print(e)
+        return [], []
+    if order == 'name':
+        files.sort(key=lambda entry: entry.name)
+    elif order == 'natural':
+        files.sort(key=lambda entry: natural_key(entry.name))
+    elif order == 'mtime':
+        files.sort(key=lambda entry: (entry.stat().st_mtime_ns, entry.name))
+    # Subdirectories are always walked by name (or naturally) so the order of the files stays predictable
+    directories.sort(key=(lambda entry: natural_key(entry.name)) if order == 'natural' else (lambda entry: entry.name))
+    return files, directories
+
+
+class Listing:
+    """
+    A directory listing that is carried out when its result is asked for. Stands in for a Future when directories are
+    listed one after another, so a directory isn't listed before the files ahead of it have been yielded
+    """
+    def __init__(self, path, order):
+        self.args = (path, order)
+
+    def result(self):
+        return list_directory(*self.args)
+
+
+def scan_files(path, suffixes=(), include=None, exclude=None, max_depth=0, order='name', jobs=1):
+    """
+    Walks a directory and yields the files in it one at a time, as soon as the directory holding them has been listed.
+    Nothing is collected up front, so a caller can start working on the first files of a huge directory tree (on a
+    network share, say) while the rest is still being listed
+
+    Directories are walked depth first. The files of a directory are yielded before those of its subdirectories, and
+    the files of every directory are ordered on their own (see ORDERS)
+
+    With more than one job the subdirectories of a directory are listed in a pool of threads while the files before
+    them are being yielded, which hides the latency of slow file systems. The files come out in the same order either
+    way
+    :param path: Path to a directory
+    :param suffixes: File extensions to yield, such as '.png'. They are compared case-insensitively. If none are given
+    every file is yielded
+    :param include: Optional list of patterns (globs or compiled regular expressions, see compile_pattern). If given,
+    only files matching at least one of them are yielded
+    :param exclude: Optional list of patterns. Files matching any of them are skipped, and so are directories matching
+    any of them, along with everything inside them
+    :param max_depth: How many levels of subdirectories to descend into. 0 only scans the directory itself, None has no
+    limit
+    :param order: How to order the files of every directory (see ORDERS)
+    :param jobs: Number of directories to list at the same time
+    :return: A generator of file paths. Directories that can't be listed are reported and skipped
+    """
+    if order not in ORDERS:
+        raise ValueError('Invalid order: {}'.format(order))
+    suffixes = tuple(suffix.lower() for suffix in suffixes)
+    include = [compile_pattern(pattern) for pattern in include or ()]
+    exclude = [compile_pattern(pattern) for pattern in exclude or ()]
+    pool = ThreadPoolExecutor(jobs) if jobs > 1 else None
+
+    def submit(directory):
+        if pool is None:
+            return Listing(directory, order)
+        return pool.submit(list_directory, directory, order)
+
+    def walk(listing, relative, depth):
+        files, directories = listing.result()
+        pending = []
+        if max_depth is None or depth < max_depth:
+            for entry in directories:
+                below = relative + entry.name
+                if not matches(exclude, entry.name, below):
+                    # With a pool the subdirectory starts being listed now, while the files below are being yielded
+                    pending.append((submit(entry.path), below + '/'))
+        for entry in files:
+            if suffixes and os.path.splitext(entry.name)[1].lower() not in suffixes:
+                continue
+            below = relative + entry.name
+            if include and not matches(include, entry.name, below):
+                continue
+            if matches(exclude, entry.name, below):
+                continue
+            yield entry.path
+        for subdirectory, below in pending:
+            yield from walk(subdirectory, below, depth + 1)
+
+    try:
+        yield from walk(submit(path), '', 0)
+    finally:
+        if pool is not None:
+            # Listings that are still running when the caller stops early are abandoned
+            pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,185 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import repeat
+from multiprocessing import shared_memory
+import ImageUtils
+import PPMCodec
+
+# Number of bands every worker gets on average. Having more bands than workers evens out the load when some bands cost
+# more to fill than others, such as the bands of a top down blend that come from ascii sources
+BANDS_PER_WORKER = 4
+# Largest piece of an ascii (P3) source that is counted or decoded in one go, in bytes
+PIECE_SIZE = 1 << 24
+
+
+def piece_tokens(path, start, stop, end):
+    """
+    Reads the samples of an ascii (P3) file that start within a range of bytes. A sample belongs to the piece it starts
+    in, so a file cut into pieces anywhere has every sample in exactly one of them, without the pieces having to agree
+    on where the cuts are
+    :param path: Path to a P3 file
+    :param start: Offset of the first byte of the piece. The pixel data of a P3 file is always preceded by a whitespace
+    character ending the header, so this is at least 1
+    :param stop: Offset just past the last byte of the piece
+    :param end: Offset of the end of the file's pixel data
+    :return: A list of the samples as undecoded tokens
+    """
+    with open(path, 'rb') as file:
+        # The byte before the piece tells whether the piece starts in the middle of a sample
+        file.seek(start - 1)
+        data = file.read(stop - start + 1)
+        tokens = data[1:].split()
+        if tokens and data[:1] not in PPMCodec.WHITESPACE and data[1:2] not in PPMCodec.WHITESPACE:
+            # The sample started in the piece before
+            tokens.pop(0)
+        if tokens and stop < end and data[-1:] not in PPMCodec.WHITESPACE:
+            # The last sample runs on past the piece. It's finished off with what follows, samples are only a few
+            # bytes long
+            rest = file.read(min(64, end - stop))
+            if rest[:1] not in PPMCodec.WHITESPACE:
+                tokens[-1] += rest.split(maxsplit=1)[0]
+    return tokens
+
+
+def count_piece(path, start, stop, end):
+    """
+    :return: The number of samples that start within a piece of an ascii (P3) file (see piece_tokens)
+    """
+    return len(piece_tokens(path, start, stop, end))
+
+
+def index_sources(images, pool, pieces):
+    """
+    Works out how to get at any row of every source without reading what comes before it. Binary (P6) samples have a
+    fixed size, so those are found by offset. Ascii (P3) samples don't, so those files are cut into pieces, and the
+    samples in every piece are counted in the pool, which tells where in the image every piece starts
+    :param images: List of paths to valid ppm files
+    :param pool: The ProcessPoolExecutor to count with
+    :param pieces: Least number of pieces to cut an ascii file into. Bigger files are cut into pieces of at most
+    PIECE_SIZE bytes
+    :return: A list holding, for every source, a tuple of its path, header dictionary and list of (start, stop,
+    first sample) pieces. The list of pieces is empty for binary sources
+    """
+    sources = []
+    tasks = []
+    for path in images:
+        header = PPMCodec.read_ppm_header(path)
+        if header['magic_number'] == 'P6':
+            sources.append((path, header, []))
+            continue
+        offset, end = header['offset'], os.path.getsize(path)
+        count = max(pieces, math.ceil((end - offset) / PIECE_SIZE))
+        cuts = [offset + i * (end - offset) // count for i in range(count + 1)]
+        pieces_of = [(start, stop) for start, stop in zip(cuts, cuts[1:]) if start < stop]
+        sources.append((path, header, pieces_of))
+        tasks += [(path, start, stop, end) for start, stop in pieces_of]
+    counts = iter(pool.map(count_piece, *zip(*tasks))) if tasks else iter(())
+    indexed = []
+    for path, header, pieces_of in sources:
+        first = 0
+        indexed_pieces = []
+        for start, stop in pieces_of:
+            indexed_pieces.append((start, stop, first))
+            first += next(counts)
+        indexed.append((path, header, indexed_pieces))
+    return indexed
+
+
+def load_range(source, low, high):
+    """
+    Gets at a range of samples of a source. Binary (P6) sources are memory-mapped. Ascii (P3) sources only have the
+    pieces holding the range read and split up, and are handed out undecoded: turning tokens into samples is what
+    takes the time, and most of the range may not be needed (such as all but one slice of every row of a left to
+    right blend)
+    :param source: One of the sources returned by index_sources
+    :param low: Index of the first sample needed
+    :param high: Index just past the last sample needed
+    :return: A tuple of a buffer holding (at least) the samples, and the index of the sample the buffer starts with.
+    The buffer is a memoryview for binary sources and a list of tokens for ascii sources
+    """
+    path, header, pieces = source
+    if header['magic_number'] == 'P6':
+        with open(path, 'rb') as file:
+            return PPMCodec.map_pixels(file, header), 0
+    end = os.path.getsize(path)
+    tokens = []
+    first = None
+    for i, (start, stop, piece_first) in enumerate(pieces):
+        piece_last = pieces[i + 1][2] if i + 1 < len(pieces) else math.inf
+        if piece_last <= low or piece_first >= high:
+            continue
+        skip = max(low - piece_first, 0)
+        if first is None:
+            first = piece_first + skip
+        tokens += piece_tokens(path, start, stop, end)[skip:high - piece_first]
+    return tokens, first
+
+
+def fill_band(name, top, runs, width, sources):
+    """
+    Fills one horizontal band of a new image held in shared memory, straight from the sources. Runs in a worker
+    process: nothing but the name of the shared memory and a description of the band is sent to it, and nothing is
+    sent back
+    :param name: Name of the shared memory block holding the new image's pixel buffer
+    :param top: Row the band starts at
+    :param runs: The layout's runs for the rows of the band (see Layouts.build_runs)
+    :param width: Width of the new image
+    :param sources: The sources (see index_sources)
+    """
+    memory = shared_memory.SharedMemory(name)
+    try:
+        base = top * width * 3
+        for index, spans in ImageUtils.layout_spans(runs, width).items():
+            pixels, first = load_range(sources[index], base + spans[0][0], base + spans[-1][1])
+            offset = base - first
+            for start, stop in spans:
+                samples = pixels[offset + start:offset + stop]
+                if isinstance(samples, list):
+                    # Ascii samples are decoded only now, so the ones the band doesn't use never are
+                    samples = PPMCodec.decode_samples(samples)
+                memory.buf[base + start:base + stop] = samples
+            del pixels
+    finally:
+        memory.close()
+
+
+@contextmanager
+def shared_composite(images, runs, workers, magic_no='P3'):
+    """
+    Builds a new image in shared memory with a pool of worker processes. The new image is cut into horizontal bands,
+    and every worker fills the bands it is handed straight from the sources (see fill_band), so the pixel data is
+    never pickled and sent between processes, and the work spreads over as many cores as there are workers
+
+    This function assumes that all ppm images are of the same size, and that they are all valid ppm files
+    :param images: List of paths to valid ppm files
+    :param runs: The layout's runs (see Layouts.build_runs). Even strips are runs too (see Layouts.strip_runs)
+    :param workers: Number of worker processes
+    :param magic_no: Magic number of the new image, 'P3' (ascii) or 'P6' (binary)
+    :return: A context manager handing out a tuple of the new image's header dictionary and its pixel buffer, which is
+    a view of the shared memory. The memory is freed on leaving the context. Raises a ValueError if a sample the new
+    image uses can't be decoded (see PPMCodec.decode_samples)
+    """
+    header = dict(PPMCodec.read_ppm_header(images[0]), magic_number=magic_no)
+    width, height = header['width'], header['height']
+    size = width * height * 3
+    bands = ImageUtils.slice_bounds(height, min(height, workers * BANDS_PER_WORKER))
+    memory = shared_memory.SharedMemory(create=True, size=size)
+    try:
+        with ProcessPoolExecutor(workers) as pool:
+            sources = index_sources(images, pool, workers * BANDS_PER_WORKER)
+            tops = [top for top, bottom in zip(bands, bands[1:]) if top < bottom]
+            band_runs = [runs[top:bottom] for top, bottom in zip(bands, bands[1:]) if top < bottom]
+            # Going through the results raises any error a worker ran into
+            for _ in pool.map(fill_band, repeat(memory.name), tops, band_runs, repeat(width), repeat(sources)):
+                pass
+        # The block can be bigger than asked for, since it is a whole number of pages
+        pixels = memory.buf[:size]
+        try:
+            yield header, pixels
+        finally:
+            pixels.release()
+    finally:
+        memory.close()
+        memory.unlink()
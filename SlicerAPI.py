@@ -0,0 +1,98 @@
+import io
+import os
+from PIL import Image
+import ImageUtils
+import PPMCodec
+import SanityChecks
+from Handlers import SlicerError
+
+
+def to_source(source):
+    """
+    Turns anything the library accepts as an image into something the blend functions can decode
+    :param source: A path, a binary file object, bytes-like object holding an encoded image, PIL Image, or an array
+    exposing the array interface (e.g. a NumPy array of shape (height, width, 3))
+    :return: A path, a binary file object or a PIL Image
+    """
+    if isinstance(source, (Image.Image, str, os.PathLike)) or hasattr(source, 'read'):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    if hasattr(source, '__array_interface__'):
+        return Image.fromarray(source)
+    raise TypeError('Unsupported image source: {!r}'.format(type(source)))
+
+
+def source_size(source):
+    """
+    :param source: A source as returned by to_source
+    :return: The (width, height) of the source, or None if it isn't an image Pillow can read. Only the header is read
+    """
+    if isinstance(source, Image.Image):
+        return source.size
+    try:
+        with Image.open(source) as img:
+            return img.size
+    except OSError:
+        return None
+
+
+def slice_images(sources, left_right=True, fmt=None, jobs=1, normalize=None, feather=0, **save_options):
+    """
+    Slices a collection of images in memory. This is the programmatic counterpart of the handlers: nothing is printed,
+    nothing is written to disk and problems are raised rather than ending the process
+
+    :param sources: Collection of images. Each one can be a path, a binary file object, a bytes-like object holding an
+    encoded image, a PIL Image or an array (see to_source). They must all be the same size, unless they are normalized
+    :param left_right: Whether or not the transition will be left to right or top to bottom
+    :param fmt: None to get the new image back as a PIL Image. Otherwise the format to encode it in: anything Pillow
+    can save (e.g. 'png' or 'jpeg'), or 'P3' or 'P6' for an ascii or binary ppm
+    :param jobs: Number of images to decode at the same time
+    :param normalize: Optional dictionary holding a 'size' ((width, height) tuple) and a 'mode', either of which may be
+    None or left out (see ImageUtils.normalize_target). If given, sources of any size and mode are resampled and
+    converted to fit while slicing
+    :param feather: Width in pixels of the bands the seams are cross-faded over (see ImageUtils.create_blend_generic)
+    :param save_options: Extra options for Pillow's encoder (e.g. quality=90 for jpegs)
+    :return: A PIL Image, or bytes holding the encoded image. Raises a SlicerError if the images can't be sliced
+    """
+    sources = [to_source(source) for source in sources]
+    if not sources:
+        raise SlicerError('No images to slice')
+    sizes = [('source {}'.format(i), source_size(source)) for i, source in enumerate(sources)]
+    unreadable = [name for name, size in sizes if size is None]
+    if unreadable:
+        raise SlicerError('Not all images can be read: {}'.format(', '.join(unreadable)))
+    target = None
+    if normalize is not None:
+        try:
+            target = ImageUtils.normalize_target(sources[0], normalize.get('size'), normalize.get('mode'))
+        except ValueError as e:
+            raise SlicerError(str(e))
+    elif not SanityChecks.report_size_mismatches(sizes):
+        raise SlicerError('Not all images are equal in size: {}'.format(', '.join(
+            '{} is {}'.format(name, size) for name, size in sizes)))
+    img = ImageUtils.create_blend_generic(sources, left_right, jobs, target, feather)
+    if fmt is None:
+        return img
+    return encode_image(img, fmt, **save_options)
+
+
+def encode_image(img, fmt, **save_options):
+    """
+    Encodes an image in memory
+    :param img: A PIL Image
+    :param fmt: Anything Pillow can save (e.g. 'png' or 'jpeg'), or 'P3' or 'P6' for an ascii or binary ppm
+    :param save_options: Extra options for Pillow's encoder
+    :return: Bytes holding the encoded image
+    """
+    buffer = io.BytesIO()
+    if fmt.upper() in PPMCodec.PPM_FORMATS:
+        img = img.convert('RGB')
+        PPMCodec.write_ppm(buffer, {'magic_number': fmt.upper(), 'width': img.width, 'height': img.height,
+                                    'depth': 255}, img.tobytes())
+    else:
+        try:
+            img.save(buffer, 'jpeg' if fmt.lower() == 'jpg' else fmt, **save_options)
+        except (KeyError, OSError, ValueError) as e:
+            raise SlicerError('Could not encode the image as {}: {}'.format(fmt, e))
+    return buffer.getvalue()
@@ -0,0 +1,196 @@
+import base64
+import getopt
+import json
+import os
+import signal
+import socketserver
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PIL import Image
+import Output
+import SlicerAPI
+from Handlers import FORMAT_ALIASES, SlicerError
+
+HELP = "-h - Prints this\n" \
+       "-p <port> - Port to listen on, on localhost (default 8737)\n" \
+       "-u <path> - Listen on a unix socket at the path instead of a port\n" \
+       "-w <workers> - Number of worker processes (defaults to the number of cpus)\n\n" \
+       "Requests are POSTed to /slice as json: {\"sources\": [<base64 encoded images>], \"method\": \"1\" or \"2\", " \
+       "\"format\": \"png\", \"options\": {<encoder options, see the --encode flag of ImageSlicer>}}. The response" \
+       " is the encoded image, or a json {\"error\": ...} with status 400 for a bad request, or 500 if slicing failed" \
+       " otherwise. GET /health answers 'ok' once the workers are up"
+
+# Content types of the formats the service answers with. Anything else is sent as plain bytes
+CONTENT_TYPES = {'png': 'image/png', 'jpeg': 'image/jpeg', 'jpg': 'image/jpeg', 'p3': 'image/x-portable-pixmap',
+                 'p6': 'image/x-portable-pixmap', 'webp': 'image/webp', 'gif': 'image/gif'}
+
+
+def warm_up():
+    """
+    Runs in every worker process as it starts: loads all of Pillow's format plugins and slices a tiny image set once,
+    so the first real request a worker gets doesn't pay for any of it
+    """
+    Image.init()
+    tiny = [Image.new('RGB', (4, 4), color) for color in ('red', 'blue')]
+    for fmt in ('png', 'jpeg'):
+        SlicerAPI.slice_images(tiny, True, fmt)
+
+
+def ready(index):
+    """
+    Does nothing. Used to make sure a worker process has started (and warmed up)
+    :param index: Number of the call, ignored
+    """
+    return True
+
+
+def check_options(options, fmt):
+    """
+    Makes sure the options of a request are encoder options the format takes (see Output.ENCODER_OPTIONS), of the
+    right types, the way Output.parse_options does for the command line. Settings such as jobs or feather that
+    SlicerAPI.slice_images takes as well are left to the service
+    :param options: The options of the request
+    :param fmt: Format of the request
+    :return: The options. Raises a ValueError if an option is unknown or has a bad value
+    """
+    if not isinstance(options, dict):
+        raise ValueError('The options must be a json object')
+    known = Output.ENCODER_OPTIONS.get(FORMAT_ALIASES.get(fmt.lower(), fmt.lower()), {})
+    for name, value in options.items():
+        if name not in known:
+            raise ValueError('Unknown {} encoder option: {}. Available: {}'.format(
+                fmt, name, ', '.join(known) if known else 'none'))
+        # json booleans are ints to Python, but not the other way around
+        if not isinstance(value, known[name]) or (known[name] is int and isinstance(value, bool)):
+            raise ValueError('Invalid value for {}: {}'.format(name, json.dumps(value)))
+    return options
+
+
+def slice_request(sources, left_right, fmt, options):
+    """
+    Slices the images of one request. Runs in a worker process
+    :param sources: List of bytes objects holding encoded images
+    :param left_right: Whether or not the transition will be left to right or top to bottom
+    :param fmt: Format to encode the new image in (see SlicerAPI.slice_images)
+    :param options: Extra encoder options (see check_options)
+    :return: Bytes holding the encoded image
+    """
+    return SlicerAPI.slice_images(sources, left_right, fmt, **options)
+
+
+class SliceRequestHandler(BaseHTTPRequestHandler):
+    """
+    Answers requests by handing them to the server's pool of worker processes
+    """
+    def do_GET(self):
+        if self.path == '/health':
+            self.reply(200, b'ok', 'text/plain')
+        else:
+            self.reply(404, json.dumps({'error': 'Not found'}).encode(), 'application/json')
+
+    def do_POST(self):
+        if self.path != '/slice':
+            self.reply(404, json.dumps({'error': 'Not found'}).encode(), 'application/json')
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            sources = [base64.b64decode(source) for source in request['sources']]
+            left_right = str(request.get('method', '1')) == '1'
+            fmt = request.get('format', 'png')
+            if not isinstance(fmt, str) or not fmt:
+                raise ValueError('The format must be a non-empty string')
+            options = check_options(request.get('options', {}), fmt)
+        except (TypeError, ValueError, KeyError) as e:
+            self.reply(400, json.dumps({'error': str(e)}).encode(), 'application/json')
+            return
+        try:
+            image = self.server.pool.submit(slice_request, sources, left_right, fmt, options).result()
+        except (SlicerError, OSError, ValueError) as e:
+            self.reply(400, json.dumps({'error': str(e)}).encode(), 'application/json')
+            return
+        except Exception as e:
+            # Anything else is a bug, or a worker that died. The client still gets an answer
+            self.reply(500, json.dumps({'error': 'Internal error: {!r}'.format(e)}).encode(), 'application/json')
+            return
+        self.reply(200, image, CONTENT_TYPES.get(fmt.lower(), 'application/octet-stream'))
+
+    def reply(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Clients of a unix socket have no address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    The unix socket counterpart of http.server's ThreadingHTTPServer
+    """
+    daemon_threads = True
+
+
+def stop(signum, frame):
+    """
+    Signal handler that stops the service the same way ctrl+c does, so the worker processes are shut down with it
+    """
+    raise KeyboardInterrupt
+
+
+def serve(port=8737, socket_path=None, workers=None):
+    """
+    Starts the service and serves until interrupted. All worker processes are started and warmed up (see warm_up)
+    before the first request is accepted, so requests only pay for decoding, slicing and encoding
+    :param port: Port to listen on, on localhost
+    :param socket_path: If given, listen on a unix socket at this path instead of a port
+    :param workers: Number of worker processes. Defaults to the number of cpus
+    """
+    workers = workers or os.cpu_count() or 1
+    signal.signal(signal.SIGTERM, stop)
+    with ProcessPoolExecutor(workers, initializer=warm_up) as pool:
+        # Worker processes are started lazily, so keep them all busy at once to get every one of them going
+        list(pool.map(ready, range(workers)))
+        if socket_path is not None:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            server = ThreadingUnixHTTPServer(socket_path, SliceRequestHandler)
+            print('Listening on {} with {} workers'.format(socket_path, workers))
+        else:
+            server = ThreadingHTTPServer(('127.0.0.1', port), SliceRequestHandler)
+            print('Listening on http://127.0.0.1:{} with {} workers'.format(port, workers))
+        server.pool = pool
+        with server:
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+
+
+def main(argvs):
+    try:
+        opts, args = getopt.getopt(argvs, 'hp:u:w:')
+    except getopt.GetoptError as e:
+        print(e)
+        exit(1)
+    port = 8737
+    socket_path = None
+    workers = None
+    for opt, arg in opts:
+        if opt == '-h':
+            print('\n\n' + HELP + '\n')
+            exit(0)
+        elif opt == '-p':
+            port = int(arg)
+        elif opt == '-u':
+            socket_path = arg
+        elif opt == '-w':
+            workers = int(arg)
+    serve(port, socket_path, workers)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
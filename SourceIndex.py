@@ -0,0 +1,184 @@
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from PIL import Image
+import PPMCodec
+import SanityChecks
+
+# Name of the index file when the index is given a directory, such as the source directory, to live in
+DEFAULT_NAME = '.imageslicer-index.sqlite'
+# Version of the table layout and of what its records mean. An index written with another version is emptied and built
+# again. Version 1 recorded ascii ppm files as valid without checking that their samples fit in a byte
+SCHEMA_VERSION = 2
+# Number of paths looked up in one query. SQLite caps the number of parameters a query can have
+LOOKUP_SIZE = 500
+# How images are inspected, by the kind of handler they are sliced by
+#   ppm - parsed and validated (see SanityChecks.valid_ppm). Ascii files are decoded to be counted, which holds the
+#         GIL, so they are inspected in a pool of processes
+#   generic - opened with Pillow, which only reads their headers, in a pool of threads
+KINDS = ['ppm', 'generic']
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    format TEXT,
+    width INTEGER,
+    height INTEGER,
+    mode TEXT,
+    depth INTEGER,
+    codes TEXT NOT NULL
+)
+'''
+
+
+def inspect_ppm(path):
+    """
+    Validates a ppm file without keeping its pixels. Ascii samples are checked as they are counted (see
+    PPMCodec.count_samples), so a file recorded as valid can be decoded
+    :param path: Path to the file
+    :return: A record dictionary holding the file's format (its magic number), size ((width, height) tuple, None if
+    its header can't be read), mode, depth and codes (list of SanityChecks.PPMCodes, empty if the file is valid)
+    """
+    cache = PPMCodec.PPMCache(keep_pixels=False)
+    codes = SanityChecks.valid_ppm(path, return_error_codes=True, cache=cache)
+    header = cache.get(path).header
+    if header is None:
+        return {'format': None, 'size': None, 'mode': None, 'depth': None, 'codes': codes}
+    return {'format': header['magic_number'], 'size': (header['width'], header['height']), 'mode': 'RGB',
+            'depth': header['depth'], 'codes': codes}
+
+
+def inspect_generic(path):
+    """
+    Reads the header of an image with Pillow
+    :param path: Path to the image
+    :return: A record dictionary (see inspect_ppm). Images Pillow can't identify have a size of None. There are no
+    codes, the size is all the generic handler checks
+    """
+    try:
+        with Image.open(path) as img:
+            return {'format': img.format, 'size': img.size, 'mode': img.mode, 'depth': None, 'codes': []}
+    except OSError:
+        return {'format': None, 'size': None, 'mode': None, 'depth': None, 'codes': []}
+
+
+INSPECTORS = {'ppm': (inspect_ppm, ProcessPoolExecutor), 'generic': (inspect_generic, ThreadPoolExecutor)}
+
+
+def all_valid(records, images):
+    """
+    :param records: Records returned by SourceIndex.refresh
+    :param images: Paths to the images
+    :return: True if every image has a record, is valid and is as big as the first one
+    """
+    if any(image not in records for image in images):
+        return False
+    size = records[images[0]]['size']
+    return size is not None and all(not records[image]['codes'] and records[image]['size'] == size
+                                    for image in images)
+
+
+def ppm_header(record):
+    """
+    :param record: Record of a valid ppm file
+    :return: The parts of the file's header dictionary (see PPMCodec.read_ppm_header) the record holds, which is all
+    of it but the offset of the pixel data
+    """
+    return {'magic_number': record['format'], 'width': record['size'][0], 'height': record['size'][1],
+            'depth': record['depth']}
+
+
+class SourceIndex:
+    """
+    On-disk index of what is known about source images: their format, dimensions, mode and, for ppm files, validity
+    codes. Slicing the same directories again and again then only takes a stat call per image to tell that nothing
+    changed, instead of opening every image to validate it. Ascii ppm files have to be read in full to be validated,
+    so for those this saves reading the whole tree
+
+    An image is looked up by its absolute path, and its record is trusted as long as the image's size and modification
+    time are the ones it was inspected with. Like the stat keys of ResultCache.ResultCache, this misses a file that is
+    rewritten with the same size within the file system's timestamp resolution
+    """
+    def __init__(self, path):
+        """
+        Opens the index, creating it if it doesn't exist
+        :param path: Path to the index file, or to a directory to keep it in under DEFAULT_NAME
+        """
+        if os.path.isdir(path):
+            path = os.path.join(path, DEFAULT_NAME)
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            if self.connection.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+                self.connection.execute('DROP TABLE IF EXISTS sources')
+                self.connection.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+            self.connection.execute(SCHEMA)
+
+    def lookup(self, paths):
+        """
+        :param paths: Absolute paths of images
+        :return: A dictionary mapping the paths that are in the index to their (kind, size, mtime_ns, record) tuples
+        """
+        rows = {}
+        for i in range(0, len(paths), LOOKUP_SIZE):
+            chunk = paths[i:i + LOOKUP_SIZE]
+            query = 'SELECT path, kind, size, mtime_ns, format, width, height, mode, depth, codes FROM sources ' \
+                    'WHERE path IN ({})'.format(', '.join('?' * len(chunk)))
+            for path, kind, size, mtime_ns, fmt, width, height, mode, depth, codes in \
+                    self.connection.execute(query, chunk):
+                record = {'format': fmt, 'size': (width, height) if width is not None else None, 'mode': mode,
+                          'depth': depth, 'codes': [SanityChecks.PPMCodes[code] for code in codes.split(',') if code]}
+                rows[path] = (kind, size, mtime_ns, record)
+        return rows
+
+    def refresh(self, images, kind, jobs=1):
+        """
+        Brings the index up to date for a collection of images and hands out their records. Every image is stat'ed,
+        and only the ones that are new or have changed since they were indexed are inspected (see KINDS)
+        :param images: Paths to the images
+        :param kind: How the images are inspected (see KINDS)
+        :param jobs: Number of images to inspect at the same time
+        :return: A tuple of a dictionary mapping the images to their records (see inspect_ppm), and the number of
+        images that had to be inspected. Images that can't be stat'ed are left out, and dropped from the index
+        """
+        if kind not in KINDS:
+            raise ValueError('Invalid kind of source: {}'.format(kind))
+        images = list(dict.fromkeys(images))
+        absolute = {image: os.path.abspath(image) for image in images}
+        rows = self.lookup(list(absolute.values()))
+        records = {}
+        stale = []
+        gone = []
+        for image in images:
+            try:
+                stat = os.stat(image)
+            except OSError:
+                gone.append(absolute[image])
+                continue
+            row = rows.get(absolute[image])
+            if row is not None and row[:3] == (kind, stat.st_size, stat.st_mtime_ns):
+                records[image] = row[3]
+            else:
+                stale.append((image, stat))
+        inspect, executor = INSPECTORS[kind]
+        if jobs > 1 and len(stale) > 1:
+            with executor(min(jobs, len(stale))) as pool:
+                inspected = list(pool.map(inspect, [image for image, _ in stale]))
+        else:
+            inspected = [inspect(image) for image, _ in stale]
+        with self.connection:
+            self.connection.executemany('DELETE FROM sources WHERE path = ?', [(path,) for path in gone])
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(absolute[image], kind, stat.st_size, stat.st_mtime_ns, record['format'],
+                  record['size'][0] if record['size'] is not None else None,
+                  record['size'][1] if record['size'] is not None else None, record['mode'], record['depth'],
+                  ','.join(code.name for code in record['codes'])) for (image, stat), record in zip(stale, inspected)])
+        for (image, _), record in zip(stale, inspected):
+            records[image] = record
+        return records, len(stale)
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,319 @@
+import os
+import struct
+from PIL import Image
+import Layouts
+import PPMCodec
+
+# Formats the tiled engine writes: an uncompressed tiled tiff, or a binary ppm
+TILED_FORMATS = ['tif', 'ppm']
+# Tiff tiles have to be a multiple of 16 pixels wide and long. Tiles of every format are kept to that
+TILE_ALIGN = 16
+# Memory budget used when none is given
+DEFAULT_BUDGET = 256 << 20
+# A tile is held up to this many times over while it's being composed: the new tile itself, the region of the source
+# being copied from, and for tiffs Pillow decodes, its copies of that region while it's cropped and converted
+TILE_COPIES = 4
+# Tags of the tiff files we write, in the order they have to appear in
+TIFF_TAGS = {'ImageWidth': 256, 'ImageLength': 257, 'BitsPerSample': 258, 'Compression': 259,
+             'PhotometricInterpretation': 262, 'SamplesPerPixel': 277, 'PlanarConfiguration': 284,
+             'TileWidth': 322, 'TileLength': 323, 'TileOffsets': 324, 'TileByteCounts': 325}
+# Tiff field types
+SHORT = 3
+LONG = 4
+
+
+def read_region(file, strips, stride, box):
+    """
+    Reads a region out of raw rgb rows stored in a file, one positioned read per row, so exactly the region and
+    nothing more is ever held in memory. Rows that are read again by the next tile come out of the page cache
+    :param file: A binary file object
+    :param strips: List of (top, bottom, offset) tuples: the rows from top up to (not including) bottom are stored one
+    after another starting at offset in the file
+    :param stride: Length of a stored row in bytes
+    :param box: The (left, top, right, bottom) box to read
+    :return: A bytearray holding the region's rgb samples, row after row
+    """
+    left, top, right, bottom = box
+    length = (right - left) * 3
+    region = bytearray(length * (bottom - top))
+    view = memoryview(region)
+    for strip_top, strip_bottom, offset in strips:
+        for y in range(max(top, strip_top), min(bottom, strip_bottom)):
+            file.seek(offset + (y - strip_top) * stride + left * 3)
+            file.readinto(view[(y - top) * length:(y - top + 1) * length])
+    return region
+
+
+class PPMTileSource:
+    """
+    A binary (P6) ppm source. Its rows are raw rgb samples, so any region can be read straight out of the file
+    (see read_region) without decoding anything
+    """
+    def __init__(self, path):
+        """
+        :param path: Path to a P6 ppm file
+        """
+        self.file = open(path, 'rb')
+        header = PPMCodec.read_header(self.file)
+        if header['magic_number'] != 'P6' or header['depth'] > 255:
+            self.file.close()
+            raise ValueError('{} is not a binary ppm file with 8 bit samples'.format(path))
+        self.size = (header['width'], header['height'])
+        self.strips = [(0, header['height'], header['offset'])]
+
+    def region(self, box):
+        """
+        :param box: The (left, top, right, bottom) box that is needed
+        :return: A buffer holding the box's rgb samples, row after row
+        """
+        return read_region(self.file, self.strips, self.size[0] * 3, box)
+
+    def close(self):
+        self.file.close()
+
+
+class TiffTileSource:
+    """
+    An uncompressed tiff source, either tiled or striped. Plain rgb strips (which is how Pillow itself writes tiffs)
+    are raw rows just like a P6 ppm file's, so regions are read straight out of the file (see read_region). Anything
+    else is decoded by Pillow tile by tile (or strip by strip), so a region is read by handing Pillow only the tiles
+    that overlap it, and pretending the image is no bigger than those tiles. Compressed tiffs are decoded by libtiff in
+    one go, which would mean holding the whole image in memory, so they are refused
+    """
+    def __init__(self, path):
+        """
+        :param path: Path to an uncompressed tiff file
+        """
+        self.path = path
+        self.file = None
+        with Image.open(path) as img:
+            if img.format != 'TIFF' or any(tile[0] != 'raw' for tile in img.tile):
+                raise ValueError('{} is not an uncompressed tiff file'.format(path))
+            self.size = img.size
+            # (top, bottom, offset) of every strip, if the image is made up of full width strips of raw rgb rows
+            self.strips = None
+            if all(tile[1][0] == 0 and tile[1][2] == img.width and tuple(tile[3]) == ('RGB', 0, 1)
+                   for tile in img.tile):
+                self.strips = [(tile[1][1], tile[1][3], tile[2]) for tile in img.tile]
+                self.file = open(path, 'rb')
+
+    def region(self, box):
+        """
+        :param box: The (left, top, right, bottom) box that is needed
+        :return: A buffer holding the box's rgb samples, row after row
+        """
+        if self.strips is not None:
+            return read_region(self.file, self.strips, self.size[0] * 3, box)
+        left, top, right, bottom = box
+        with Image.open(self.path) as img:
+            tiles = [tile for tile in img.tile
+                     if tile[1][0] < right and tile[1][2] > left and tile[1][1] < bottom and tile[1][3] > top]
+            x0 = min(tile[1][0] for tile in tiles)
+            y0 = min(tile[1][1] for tile in tiles)
+            x1 = max(tile[1][2] for tile in tiles)
+            y1 = max(tile[1][3] for tile in tiles)
+            # Move the overlapping tiles to the top left, so the decoder fills an image just big enough for them.
+            # Newer versions of Pillow keep tiles as named tuples, older ones as plain tuples
+            img.tile = [moved_tile(tile, (tile[1][0] - x0, tile[1][1] - y0, tile[1][2] - x0, tile[1][3] - y0))
+                        for tile in tiles]
+            img._size = (x1 - x0, y1 - y0)
+            return img.crop((left - x0, top - y0, right - x0, bottom - y0)).convert('RGB').tobytes()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+def moved_tile(tile, extents):
+    """
+    :param tile: One of the tiles of a Pillow image
+    :param extents: New (left, top, right, bottom) box for the tile
+    :return: A copy of the tile covering the new box
+    """
+    if hasattr(tile, '_replace'):
+        return tile._replace(extents=extents)
+    return (tile[0], extents) + tuple(tile[2:])
+
+
+def open_source(path):
+    """
+    :param path: Path to a P6 ppm file or an uncompressed tiff file
+    :return: A tile source for the file (see PPMTileSource and TiffTileSource). Raises a ValueError for anything else
+    """
+    if os.path.splitext(path)[1].lower() == '.ppm':
+        return PPMTileSource(path)
+    return TiffTileSource(path)
+
+
+class TiffTileWriter:
+    """
+    Writes an uncompressed, tiled rgb tiff file. Every tile takes up a fixed spot in the file, worked out up front, so
+    tiles can be written in any order and nothing but the tile being written is ever held in memory. Edge tiles are
+    padded to the full tile size, as the tiff format requires
+    """
+    def __init__(self, file, width, height, tile_width, tile_length):
+        """
+        Writes the header and lays out the file
+        :param file: A binary file object, opened for writing, that can seek
+        :param width: Width of the image
+        :param height: Height of the image
+        :param tile_width: Width of a tile. Must be a multiple of 16
+        :param tile_length: Height of a tile. Must be a multiple of 16
+        """
+        self.file = file
+        self.width, self.height = width, height
+        self.tile_width, self.tile_length = tile_width, tile_length
+        self.across = -(-width // tile_width)
+        count = self.across * -(-height // tile_length)
+        tile_bytes = tile_width * tile_length * 3
+        # Header, then the directory with its entries, then the arrays that didn't fit in an entry, then the tiles
+        directory = 8
+        bits = directory + 2 + len(TIFF_TAGS) * 12 + 4
+        offsets = bits + 8
+        byte_counts = offsets + 4 * count
+        self.data = byte_counts + 4 * count
+        if self.data + count * tile_bytes > 0xFFFFFFFF:
+            raise ValueError('The image is too big for a tiff file. Write a ppm file instead')
+        values = {'ImageWidth': (LONG, 1, width), 'ImageLength': (LONG, 1, height), 'BitsPerSample': (SHORT, 3, bits),
+                  'Compression': (SHORT, 1, 1), 'PhotometricInterpretation': (SHORT, 1, 2),
+                  'SamplesPerPixel': (SHORT, 1, 3), 'PlanarConfiguration': (SHORT, 1, 1),
+                  'TileWidth': (LONG, 1, tile_width), 'TileLength': (LONG, 1, tile_length),
+                  'TileOffsets': (LONG, count, offsets if count > 1 else self.data),
+                  'TileByteCounts': (LONG, count, byte_counts if count > 1 else tile_bytes)}
+        entries = []
+        for name, tag in TIFF_TAGS.items():
+            kind, number, value = values[name]
+            # Values that fit in four bytes are stored in the entry itself, left justified
+            entries.append(struct.pack('<HHI', tag, kind, number) +
+                           (struct.pack('<HH', value, 0) if kind == SHORT and number == 1 else struct.pack('<I', value)))
+        file.write(b'II*\x00' + struct.pack('<I', directory) + struct.pack('<H', len(entries)) + b''.join(entries) +
+                   struct.pack('<I', 0) + struct.pack('<4H', 8, 8, 8, 0))
+        if count > 1:
+            file.write(struct.pack('<{}I'.format(count), *range(self.data, self.data + count * tile_bytes, tile_bytes)))
+            file.write(struct.pack('<{}I'.format(count), *[tile_bytes] * count))
+        file.truncate(self.data + count * tile_bytes)
+
+    def write_tile(self, box, pixels):
+        """
+        :param box: The (left, top, right, bottom) box of the tile in the image. Its top left corner is on the tile grid
+        :param pixels: The tile's rgb samples, tile_width * tile_length pixels of them, row after row
+        """
+        index = box[1] // self.tile_length * self.across + box[0] // self.tile_width
+        self.file.seek(self.data + index * self.tile_width * self.tile_length * 3)
+        self.file.write(pixels)
+
+
+class PPMTileWriter:
+    """
+    Writes a binary (P6) ppm file tile by tile. A ppm file is laid out row after row, so every row of a tile is
+    written to its own spot in the file
+    """
+    def __init__(self, file, width, height, tile_width, tile_length):
+        """
+        Writes the header and makes room for the pixel data
+        :param file: A binary file object, opened for writing, that can seek
+        :param width: Width of the image
+        :param height: Height of the image
+        :param tile_width: Width of a tile
+        :param tile_length: Height of a tile
+        """
+        self.file = file
+        self.width = width
+        self.tile_width = tile_width
+        PPMCodec.write_header(file, {'magic_number': 'P6', 'width': width, 'height': height, 'depth': 255})
+        self.data = file.tell()
+        file.truncate(self.data + width * height * 3)
+
+    def write_tile(self, box, pixels):
+        """
+        :param box: The (left, top, right, bottom) box of the tile in the image
+        :param pixels: The tile's rgb samples, tile_width pixels per row, row after row
+        """
+        left, top, right, bottom = box
+        pixels = memoryview(pixels)
+        for y in range(top, bottom):
+            start = (y - top) * self.tile_width * 3
+            self.file.seek(self.data + (y * self.width + left) * 3)
+            self.file.write(pixels[start:start + (right - left) * 3])
+
+
+def plan_tile_size(width, height, budget=DEFAULT_BUDGET):
+    """
+    Picks the biggest square tile whose composition fits in a memory budget (see TILE_COPIES). Bigger tiles mean fewer,
+    bigger reads and writes. The tile never gets bigger than the image (rounded up to the tile alignment)
+    :param width: Width of the image
+    :param height: Height of the image
+    :param budget: Memory budget in bytes
+    :return: The side of the tile, a multiple of TILE_ALIGN
+    """
+    side = int((budget / (TILE_COPIES * 3)) ** 0.5) // TILE_ALIGN * TILE_ALIGN
+    longest = -(-max(width, height) // TILE_ALIGN) * TILE_ALIGN
+    return max(TILE_ALIGN, min(side, longest))
+
+
+def compose_tile(sources, runs, box, side):
+    """
+    Composes one tile of the new image
+    :param sources: List of tile sources (see open_source)
+    :param runs: The layout's runs (see Layouts.build_runs)
+    :param box: The (left, top, right, bottom) box of the tile
+    :param side: Width and height of the tile buffer. May be bigger than the box at the edges of the image
+    :return: A bytearray holding the tile's rgb samples, side pixels per row and side rows, padded with black
+    """
+    left, top, right, bottom = box
+    # Clip the layout to the tile, and sort the spans by the source they come from
+    spans = {}
+    for y in range(top, bottom):
+        for start, stop, index in runs[y]:
+            if start < right and stop > left:
+                spans.setdefault(index, []).append((y, max(start, left), min(stop, right)))
+    tile = bytearray(side * side * 3)
+    for index, source_spans in spans.items():
+        # Read just the part of the source that the tile needs from it
+        needed = (min(span[1] for span in source_spans), source_spans[0][0],
+                  max(span[2] for span in source_spans), source_spans[-1][0] + 1)
+        pixels = sources[index].region(needed)
+        stride = (needed[2] - needed[0]) * 3
+        for y, start, stop in source_spans:
+            offset = (y - top) * side * 3
+            source_offset = (y - needed[1]) * stride + (start - needed[0]) * 3
+            tile[offset + (start - left) * 3:offset + (stop - left) * 3] = \
+                pixels[source_offset:source_offset + (stop - start) * 3]
+    return tile
+
+
+def compose_tiled(images, file, left_right=True, output_format='tif', budget=DEFAULT_BUDGET, layout=None):
+    """
+    Slices images of any size without ever holding one of them, or the new image, in memory. The new image is
+    composed one tile at a time (see compose_tile), and every finished tile is written straight to the destination.
+    Each tile only reads the regions of the sources it needs: the raw rows of P6 ppm sources (and plain striped tiffs)
+    are read span by span straight out of the file, and other uncompressed tiffs only have the tiles overlapping the
+    region decoded. Memory use is bounded by the budget, which
+    decides the tile size (see plan_tile_size), plus the layout, which takes a few small tuples per row
+
+    This function assumes that all images are of the same size
+    :param images: List of paths to P6 ppm files or uncompressed tiff files
+    :param file: A binary file object, opened for writing, that can seek. The new image is written to it
+    :param left_right: Whether or not the transition will be left to right or top to bottom
+    :param output_format: 'tif' for a tiled tiff or 'ppm' for a binary ppm (see TILED_FORMATS)
+    :param budget: Memory budget in bytes
+    :param layout: Optional layout dictionary (see Layouts.build_runs). Without one the images are sliced into even
+    strips
+    :return: The (width, height) of the new image. Raises a ValueError if an image can't be read tile by tile
+    """
+    sources = []
+    try:
+        for image in images:
+            sources.append(open_source(image))
+        width, height = sources[0].size
+        runs = Layouts.build_runs(layout or {'layout': 'strips'}, width, height, len(sources), left_right)
+        side = plan_tile_size(width, height, budget)
+        writer = (TiffTileWriter if output_format == 'tif' else PPMTileWriter)(file, width, height, side, side)
+        for top in range(0, height, side):
+            for left in range(0, width, side):
+                box = (left, top, min(left + side, width), min(top + side, height))
+                writer.write_tile(box, compose_tile(sources, runs, box, side))
+    finally:
+        for source in sources:
+            source.close()
+    return width, height
@@ -0,0 +1,179 @@
+import os
+import time
+from PIL import Image
+import ImageUtils
+import Output
+import PPMCodec
+try:
+    # Only available on Linux, and only if inotify_simple is installed. Without it the sources are polled
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+# How often the sources are checked for changes when polling, in seconds
+POLL_INTERVAL = 0.25
+# How long to wait for more changes once inotify reports one, in milliseconds. Saving a file often takes more than one
+# write, and they should all be picked up together
+SETTLE_TIME = 50
+
+
+def snapshot(paths):
+    """
+    Takes the state of a collection of files
+    :param paths: Paths to the files
+    :return: A dictionary mapping every path to its (size, mtime) tuple. Files that vanished are left out
+    """
+    state = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        state[path] = (stat.st_size, stat.st_mtime_ns)
+    return state
+
+
+class Watcher:
+    """
+    Watches a set of source images for changes. When inotify_simple is available the directories holding them are
+    watched through inotify, so a change is noticed as soon as the file is closed, and nothing is done while nothing
+    changes. Otherwise the sources are stat'ed every POLL_INTERVAL seconds. Either way, what changed is worked out by
+    comparing the size and mtime of every source against the last time around
+    """
+    def __init__(self, list_sources, directory, interval=POLL_INTERVAL):
+        """
+        :param list_sources: Function returning the current list of source paths
+        :param directory: The directory the sources are retrieved from
+        :param interval: How often to poll, in seconds, when inotify isn't available
+        """
+        self.list_sources = list_sources
+        self.interval = interval
+        self.sources = list_sources()
+        self.state = snapshot(self.sources)
+        self.inotify = None
+        if INotify is not None:
+            try:
+                self.inotify = INotify()
+                mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM | flags.CREATE | flags.DELETE
+                for watched in {directory} | {os.path.dirname(source) for source in self.sources}:
+                    self.inotify.add_watch(watched, mask)
+            except OSError:
+                # Out of watches, or not a file system inotify works on (some network shares). Poll instead
+                self.inotify = None
+
+    def wait(self):
+        """
+        Blocks until the sources change
+        :return: A tuple of the current list of sources and the list of sources that were added or changed
+        """
+        while True:
+            if self.inotify is not None:
+                self.inotify.read(read_delay=SETTLE_TIME)
+            else:
+                time.sleep(self.interval)
+            sources = self.list_sources()
+            state = snapshot(sources)
+            if sources != self.sources or state != self.state:
+                changed = [source for source in sources if state.get(source) != self.state.get(source)]
+                self.sources, self.state = sources, state
+                return sources, changed
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+
+
+class PPMTarget:
+    """
+    A sliced ppm image kept in memory along with the layout it was sliced with, so that when one source changes only
+    that source's part of it is read again and copied in (see ImageUtils.layout_spans). Binary (P6) images are then
+    patched in place on disk, span by span. Ascii (P3) samples have no fixed width, so those are written out in full
+    """
+    def __init__(self, images, runs, path, magic_no='P3'):
+        """
+        Slices the images and writes the sliced image
+        :param images: List of paths to valid ppm files of the same size
+        :param runs: The layout's runs (see Layouts.build_runs)
+        :param path: Where to write the sliced image
+        :param magic_no: Format of the sliced image, 'P3' (ascii) or 'P6' (binary)
+        """
+        self.images = images
+        self.path = path
+        self.magic_no = magic_no
+        self.header, self.pixels = ImageUtils.composite_ppm(images, runs, magic_no)
+        self.spans = ImageUtils.layout_spans(runs, self.header['width'])
+        with Output.open_output(path) as sink:
+            PPMCodec.write_header(sink, self.header)
+            # Where the pixel data starts, so spans can be written straight to their place in the file
+            self.offset = sink.written
+            PPMCodec.write_pixels(sink, self.pixels, magic_no)
+
+    def update(self, index):
+        """
+        Reads one source again and updates the sliced image with it
+        :param index: Number of the source that changed
+        :return: Raises a ValueError naming the source if it can't be decoded, such as an ascii sample that doesn't
+        fit in a byte. Nothing is updated then
+        """
+        try:
+            header, pixels = PPMCodec.load_pixels(self.images[index])
+        except ValueError as e:
+            raise ValueError('{}: {}'.format(self.images[index], e))
+        if (header['width'], header['height'], header['depth']) != \
+                (self.header['width'], self.header['height'], self.header['depth']):
+            raise ValueError('{} no longer has the size and depth of the other images'.format(self.images[index]))
+        spans = self.spans.get(index, [])
+        for start, stop in spans:
+            self.pixels[start:stop] = pixels[start:stop]
+        if self.magic_no != 'P6':
+            with Output.open_output(self.path) as sink:
+                PPMCodec.write_ppm(sink, self.header, self.pixels)
+            return
+        with open(self.path, 'r+b') as file:
+            for start, stop in spans:
+                file.seek(self.offset + start)
+                file.write(self.pixels[start:stop])
+
+
+class ImageTarget:
+    """
+    The generic counterpart of PPMTarget. The sliced image is kept in memory, and when one source changes only the
+    part of it the layout uses (see ImageUtils.layout_parts) is decoded and pasted in again. Compressed formats can't
+    be patched, so the sliced image is encoded again in full
+    """
+    def __init__(self, images, runs, path, ftype, options=None):
+        """
+        Slices the images and writes the sliced image
+        :param images: List of paths to images of the same size
+        :param runs: The layout's runs (see Layouts.build_runs)
+        :param path: Where to write the sliced image
+        :param ftype: Format of the sliced image, as Pillow knows it
+        :param options: Optional dictionary of encoder options (see Output.ENCODER_OPTIONS)
+        """
+        self.images = images
+        self.path = path
+        self.ftype = ftype
+        self.options = options or {}
+        self.image = ImageUtils.composite_generic(images, runs)
+        self.parts = ImageUtils.layout_parts(runs, self.image.width, len(images))
+        self.save()
+
+    def update(self, index):
+        """
+        Decodes the part of one source that is used again and updates the sliced image with it
+        :param index: Number of the source that changed
+        """
+        if index in self.parts:
+            box, part = self.parts[index]
+            with Image.open(self.images[index]) as img:
+                if img.size != self.image.size:
+                    raise ValueError('{} no longer has the size of the other images'.format(self.images[index]))
+                self.image.paste(ImageUtils.load_strip(img, box), box[:2], part)
+        self.save()
+
+    def save(self):
+        """
+        Encodes the sliced image and writes it out
+        """
+        with Output.open_output(self.path) as sink:
+            Output.encode_image(self.image, sink, self.ftype, **self.options)
@@ -0,0 +1,91 @@
+import builtins
+import os
+import tempfile
+import unittest
+from array import array
+from unittest import mock
+import ImageUtils
+import PPMCodec
+import SanityChecks
+
+
+def write_source(path, magic_no, width, height, seed):
+    """
+    Writes a ppm file whose samples are worked out from a seed, so every source is different
+    """
+    pixels = array('B', [(seed * 37 + i * 11) % 256 for i in range(width * height * 3)])
+    with open(path, 'wb') as file:
+        PPMCodec.write_ppm(file, {'magic_number': magic_no, 'width': width, 'height': height, 'depth': 255}, pixels)
+
+
+class SingleReadTest(unittest.TestCase):
+    """
+    Validating, size checking and slicing a set of ppm files through one PPMCache reads every file once
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.images = []
+        for i, magic_no in enumerate(['P3', 'P6', 'P3', 'P6']):
+            path = os.path.join(self.directory.name, 'img{}.ppm'.format(i))
+            write_source(path, magic_no, 7, 5, i)
+            self.images.append(path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_every_source_is_opened_once(self):
+        opened = []
+        real_open = builtins.open
+
+        def counting_open(file, *args, **kwargs):
+            opened.append(file)
+            return real_open(file, *args, **kwargs)
+
+        cache = PPMCodec.PPMCache()
+        with mock.patch('builtins.open', counting_open):
+            self.assertTrue(all(SanityChecks.valid_ppm(image, cache=cache) for image in self.images))
+            self.assertTrue(SanityChecks.check_image_size_consistency_ppm(self.images, cache=cache))
+            for left_right in (True, False):
+                ImageUtils.create_blend_ppm(self.images, left_right, 'P6', cache)
+        for image in self.images:
+            self.assertEqual(opened.count(image), 1, image)
+        self.assertEqual(cache.reads, len(self.images))
+
+    def test_cached_blend_matches_uncached(self):
+        cache = PPMCodec.PPMCache()
+        for left_right in (True, False):
+            self.assertEqual(ImageUtils.create_blend_ppm(self.images, left_right, 'P6', cache),
+                             ImageUtils.create_blend_ppm(self.images, left_right, 'P6'))
+
+
+class SampleCheckTest(unittest.TestCase):
+    """
+    Counting ascii samples (see PPMCodec.check_samples) rejects exactly the tokens decoding them does
+    """
+    def test_check_agrees_with_decode(self):
+        for tokens in ([b'0', b'255'], [b'0042'], [b'256'], [b'+245'], [b'1_0'], [b'-0'], [b'1x'], [b'9999']):
+            try:
+                PPMCodec.decode_samples(tokens)
+                decoded = True
+            except ValueError:
+                decoded = False
+            try:
+                PPMCodec.check_samples(b' '.join(tokens), tokens)
+                checked = True
+            except ValueError:
+                checked = False
+            self.assertEqual(decoded, checked, tokens)
+
+    def test_undecodable_samples_have_their_own_code(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bad.ppm')
+            with open(path, 'wb') as file:
+                file.write(b'P3\n1 1\n255\n1 300 2\n')
+            for keep_pixels in (True, False):
+                codes = SanityChecks.valid_ppm(path, return_error_codes=True,
+                                               cache=PPMCodec.PPMCache(keep_pixels=keep_pixels))
+                self.assertEqual(codes, [SanityChecks.PPMCodes.BAD_SAMPLES])
+
+
+if __name__ == '__main__':
+    unittest.main()